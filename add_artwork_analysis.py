@@ -0,0 +1,48 @@
+"""
+Database migration script for the artwork alpha analysis
+This script adds the printable area and ink coverage columns to
+stored_asset; the image worker fills them in as it processes originals.
+It also drops effective_dpi, which an earlier version added: the DPI depends
+on each order item's print size, see StoredAsset.dpi_at
+"""
+import logging
+from app import app, db
+from sqlalchemy import text
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def migrate():
+    """Add the columns written by artwork_analysis"""
+    with app.app_context():
+        try:
+            conn = db.engine.connect()
+
+            # Make sure the catalog table exists before altering it
+            db.create_all()
+
+            statements = [
+                ("stored_asset.content_box", "ALTER TABLE stored_asset ADD COLUMN IF NOT EXISTS content_box JSON"),
+                ("stored_asset.ink_coverage", "ALTER TABLE stored_asset ADD COLUMN IF NOT EXISTS ink_coverage FLOAT"),
+                ("stored_asset.analyzed_at", "ALTER TABLE stored_asset ADD COLUMN IF NOT EXISTS analyzed_at TIMESTAMP WITH TIME ZONE"),
+            ]
+
+            for name, sql in statements:
+                logger.info("Adding column: %s", name)
+                conn.execute(text(sql))
+
+            logger.info("Dropping column: stored_asset.effective_dpi")
+            conn.execute(text("ALTER TABLE stored_asset DROP COLUMN IF EXISTS effective_dpi"))
+
+            # Commit the transaction
+            conn.commit()
+            conn.close()
+
+            logger.info("Successfully added the artwork analysis columns")
+
+        except Exception as e:
+            logger.error("Error adding the artwork analysis columns: %s", str(e))
+            raise
+
+if __name__ == "__main__":
+    migrate()
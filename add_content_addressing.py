@@ -0,0 +1,54 @@
+"""
+Database migration script for content-addressed artwork storage
+This script adds OrderItem.filename and StoredAsset.ref_count to existing tables
+and fills them in for orders created before uploads were deduplicated
+"""
+import logging
+from app import app, db
+from sqlalchemy import text
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def migrate():
+    """Add the columns used by content-addressed storage"""
+    with app.app_context():
+        try:
+            conn = db.engine.connect()
+
+            # Make sure the catalog table exists before altering it
+            db.create_all()
+
+            statements = [
+                # Older items were stored under their display name, so it doubles as filename
+                ("order_item.filename", "ALTER TABLE order_item ADD COLUMN IF NOT EXISTS filename VARCHAR(255)"),
+                ("stored_asset.ref_count", "ALTER TABLE stored_asset ADD COLUMN IF NOT EXISTS ref_count INTEGER NOT NULL DEFAULT 1"),
+            ]
+
+            for name, sql in statements:
+                logger.info("Adding column: %s", name)
+                conn.execute(text(sql))
+
+            result = conn.execute(text(
+                "UPDATE order_item SET filename = file_key WHERE filename IS NULL"))
+            logger.info("Filled in filename for %d order items", result.rowcount)
+
+            # Count the order items that use each stored file
+            result = conn.execute(text(
+                "UPDATE stored_asset SET ref_count = refs.count "
+                "FROM (SELECT file_key, COUNT(*) AS count FROM order_item GROUP BY file_key) AS refs "
+                "WHERE stored_asset.file_key = refs.file_key AND stored_asset.ref_count != refs.count"))
+            logger.info("Updated reference counts for %d stored assets", result.rowcount)
+
+            # Commit the transaction
+            conn.commit()
+            conn.close()
+
+            logger.info("Successfully migrated to content-addressed storage")
+
+        except Exception as e:
+            logger.error("Error migrating to content-addressed storage: %s", str(e))
+            raise
+
+if __name__ == "__main__":
+    migrate()
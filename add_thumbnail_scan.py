@@ -0,0 +1,29 @@
+"""
+Database migration script for the incremental thumbnail scan
+This script creates the scan_watermark and missing_derivatives tables used by
+thumbnail_scanner; the first scan starts at the orders of the last
+THUMBNAIL_SCAN_BACKFILL_HOURS
+"""
+import logging
+from app import app, db
+from models import MissingDerivatives, ScanWatermark
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def migrate():
+    """Create the tables written by thumbnail_scanner"""
+    with app.app_context():
+        try:
+            for model in (ScanWatermark, MissingDerivatives):
+                logger.info("Creating table: %s", model.__tablename__)
+                model.__table__.create(db.engine, checkfirst=True)
+
+            logger.info("Successfully created the thumbnail scan tables")
+
+        except Exception as e:
+            logger.error("Error creating the thumbnail scan tables: %s", str(e))
+            raise
+
+if __name__ == "__main__":
+    migrate()
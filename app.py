@@ -14,9 +14,14 @@ from sendgrid.helpers.mail import Mail as SGMail
 from io import BytesIO
 from sqlalchemy import create_engine
 from sqlalchemy.pool import QueuePool
-from storage import ObjectStorage
-import zipfile
+from storage import ObjectStorage, get_reader_size
+from storage_backends import CHUNK_SIZE
+from zip_stream import stream_zip
+from png_header import PNGHeaderError
+from artwork_analysis import AlphaAnalysis
 from werkzeug.serving import WSGIRequestHandler
+from werkzeug.wsgi import wrap_file
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
 from config import Config
 from PIL import Image
 import io
@@ -27,7 +32,9 @@ from apscheduler.schedulers.background import BackgroundScheduler
 import threading
 import queue
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from utils import generate_thumbnail, get_thumbnail_key
+from utils import (DERIVATIVE_SIZES, SUPPORTED_VARIANTS, VARIANT_FORMATS, closest_derivative, derivative_names,
+                   generate_derivatives, get_derivative_key, get_derivative_mimetype, get_thumbnail_key,
+                   variant_name)
 
 # Set longer timeout for the server
 WSGIRequestHandler.protocol_version = "HTTP/1.1"
@@ -45,6 +52,7 @@ login_manager = LoginManager()
 # Simple in-memory caches and queues to avoid repeated operations
 thumbnail_cache = {}  # filename -> bool (exists)
 thumbnail_generation_queue = queue.Queue()  # queue of file_keys to process
+queued_thumbnail_keys = set()  # file_keys in the queue or being processed, to skip duplicates
 thumbnail_queue_lock = threading.Lock()  # lock for thread safety
 MAX_CACHE_SIZE = 1000  # Maximum number of items to keep in cache
 
@@ -91,17 +99,90 @@ def add_cache_headers(response, content_type=None, etag_content=None):
         else:
             content_hash = hashlib.md5(str(etag_content).encode('utf-8')).hexdigest()
             
-        etag = f'W/"{content_hash}"'  # Use weak ETag
-        response.headers['ETag'] = etag
-        
-        # Check If-None-Match header for 304 response
-        if_none_match = request.headers.get('If-None-Match')
-        if if_none_match and if_none_match == etag:
-            response.status_code = 304  # Not Modified
-            response.data = b''  # No need to send content
+        response.set_etag(content_hash, weak=True)
+
+        # Answer a matching If-None-Match with 304; Werkzeug drops the body
+        # and closes the response itself
+        response.make_conditional(request)
     
     return response
 
+def get_storage_etag(filename):
+    """Return the strong ETag of a stored file from the asset catalog, or None if unknown"""
+    try:
+        asset = asset_catalog.lookup(filename)
+    except Exception as e:
+        logger.warning(f"Error reading asset catalog for {filename}: {str(e)}")
+        return None
+    if asset is not None and asset.content_hash:
+        return asset.content_hash
+    return None
+
+def stream_storage_file(filename, disposition='inline', download_name=None, cache_type=None, mimetype='image/png',
+                        etag=None, catalog=True):
+    """Stream a file from object storage to the client
+
+    The response body is read from storage in chunks while it is being sent,
+    so memory use stays flat no matter how large the file is.
+
+    Conditional and partial requests are answered without fetching the whole
+    object: when the asset catalog knows the content hash, If-None-Match is
+    checked before storage is touched, and Range/If-Range requests seek the
+    storage stream so only the requested bytes are read.
+
+    Args:
+        filename: Storage key of the file
+        disposition: 'inline' or 'attachment'
+        download_name: Filename for the Content-Disposition header (defaults to filename)
+        cache_type: Content type for add_cache_headers, or None for no cache headers
+        mimetype: MIME type of the file
+        etag: Strong ETag of the file if the caller knows it (e.g. StoredAsset.derivative_etag)
+        catalog: Look the ETag up in the asset catalog; only originals are cataloged,
+            so pass False for derivatives
+
+    Returns:
+        The streaming response, or None if the file could not be opened
+    """
+    if etag is None and catalog:
+        etag = get_storage_etag(filename)
+    if etag is not None and request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        if cache_type is not None:
+            response = add_cache_headers(response, content_type=cache_type)
+        return response
+
+    reader = storage.open_file(filename)
+    if reader is None:
+        return None
+
+    size = get_reader_size(reader)
+    response = Response(
+        wrap_file(request.environ, reader, CHUNK_SIZE),
+        mimetype=mimetype,
+        direct_passthrough=True,
+        headers={'Content-Disposition': f'{disposition}; filename={download_name or filename}'}
+    )
+    response.content_length = size
+
+    if etag is not None:
+        response.set_etag(etag)
+    else:
+        # Not cataloged: key and size identify the content well enough for
+        # revalidation, but not for If-Range, which needs a strong ETag
+        response.set_etag(hashlib.md5(f"{filename}:{size}".encode('utf-8')).hexdigest(), weak=True)
+    if cache_type is not None:
+        response = add_cache_headers(response, content_type=cache_type)
+
+    # Answers If-None-Match for uncataloged files and turns Range requests into
+    # 206 responses; the storage stream is closed with the response
+    try:
+        response.make_conditional(request, accept_ranges=True, complete_length=size)
+    except RequestedRangeNotSatisfiable:
+        response.close()
+        raise
+    return response
+
 # Cache for database queries to reduce repeated lookups
 order_cache = {}  # order_id -> (Order object, timestamp)
 order_cache_lock = threading.Lock()  # lock for thread safety
@@ -121,9 +202,13 @@ def check_thumbnail_exists(filename):
     if thumbnail_key in thumbnail_cache:
         return thumbnail_cache[thumbnail_key]
     
-    # If not in cache, check storage
+    # If not in cache, ask the asset catalog, then storage for uncataloged files
     try:
-        exists = storage.get_file(thumbnail_key) is not None
+        exists = asset_catalog.thumbnail_status(filename)
+        if exists is None:
+            exists = storage.file_exists(thumbnail_key)
+            if exists:
+                asset_catalog.record_thumbnail(filename, thumbnail_key)
         
         # Add to cache (with simple LRU-like behavior if cache is full)
         with thumbnail_queue_lock:
@@ -164,7 +249,8 @@ def queue_thumbnail_generation(file_key):
     else:
         # Legacy in-process queuing
         with thumbnail_queue_lock:
-            if file_key not in thumbnail_generation_queue.queue:
+            if file_key not in queued_thumbnail_keys:
+                queued_thumbnail_keys.add(file_key)
                 thumbnail_generation_queue.put(file_key)
                 logger.info(f"Queued thumbnail generation for {file_key}")
                 return True
@@ -189,71 +275,20 @@ def get_central_time():
     utc_dt = datetime.utcnow().replace(tzinfo=pytz.UTC)
     return utc_dt.astimezone(central)
 
-# Move the task definition before scheduler initialization
-def generate_thumbnails_task():
-    """Background task to pre-generate thumbnails for recent orders"""
+def drain_thumbnail_queue():
+    """Background task for the in-process fallback: scan for missing previews and generate them
+
+    With the worker, worker_manager schedules the same scan as a task. The
+    scan's watermark keeps concurrent runs from several web processes from
+    recording an item twice.
+    """
     with app.app_context():
         try:
-            # First, process any explicitly queued thumbnails (highest priority)
+            import thumbnail_scanner
+            thumbnail_scanner.scan()
+            for file_key in thumbnail_scanner.due(limit=20):
+                queue_thumbnail_generation(file_key)
             process_queued_thumbnails(max_items=10)
-
-            # Then check recent orders, but only process a limited number to avoid long-running tasks
-            # Use a shorter time window (24 hours instead of 7 days) to reduce load
-            recent_orders = Order.query.filter(
-                Order.created_at >= datetime.now() - timedelta(hours=24)
-            ).order_by(Order.created_at.desc()).all()
-
-            logger.info(f"Checking for missing thumbnails in {len(recent_orders)} recent orders")
-            
-            # Limit processing to 20 new thumbnails per run to avoid overwhelming the server
-            processed = 0
-            max_to_process = 20
-
-            for order in recent_orders:
-                if processed >= max_to_process:
-                    break
-                    
-                for item in order.items:
-                    if processed >= max_to_process:
-                        break
-                        
-                    thumbnail_key = get_thumbnail_key(item.file_key)
-                    
-                    # Check cache first, then storage
-                    if thumbnail_key in thumbnail_cache:
-                        if thumbnail_cache[thumbnail_key]:
-                            continue  # Skip if we know thumbnail exists
-                    
-                    # If not in cache or cache says it doesn't exist, try to generate it
-                    try:
-                        # Only check storage if not in cache
-                        if thumbnail_key not in thumbnail_cache:
-                            if storage.get_file(thumbnail_key):
-                                # Update cache since thumbnail exists
-                                with thumbnail_queue_lock:
-                                    thumbnail_cache[thumbnail_key] = True
-                                continue
-                        
-                        # Thumbnail doesn't exist, generate it
-                        file_data = storage.get_file(item.file_key)
-                        if file_data:
-                            thumb_data = generate_thumbnail(file_data)
-                            if thumb_data:
-                                storage.upload_file(BytesIO(thumb_data), thumbnail_key)
-                                logger.info(f"Generated thumbnail for {item.file_key}")
-                                
-                                # Update cache
-                                with thumbnail_queue_lock:
-                                    thumbnail_cache[thumbnail_key] = True
-                                    
-                                processed += 1
-                    except Exception as e:
-                        logger.error(f"Error processing thumbnail for {item.file_key}: {str(e)}")
-                        continue
-
-            if processed > 0:
-                logger.info(f"Generated {processed} thumbnails in background task")
-
         except Exception as e:
             logger.error(f"Error in thumbnail generation task: {str(e)}")
 
@@ -265,7 +300,11 @@ def process_queued_thumbnails(max_items=5):
         try:
             file_key = thumbnail_generation_queue.get(block=False)
             if file_key:
-                success = generate_thumbnail_for_file(file_key)
+                try:
+                    success = generate_thumbnail_for_file(file_key)
+                finally:
+                    with thumbnail_queue_lock:
+                        queued_thumbnail_keys.discard(file_key)
                 if success:
                     processed += 1
                     # Update cache
@@ -282,47 +321,109 @@ def process_queued_thumbnails(max_items=5):
     
     return processed
 
+def derivatives_complete(file_key, asset=None):
+    """Check whether every preview size of file_key exists
+
+    Answered from the asset catalog (asset, if the caller already loaded it).
+    Files that are not cataloged yet are checked in storage, and the previews
+    found are recorded.
+    """
+    if asset is not None:
+        return asset.has_derivatives(derivative_names())
+    status = asset_catalog.derivatives_status(file_key)
+    if status is not None:
+        return status
+
+    keys = {name: get_derivative_key(file_key, name) for name in derivative_names()}
+    probed = storage.exists_many(keys.values())
+    found = {name: (key, None) for name, key in keys.items() if probed.results.get(key)}
+    if found:
+        asset_catalog.record_derivatives(file_key, found)
+    return len(found) == len(keys)
+
+def store_derivatives(file_key, file_data):
+    """Generate every preview size of an original from one decode and upload them
+
+    The alpha analysis (printable area, ink coverage) is recorded from the same decode.
+    """
+    analysis = AlphaAnalysis()
+    derivatives = generate_derivatives(file_data, analysis=analysis)
+    if not derivatives:
+        logger.error(f"Failed to generate thumbnail data for {file_key}")
+        return False
+
+    keys = {name: get_derivative_key(file_key, name) for name in derivatives}
+    result = storage.put_many({keys[name]: data for name, data in derivatives.items()})
+    written = {name: (keys[name], len(data)) for name, data in derivatives.items()
+               if keys[name] in result.results}
+    if written:
+        asset_catalog.record_derivatives(file_key, written)
+    asset_catalog.record_analysis(file_key, analysis.result())
+
+    # Update cache
+    with thumbnail_queue_lock:
+        for derivative_key, _ in written.values():
+            thumbnail_cache[derivative_key] = True
+
+    for derivative_key, error in result.errors.items():
+        logger.error(f"Failed to upload thumbnail {derivative_key}: {error}")
+    return result.ok
+
 def generate_thumbnail_for_file(file_key):
-    """Generate and store thumbnail for a single file"""
+    """Generate and store the thumbnail and larger previews for a single file"""
     try:
-        thumbnail_key = get_thumbnail_key(file_key)
-        
-        # Check cache first
-        if thumbnail_key in thumbnail_cache and thumbnail_cache[thumbnail_key]:
-            return True  # Thumbnail already exists
-            
-        # Not in cache or cache says it doesn't exist, check storage
-        if check_thumbnail_exists(file_key):
-            return True  # Thumbnail exists in storage
-            
-        # Thumbnail doesn't exist, generate it
-        logger.info(f"Generating thumbnail for {file_key}")
+        # Check the catalog (or storage for files not cataloged yet)
+        if derivatives_complete(file_key):
+            return True  # All previews exist
+
+        # Previews missing, generate them
+        logger.info(f"Generating thumbnails for {file_key}")
         file_data = storage.get_file(file_key)
-        
+
         if file_data:
-            thumb_data = generate_thumbnail(file_data)
-            if thumb_data:
-                logger.info(f"Uploading thumbnail {thumbnail_key}")
-                storage.upload_file(BytesIO(thumb_data), thumbnail_key)
-                
-                # Update cache
-                with thumbnail_queue_lock:
-                    thumbnail_cache[thumbnail_key] = True
-                    
-                return True
-            else:
-                logger.error(f"Failed to generate thumbnail data for {file_key}")
+            return store_derivatives(file_key, file_data)
         else:
             logger.error(f"Could not retrieve original file {file_key}")
     except Exception as e:
         logger.error(f"Error generating thumbnail for {file_key}: {str(e)}")
-    
+
+    return False
+
+def generate_small_thumbnail(file_key):
+    """Generate only the PNG thumbnail of a file, for the upload request
+
+    The larger previews, their variants and the alpha analysis stay queued
+    for drain_thumbnail_queue, so the request never renders the full set.
+    """
+    try:
+        if check_thumbnail_exists(file_key):
+            return True
+
+        file_data = storage.get_file(file_key)
+        if not file_data:
+            logger.error(f"Could not retrieve original file {file_key}")
+            return False
+        derivatives = generate_derivatives(file_data, sizes={'thumbnail': DERIVATIVE_SIZES['thumbnail']}, formats=[])
+        if not derivatives:
+            logger.error(f"Failed to generate thumbnail data for {file_key}")
+            return False
+
+        thumbnail_key = get_thumbnail_key(file_key)
+        if not storage.upload_file(BytesIO(derivatives['thumbnail']), thumbnail_key):
+            return False
+        asset_catalog.record_derivatives(file_key, {'thumbnail': (thumbnail_key, len(derivatives['thumbnail']))})
+        with thumbnail_queue_lock:
+            thumbnail_cache[thumbnail_key] = True
+        return True
+    except Exception as e:
+        logger.error(f"Error generating thumbnail for {file_key}: {str(e)}")
     return False
 
-# Now initialize the scheduler
-scheduler = BackgroundScheduler()
-scheduler.add_job(generate_thumbnails_task, 'interval', hours=1)
-scheduler.start()
+# Without the worker, web processes drain their own thumbnail queue
+if not worker_client_available:
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(drain_thumbnail_queue, 'interval', hours=1)
+    scheduler.start()
 
 app = Flask(__name__)
 app.config.from_object('config.Config')
@@ -348,8 +449,11 @@ app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
 db.init_app(app)
 mail.init_app(app)
 
-from models import Order, OrderItem, User
-from utils import allowed_file, generate_order_number, calculate_cost, get_image_dimensions, generate_thumbnail, get_thumbnail_key
+from models import Order, OrderItem, User, StoredAsset
+from utils import allowed_file, generate_order_number, calculate_cost, get_image_dimensions, get_thumbnail_key
+import asset_catalog
+import nesting
+import ingest
 
 with app.app_context():
     db.create_all()
@@ -505,8 +609,34 @@ def view_order(order_id):
     if not order:
         flash('Order not found or database error occurred.')
         return redirect(url_for('admin'))
+
+    # Load the catalog entries for all items with one query
+    assets = asset_catalog.preload([item.file_key for item in order.items])
         
-    return render_template('order_detail.html', order=order)
+    return render_template('order_detail.html', order=order, assets=assets)
+
+@app.route('/admin/storage-stats')
+@login_required
+def storage_stats():
+    if not current_user.is_admin:
+        return jsonify({'error': 'Unauthorized access'}), 401
+    return jsonify({
+        'backend': storage.backend.name,
+        'healthy': storage.health_check(),
+        'cache': storage.cache_stats(),
+        # Per process: each gunicorn worker keeps its own breaker and counters
+        'resilience': storage.resilience_stats()
+    })
+
+@app.route('/admin/worker-status')
+@login_required
+def worker_status():
+    if not current_user.is_admin:
+        return jsonify({'error': 'Unauthorized access'}), 401
+    if not worker_client_available:
+        return jsonify({'error': 'Worker not available'}), 503
+    # Pool size, busy/idle workers and restarts from worker_manager
+    return jsonify(worker_client.get_worker_status())
 
 @app.route('/admin/order/<int:order_id>/status', methods=['POST'])
 @login_required
@@ -542,19 +672,13 @@ def get_order_image(order_id, filename):
     if not current_user.is_admin:
         flash('You do not have permission to access this page.')
         return redirect(url_for('index'))
-    file_data = storage.get_file(filename)
-    if file_data is None:
+    # Stream with cache headers and ETag support for better performance
+    response = stream_storage_file(filename, cache_type='image')
+    if response is None:
         logger.error(f"Image file not found in storage: {filename}")
         return "Image not found", 404
 
-    response = Response(
-        file_data,
-        mimetype='image/png',
-        headers={'Content-Disposition': f'inline; filename={filename}'}
-    )
-    
-    # Add cache headers with ETag support for better performance
-    return add_cache_headers(response, content_type='image', etag_content=file_data)
+    return response
 
 @app.route('/admin/order/<int:order_id>/download/<path:filename>')
 @login_required
@@ -563,36 +687,32 @@ def download_order_image(order_id, filename):
         flash('You do not have permission to access this page.')
         return redirect(url_for('index'))
     order = Order.query.get_or_404(order_id)
-    # Check if the order item exists using EXISTS (more efficient than first() or COUNT())
-    item_exists = db.session.query(db.exists().where(
-        (OrderItem.order_id == order_id) & (OrderItem.file_key == filename)
-    )).scalar()
-    
-    if not item_exists:
+    # Several items of an order can share one stored file, so the item is
+    # picked by id when given
+    item_query = OrderItem.query.filter_by(order_id=order_id, file_key=filename)
+    item_id = request.args.get('item', type=int)
+    if item_id is not None:
+        item_query = item_query.filter_by(id=item_id)
+    order_item = item_query.first()
+
+    if order_item is None:
         logger.error(f"Order item not found for file: {filename}")
         return "Image not found", 404
-        
-    # If item exists and we need its properties, then fetch it
-    order_item = OrderItem.query.filter_by(order_id=order_id, file_key=filename).first()
-
-    file_data = storage.get_file(filename)
-    if file_data is None:
-        logger.error(f"Image file not found in storage: {filename}")
-        return "Image not found", 404
 
-    # The filename already includes the quantity, so we can use it directly
-    download_filename = filename
+    # The display name already includes the quantity, so we can use it directly
+    download_filename = order_item.display_name
 
     # Prepend invoice number if it exists
     if order.invoice_number and order.invoice_number.strip():
         name, ext = os.path.splitext(download_filename)
         download_filename = f"{order.invoice_number}_{name}{ext}"
 
-    return Response(
-        file_data,
-        mimetype='image/png',
-        headers={'Content-Disposition': f'attachment; filename={download_filename}'}
-    )
+    response = stream_storage_file(filename, disposition='attachment', download_name=download_filename)
+    if response is None:
+        logger.error(f"Image file not found in storage: {filename}")
+        return "Image not found", 404
+
+    return response
 
 @app.route('/admin/order/<int:order_id>/download-all')
 @login_required
@@ -607,35 +727,25 @@ def download_all_images(order_id):
         # Fall back to direct query if cache fails
         order = Order.query.get_or_404(order_id)
 
-    # Create a zip file in memory
-    memory_file = BytesIO()
-    with zipfile.ZipFile(memory_file, 'w') as zf:
-        for item in order.items:
-            try:
-                file_data = storage.get_file(item.file_key)
-                if file_data:
-                    # Use the file_key directly as it already contains the sequence number and quantity
-                    zip_filename = item.file_key
-
-                    # Add invoice number to filename if it exists
-                    if order.invoice_number and order.invoice_number.strip():
-                        name, ext = os.path.splitext(zip_filename)
-                        zip_filename = f"{order.invoice_number}_{name}{ext}"
-
-                    # Add file to zip
-                    zf.writestr(zip_filename, file_data)
-            except Exception as e:
-                logger.error(f"Error adding {item.file_key} to zip: {str(e)}")
-                continue
+    # Use the item's display name as it already contains the sequence number and quantity
+    entries = []
+    for item in order.items:
+        zip_filename = item.display_name
+
+        # Add invoice number to filename if it exists
+        if order.invoice_number and order.invoice_number.strip():
+            name, ext = os.path.splitext(zip_filename)
+            zip_filename = f"{order.invoice_number}_{name}{ext}"
+
+        entries.append((item.file_key, zip_filename))
 
-    # Prepare zip file for download
-    memory_file.seek(0)
     zip_filename = f"order_{order.order_number}_files.zip"
     if order.invoice_number and order.invoice_number.strip():
         zip_filename = f"{order.invoice_number}_order_{order.order_number}_files.zip"
 
+    # Stream the archive while it is built, fetching the next files in parallel
     return Response(
-        memory_file.getvalue(),
+        stream_zip(storage, entries, prefetch=app.config['DOWNLOAD_ALL_PREFETCH']),
         mimetype='application/zip',
         headers={
             'Content-Disposition': f'attachment; filename={zip_filename}'
@@ -686,6 +796,58 @@ def bulk_status_update():
         return jsonify({'error': 'Failed to update orders'}), 500
 
 
+@app.route('/admin/gang-sheet', methods=['POST'])
+@login_required
+def gang_sheet_layout():
+    """Lay out the items of several orders on roll film (see nesting.py)
+
+    With render set, the image worker also renders the sheet to storage
+    (gang_sheet.py); the response has its storage key.
+    """
+    if not current_user.is_admin:
+        return jsonify({'error': 'Unauthorized access'}), 401
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Invalid request data'}), 400
+    order_ids = data.get('order_ids')
+    if (not isinstance(order_ids, list) or not order_ids
+            or not all(isinstance(order_id, int) and not isinstance(order_id, bool) for order_id in order_ids)):
+        return jsonify({'error': 'order_ids must be a non-empty list of order IDs'}), 400
+    dpi = data.get('dpi', 300)
+    if (isinstance(dpi, bool) or not isinstance(dpi, (int, float))
+            or not Config.GANG_SHEET_MIN_DPI <= dpi <= Config.GANG_SHEET_MAX_DPI):
+        return jsonify({'error': f"dpi must be a number from {Config.GANG_SHEET_MIN_DPI} "
+                                 f"to {Config.GANG_SHEET_MAX_DPI}"}), 400
+
+    items = OrderItem.query.filter(OrderItem.order_id.in_(order_ids)).order_by(OrderItem.id).all()
+    try:
+        layout = nesting.pack_items(
+            items,
+            roll_width=data.get('roll_width'),
+            spacing=data.get('spacing'),
+            allow_rotation=data.get('allow_rotation', True)
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    result = layout.to_dict()
+    for placement in result['placements']:
+        item = placement.pop('key')
+        placement.update({'item_id': item.id, 'order_id': item.order_id, 'file_key': item.file_key})
+    logger.info(f"Gang sheet for {len(items)} items: {layout.length:.1f}\" of film, "
+                f"{layout.efficiency:.1%} used")
+
+    if data.get('render'):
+        if not worker_client_available:
+            return jsonify({'error': 'The image worker is not available'}), 503
+        key = f"gang-sheets/{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.png"
+        if not worker_client.submit_gang_sheet_task(result['placements'], key, layout.roll_width,
+                                                    layout.length, dpi):
+            return jsonify({'error': 'Failed to queue the gang sheet'}), 500
+        result['sheet_key'] = key
+    return jsonify(result)
+
+
 @app.route('/admin/export')
 @login_required
 def export_orders():
@@ -756,62 +918,8 @@ def get_order_thumbnail(order_id, filename):
     if not current_user.is_admin:
         flash('You do not have permission to access this page.')
         return redirect(url_for('index'))
-    """Get thumbnail for order image, using pre-generated thumbnail if available"""
-    try:
-        thumbnail_key = get_thumbnail_key(filename)
-
-        # Try to get pre-generated thumbnail
-        try:
-            # Check cache first
-            if thumbnail_key in thumbnail_cache and thumbnail_cache[thumbnail_key]:
-                thumb_data = storage.get_file(thumbnail_key)
-                if thumb_data:
-                    return Response(
-                        thumb_data,
-                        mimetype='image/png',
-                        headers={'Content-Disposition': f'inline; filename={thumbnail_key}'}
-                    )
-            
-            # Not in cache or cache says it doesn't exist
-            if thumbnail_key not in thumbnail_cache:
-                thumb_data = storage.get_file(thumbnail_key)
-                if thumb_data:
-                    # Update cache since thumbnail exists
-                    with thumbnail_queue_lock:
-                        thumbnail_cache[thumbnail_key] = True
-                    
-                    return Response(
-                        thumb_data,
-                        mimetype='image/png',
-                        headers={'Content-Disposition': f'inline; filename={thumbnail_key}'}
-                    )
-        except Exception as e:
-            logger.debug(f"No pre-generated thumbnail found for {filename}: {str(e)}")
-
-        # If we get here, thumbnail doesn't exist - queue it for background generation
-        # and use the fallback image for now
-        queue_thumbnail_generation(filename)
-        
-        # Return the original image as fallback
-        # This avoids generating thumbnails on page load
-        file_data = storage.get_file(filename)
-        if file_data is None:
-            logger.error(f"Image file not found in storage: {filename}")
-            return "Image not found", 404
-
-        # Update cache to indicate thumbnail doesn't exist
-        with thumbnail_queue_lock:
-            thumbnail_cache[thumbnail_key] = False
-            
-        return Response(
-            file_data,  # Return the original image instead of generating a thumbnail on the fly
-            mimetype='image/png',
-            headers={'Content-Disposition': f'inline; filename={filename}'}
-        )
-
-    except Exception as e:
-        logger.error(f"Error in get_order_thumbnail: {str(e)}")
-        return str(e), 500
+    """Get thumbnail (or a larger preview with ?size=<pixels>) for order image, using pre-generated thumbnail if available"""
+    return serve_thumbnail(filename, request.args.get('size', type=int))
 
 @app.route('/get-dimensions', methods=['POST'])
 def get_dimensions():
@@ -823,11 +931,14 @@ def get_dimensions():
         return jsonify({'error': 'Invalid file'}), 400
 
     try:
+        # Reads only the PNG header, however large the file is
         width_inches, height_inches = get_image_dimensions(file)
         return jsonify({
             'width': width_inches,
             'height': height_inches
         })
+    except PNGHeaderError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error getting dimensions: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -931,8 +1042,6 @@ def order_history():
         orders = Order.query.filter_by(email=email).order_by(Order.created_at.desc()).all()
     return render_template('order_history.html', orders=orders, email=email)
 
-#Start scheduler after app initialization.  The scheduler is already started above.
-
 @app.template_filter('to_central')
 def to_central_filter(dt):
     """Convert UTC datetime to Central time"""
@@ -980,7 +1089,8 @@ def get_smart_image_url(order_id, filename, external=True, scheme='https'):
     """
     thumbnail_key = get_thumbnail_key(filename)
     try:
-        if storage.get_file(thumbnail_key):
+        # Answered from the catalog (preloaded per page where possible)
+        if check_thumbnail_exists(filename):
             return url_for('get_order_thumbnail', 
                          order_id=order_id, 
                          filename=filename, 
@@ -996,83 +1106,117 @@ def get_smart_image_url(order_id, filename, external=True, scheme='https'):
                   _external=external, 
                   _scheme=scheme)
 
-# Add new public routes for image access
-@app.route('/order/image/<path:filename>')
-def get_public_image(filename):
-    """Public access to order images"""
-    file_data = storage.get_file(filename)
-    if file_data is None:
-        logger.error(f"Image file not found in storage: {filename}")
-        return "Image not found", 404
+def accepted_variants():
+    """Variant formats the client accepts, most preferred first
 
-    response = Response(
-        file_data,
-        mimetype='image/png',
-        headers={'Content-Disposition': f'inline; filename={filename}'}
-    )
-    
-    # Add specific ETag for this image
-    return add_cache_headers(response, content_type='image', etag_content=file_data)
+    Only formats the Accept header names explicitly count, since browsers
+    send */* for images they can't decode too. Ties keep our own order
+    (AVIF before WebP, as it is smaller).
+    """
+    accepted = {value: quality for value, quality in request.accept_mimetypes}
+    formats = [fmt for fmt in SUPPORTED_VARIANTS if accepted.get(VARIANT_FORMATS[fmt][0], 0) > 0]
+    return sorted(formats, key=lambda fmt: -accepted[VARIANT_FORMATS[fmt][0]])
+
+def serve_thumbnail(filename, size=None):
+    """Serve the preview of an image closest to size pixels, falling back to the original
+
+    The asset catalog decides what to serve with one indexed query: the
+    smallest preview at least size pixels long, or failing that the next
+    larger one that exists, as AVIF or WebP if the Accept header allows
+    and PNG otherwise. Files that are not cataloged yet fall back to the
+    in-memory cache and storage. If the preview doesn't exist it is queued
+    for background generation and the original is streamed instead.
+    """
+    response = _serve_thumbnail(filename, size)
+    # The format depends on the Accept header, so shared caches must key on it
+    if isinstance(response, Response):
+        response.vary.add('Accept')
+    return response
 
-@app.route('/order/thumbnail/<path:filename>')
-def get_public_thumbnail(filename):
-    """Public access to image thumbnails"""
+def _serve_thumbnail(filename, size=None):
     try:
-        thumbnail_key = get_thumbnail_key(filename)
+        name = closest_derivative(size)
+        derivative_key = get_derivative_key(filename, name)
 
-        # Try to get pre-generated thumbnail
         try:
-            # Check cache first
-            if thumbnail_key in thumbnail_cache and thumbnail_cache[thumbnail_key]:
-                thumb_data = storage.get_file(thumbnail_key)
-                if thumb_data:
-                    return Response(
-                        thumb_data,
-                        mimetype='image/png',
-                        headers={'Content-Disposition': f'inline; filename={thumbnail_key}'}
-                    )
-            
-            # Not in cache or cache says it doesn't exist
-            if thumbnail_key not in thumbnail_cache:
-                thumb_data = storage.get_file(thumbnail_key)
-                if thumb_data:
-                    # Update cache since thumbnail exists
+            asset = asset_catalog.lookup(filename)
+        except Exception as e:
+            logger.warning(f"Error reading asset catalog for {filename}: {str(e)}")
+            asset = None
+
+        # Try to get pre-generated preview
+        try:
+            if asset is not None:
+                larger = [candidate for candidate in sorted(DERIVATIVE_SIZES, key=DERIVATIVE_SIZES.get)
+                          if DERIVATIVE_SIZES[candidate] >= DERIVATIVE_SIZES[name]]
+                formats = accepted_variants()
+                for candidate in larger:
+                    if not asset.has_derivative(candidate):
+                        continue
+                    choices = [variant_name(candidate, fmt) for fmt in formats] + [candidate]
+                    chosen = next(choice for choice in choices if asset.has_derivative(choice))
+                    exact = candidate == name
+                    response = stream_storage_file(asset.derivative_key(chosen),
+                                                   cache_type='thumbnail' if exact else None,
+                                                   mimetype=get_derivative_mimetype(chosen),
+                                                   etag=asset.derivative_etag(chosen), catalog=False)
+                    if response is not None:
+                        # Generate the missing size, or variants for older previews
+                        if not exact or chosen != choices[0]:
+                            queue_thumbnail_generation(filename)
+                        return response
+
+            # Not cataloged and not known to be missing
+            elif thumbnail_cache.get(derivative_key) is not False:
+                response = stream_storage_file(derivative_key, catalog=False)
+                if response is not None:
+                    # Update cache since preview exists
                     with thumbnail_queue_lock:
-                        thumbnail_cache[thumbnail_key] = True
-                    
-                    return Response(
-                        thumb_data,
-                        mimetype='image/png',
-                        headers={'Content-Disposition': f'inline; filename={thumbnail_key}'}
-                    )
+                        thumbnail_cache[derivative_key] = True
+
+                    return response
         except Exception as e:
             logger.debug(f"No pre-generated thumbnail found for {filename}: {str(e)}")
 
-        # If thumbnail doesn't exist, queue it for background generation
+        # If preview doesn't exist, queue it for background generation
         # and use the fallback image for now
         queue_thumbnail_generation(filename)
         
         # Return original image as fallback
         # This avoids generating thumbnails on page load
-        file_data = storage.get_file(filename)
-        if file_data is None:
+        response = stream_storage_file(filename)
+        if response is None:
             logger.error(f"Image file not found in storage: {filename}")
             return "Image not found", 404
 
-        # Update cache to indicate thumbnail doesn't exist
-        with thumbnail_queue_lock:
-            thumbnail_cache[thumbnail_key] = False
+        # Update cache to indicate preview doesn't exist
+        if asset is None:
+            with thumbnail_queue_lock:
+                thumbnail_cache[derivative_key] = False
             
-        return Response(
-            file_data,  # Return the original image instead of generating a thumbnail on the fly
-            mimetype='image/png',
-            headers={'Content-Disposition': f'inline; filename={filename}'}
-        )
+        return response  # Stream the original image instead of generating a thumbnail on the fly
 
     except Exception as e:
-        logger.error(f"Error in get_public_thumbnail: {str(e)}")
+        logger.error(f"Error serving thumbnail for {filename}: {str(e)}")
         return str(e), 500
 
+# Add new public routes for image access
+@app.route('/order/image/<path:filename>')
+def get_public_image(filename):
+    """Public access to order images"""
+    # Stream with a specific ETag for this image
+    response = stream_storage_file(filename, cache_type='image')
+    if response is None:
+        logger.error(f"Image file not found in storage: {filename}")
+        return "Image not found", 404
+
+    return response
+
+@app.route('/order/thumbnail/<path:filename>')
+def get_public_thumbnail(filename):
+    """Public access to image thumbnails and previews (?size=<pixels>)"""
+    return serve_thumbnail(filename, request.args.get('size', type=int))
+
 # Update the templates to use the new public routes
 def get_public_image_url(filename, external=True, scheme='https'):
     """Get the URL for public image access"""
@@ -1081,10 +1225,11 @@ def get_public_image_url(filename, external=True, scheme='https'):
                   _external=external, 
                   _scheme=scheme)
 
-def get_public_thumbnail_url(filename, external=True, scheme='https'):
-    """Get the URL for public thumbnail access"""
+def get_public_thumbnail_url(filename, size=None, external=True, scheme='https'):
+    """Get the URL for public thumbnail access, optionally for a larger preview size"""
     return url_for('get_public_thumbnail', 
                   filename=filename, 
+                  size=size,
                   _external=external, 
                   _scheme=scheme)
 
@@ -1201,17 +1346,27 @@ def upload_file():
             logger.info(f"Processing file: {new_filename}")
 
             try:
-                if not storage.upload_file(file, new_filename):
-                    error_msg = f"Failed to upload file {new_filename} to storage"
-                    logger.error(error_msg)
-                    raise Exception(error_msg)
-
-                logger.info(f"Successfully uploaded {new_filename} to storage")
-
-                # Create order item with new filename
+                # Validate, measure, hash and store the upload in one pipeline;
+                # artwork we already have is stored once and just referenced
+                try:
+                    ingested = ingest.ingest_upload(file, original_filename, storage)
+                except PNGHeaderError as e:
+                    return jsonify({
+                        'error': 'Invalid file',
+                        'details': f'File {file.filename} is not a valid PNG: {str(e)}'
+                    }), 400
+                except ingest.InvalidArtwork as e:
+                    return jsonify({
+                        'error': 'Invalid file',
+                        'details': f'File {file.filename} cannot be printed: {str(e)}'
+                    }), 400
+                file_key = ingested.file_key
+
+                # Create order item pointing at the shared blob
                 order_item = OrderItem(
                     order_id=order.id,
-                    file_key=new_filename,
+                    file_key=file_key,
+                    filename=new_filename,
                     width_inches=file_details.get('width', 0),
                     height_inches=file_details.get('height', 0),
                     quantity=file_details.get('quantity', 1),
@@ -1224,14 +1379,18 @@ def upload_file():
 
                 # Queue thumbnail generation instead of doing it synchronously
                 if request.form.get('is_last_file') == 'true':
-                    # Queue thumbnails for all items in the order
-                    for item in order.items:
-                        queue_thumbnail_generation(item.file_key)
-                        logger.info(f"Queued thumbnail generation for {item.file_key}")
-                    
-                    # Process a few thumbnails right away for the email preview
-                    # but limit to 3 max to avoid slowing down the response
-                    process_queued_thumbnails(max_items=3)
+                    # Queue thumbnails for all artwork in the order
+                    order_file_keys = list(dict.fromkeys(item.file_key for item in order.items))
+                    for file_key in order_file_keys:
+                        queue_thumbnail_generation(file_key)
+                        logger.info(f"Queued thumbnail generation for {file_key}")
+
+                    # Without the worker, make just the small thumbnails of the
+                    # first 3 files for the email preview; the rest of the
+                    # previews are left in the queue
+                    if not worker_client_available:
+                        for file_key in order_file_keys[:3]:
+                            generate_small_thumbnail(file_key)
 
                     # Now send the emails
                     if not send_order_emails(order):
@@ -1376,26 +1535,31 @@ def delete_orders():
         # Get all orders with their items
         orders = Order.query.filter(Order.id.in_(order_ids)).all()
 
-        # Collect all file keys to delete
-        file_keys = []
-        for order in orders:
-            for item in order.items:
-                # Add both the original file and its thumbnail
-                file_keys.append(item.file_key)
-                thumbnail_key = get_thumbnail_key(item.file_key)
-                file_keys.append(thumbnail_key)
-
-        # Delete files from storage
-        for file_key in file_keys:
-            try:
-                storage.delete_file(file_key)
-                logger.info(f"Deleted file: {file_key}")
-            except Exception as e:
-                logger.warning(f"Failed to delete file {file_key}: {str(e)}")
+        # Drop one reference per item; shared artwork still used by other
+        # orders is kept. The catalog rows stay locked until the commit below.
+        unreferenced = asset_catalog.release(
+            item.file_key for order in orders for item in order.items
+        )
 
-        # First delete all order items
+        # Collect the originals nobody uses any more with their thumbnails and other derivatives
+        file_keys = []
+        for file_key, asset in unreferenced.items():
+            file_keys.append(file_key)
+            file_keys.extend(get_derivative_key(file_key, name) for name in derivative_names())
+            if asset is not None:
+                file_keys.extend(entry['key'] for entry in (asset.derivatives or {}).values())
+        file_keys = list(dict.fromkeys(file_keys))
+
+        # Delete files from storage concurrently
+        result = storage.delete_many(file_keys)
+        logger.info(f"Deleted {len(result.results)} files from storage")
+        for file_key, error in result.errors.items():
+            logger.warning(f"Failed to delete file {file_key}: {error}")
+
+        # First delete all order items and their catalog entries
         for order in orders:
             OrderItem.query.filter_by(order_id=order.id).delete()
+        asset_catalog.remove(unreferenced, commit=False)
 
         # Then delete the orders
         deleted = Order.query.filter(Order.id.in_(order_ids)).delete(
@@ -0,0 +1,140 @@
+"""
+Alpha channel analysis of uploaded artwork.
+Production cares about the printable part of a transfer: the tight box
+around the non-transparent pixels and how much ink it takes. These are
+computed once in the image worker, while the original is decoded for its
+previews, and stored on the StoredAsset, so admin and pricing code read them
+from the catalog instead of opening the PNG again. The effective DPI depends
+on the size each order item prints at, so it is worked out per item from the
+pixel size instead (StoredAsset.dpi_at).
+
+The alpha channel is processed with NumPy one strip of rows at a time, the
+same strips image_decode uses for large images, so memory stays within one
+strip (IMAGE_DECODE_STRIP_MB) plus a row and a column of flags.
+"""
+
+import logging
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from config import Config
+from image_decode import ImageTooLarge, can_decode_strips, iter_decoded_strips
+from png_header import PNGHeaderError, read_png_header
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+
+class AlphaAnalysis:
+    """Accumulates alpha channel statistics of an image strip by strip
+
+    Strips must be added top to bottom and cover the whole image.
+    """
+
+    def __init__(self):
+        self.width = None
+        self.height = 0
+        self.alpha_sum = 0
+        self._columns = None  # Columns with at least one visible pixel
+        self.top = None
+        self.bottom = None
+
+    def add(self, strip):
+        """Add the next strip of rows (a PIL image of any mode)"""
+        width, rows = strip.size
+        if self.width is None:
+            self.width = width
+            self._columns = np.zeros(width, dtype=bool)
+
+        if 'A' not in strip.getbands():
+            # No alpha channel: every pixel prints
+            self._add_opaque(rows)
+            return
+
+        # Bound the temporary arrays of a full-size image to one strip each
+        rows_per_block = max(1, Config.IMAGE_DECODE_STRIP_MB * MB // max(width, 1))
+        for y in range(0, rows, rows_per_block):
+            block = strip if rows <= rows_per_block else strip.crop((0, y, width, min(y + rows_per_block, rows)))
+            alpha = np.asarray(block.getchannel('A'))
+            self.alpha_sum += int(alpha.sum(dtype=np.uint64))
+            visible = alpha > 0
+            self._columns |= visible.any(axis=0)
+            visible_rows = np.flatnonzero(visible.any(axis=1))
+            if visible_rows.size:
+                if self.top is None:
+                    self.top = self.height + int(visible_rows[0])
+                self.bottom = self.height + int(visible_rows[-1]) + 1
+            self.height += alpha.shape[0]
+
+    def _add_opaque(self, rows):
+        self._columns[:] = True
+        self.alpha_sum += 255 * self.width * rows
+        if self.top is None:
+            self.top = self.height
+        self.height += rows
+        self.bottom = self.height
+
+    @property
+    def content_box(self):
+        """(left, top, right, bottom) of the visible pixels, or None if there are none"""
+        if self.top is None:
+            return None
+        columns = np.flatnonzero(self._columns)
+        return int(columns[0]), self.top, int(columns[-1]) + 1, self.bottom
+
+    @property
+    def ink_coverage(self):
+        """Alpha-weighted share of the image that takes ink, in percent"""
+        if not self.width or not self.height:
+            return 0.0
+        return self.alpha_sum / (255 * self.width * self.height) * 100
+
+    def result(self):
+        """The figures stored on the StoredAsset"""
+        return {
+            'content_box': list(self.content_box) if self.content_box else None,
+            'ink_coverage': round(self.ink_coverage, 3),
+        }
+
+
+def analyze_image(image_data):
+    """Analyze an image without generating previews
+
+    PNGs the strip decoder can read are analyzed one strip at a time;
+    anything else is decoded in full, within the same pixel budget as
+    previews.
+
+    Args:
+        image_data: Image bytes or a seekable binary file object
+
+    Returns the result() dict.
+
+    Raises:
+        ImageTooLarge: The image is over the decode budget
+    """
+    source = BytesIO(image_data) if isinstance(image_data, (bytes, bytearray)) else image_data
+    analysis = AlphaAnalysis()
+    try:
+        info = read_png_header(source)
+    except PNGHeaderError:
+        info = None
+
+    if info is not None and info.width * info.height > Config.IMAGE_MAX_PIXELS:
+        raise ImageTooLarge(f"Image is {info.width}x{info.height} pixels, "
+                            f"over the limit of {Config.IMAGE_MAX_PIXELS} pixels")
+
+    if info is not None and can_decode_strips(info):
+        for strip in iter_decoded_strips(source, info):
+            analysis.add(strip)
+        return analysis.result()
+
+    if info is not None and info.width * info.height > Config.IMAGE_FULL_DECODE_PIXELS:
+        raise ImageTooLarge(f"Image is {info.width}x{info.height} pixels, too large to decode in full")
+    img = Image.open(source)
+    if img.mode not in ('RGBA', 'RGB'):
+        img = img.convert('RGBA')
+    analysis.add(img)
+    return analysis.result()
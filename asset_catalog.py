@@ -0,0 +1,326 @@
+"""
+Database catalog of the originals stored in object storage.
+Each StoredAsset row records an original's size, content hash, pixel size,
+DPI and which derivatives (thumbnail etc.) exist, so routes and templates can
+decide what to serve with one indexed query instead of probing storage. The
+image worker adds the printable area and ink coverage (artwork_analysis).
+
+Uploads are stored once per content under a content-addressed key
+(utils.get_content_key), so one entry can back many OrderItems. ref_count
+tracks how many; delete_orders only removes the blob and its derivatives when
+release() reports the last reference gone.
+
+The catalog is kept up to date on upload, thumbnail write and delete, and can
+be rebuilt from the bucket listing with reconcile_assets.py.
+
+All functions need an application context.
+"""
+
+import logging
+from collections import Counter
+from datetime import datetime
+from flask import g, has_request_context
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models import OrderItem, StoredAsset
+from utils import derivative_names, get_derivative_key
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL = 'thumbnail'
+
+
+def add_reference(file_key):
+    """Count one more OrderItem pointing at file_key
+
+    Returns False if file_key is not cataloged, in which case the caller
+    uploads the blob and calls record_upload(). The increment is a single
+    UPDATE, so it waits for a concurrent release() holding the row.
+    """
+    updated = StoredAsset.query.filter_by(file_key=file_key).update(
+        {StoredAsset.ref_count: StoredAsset.ref_count + 1}, synchronize_session=False
+    )
+    _forget_preloaded(file_key)
+    return updated > 0
+
+
+def record_upload(file_key, size_bytes=None, content_hash=None, width_px=None, height_px=None,
+                  dpi_x=None, dpi_y=None, commit=True):
+    """Create or update the catalog entry for an uploaded original
+
+    A new entry starts with one reference. If another request created the
+    entry for the same content at the same time, a reference is added to it.
+    """
+    asset = StoredAsset.query.filter_by(file_key=file_key).first()
+    if asset is None:
+        asset = StoredAsset(file_key=file_key, derivatives={}, ref_count=1)
+        try:
+            with db.session.begin_nested():
+                db.session.add(asset)
+        except IntegrityError:
+            add_reference(file_key)
+            asset = StoredAsset.query.filter_by(file_key=file_key).first()
+
+    asset.size_bytes = size_bytes
+    asset.content_hash = content_hash
+    asset.width_px = width_px
+    asset.height_px = height_px
+    asset.dpi_x = dpi_x
+    asset.dpi_y = dpi_y
+
+    if commit:
+        db.session.commit()
+    _forget_preloaded(file_key)
+    return asset
+
+
+def record_derivative(file_key, name, derivative_key, size_bytes=None, commit=True):
+    """Record that a derivative (e.g. the thumbnail) of file_key was written to storage"""
+    asset = StoredAsset.query.filter_by(file_key=file_key).first()
+    if asset is None:
+        asset = StoredAsset(file_key=file_key, derivatives={})
+        db.session.add(asset)
+
+    # Assign a new dict so SQLAlchemy notices the change to the JSON column
+    derivatives = dict(asset.derivatives or {})
+    derivatives[name] = {'key': derivative_key, 'size': size_bytes}
+    asset.derivatives = derivatives
+
+    if commit:
+        db.session.commit()
+    _forget_preloaded(file_key)
+    return asset
+
+
+def record_derivatives(file_key, derivatives, commit=True):
+    """Record several derivatives of file_key at once
+
+    Args:
+        derivatives: Mapping of derivative name -> (storage key, size in bytes or None)
+    """
+    asset = StoredAsset.query.filter_by(file_key=file_key).first()
+    if asset is None:
+        asset = StoredAsset(file_key=file_key, derivatives={})
+        db.session.add(asset)
+
+    updated = dict(asset.derivatives or {})
+    for name, (derivative_key, size_bytes) in derivatives.items():
+        updated[name] = {'key': derivative_key, 'size': size_bytes}
+    asset.derivatives = updated
+
+    if commit:
+        db.session.commit()
+    _forget_preloaded(file_key)
+    return asset
+
+
+def record_analysis(file_key, analysis, commit=True):
+    """Store the alpha analysis of file_key (artwork_analysis.AlphaAnalysis.result())
+
+    Returns the asset, or None if file_key is not cataloged.
+    """
+    asset = StoredAsset.query.filter_by(file_key=file_key).first()
+    if asset is None:
+        return None
+
+    asset.content_box = analysis['content_box']
+    asset.ink_coverage = analysis['ink_coverage']
+    asset.analyzed_at = datetime.utcnow()
+
+    if commit:
+        db.session.commit()
+    _forget_preloaded(file_key)
+    return asset
+
+
+def unanalyzed(file_keys):
+    """Return the cataloged keys among file_keys that have no alpha analysis yet"""
+    file_keys = list(set(file_keys))
+    if not file_keys:
+        return set()
+    rows = db.session.query(StoredAsset.file_key).filter(
+        StoredAsset.file_key.in_(file_keys), StoredAsset.analyzed_at.is_(None))
+    return {file_key for file_key, in rows}
+
+
+def record_thumbnail(file_key, thumbnail_key, size_bytes=None, commit=True):
+    """Record that the thumbnail of file_key was written to storage"""
+    return record_derivative(file_key, THUMBNAIL, thumbnail_key, size_bytes, commit)
+
+
+def release(file_keys):
+    """Drop one reference for every occurrence of a key in file_keys
+
+    The affected rows stay locked until the caller commits, so no upload can
+    take a new reference while the caller deletes the blobs. Returns the
+    {file_key: StoredAsset or None} of keys whose last reference is gone;
+    None means the key was never cataloged (items that predate the catalog
+    each have their own blob) and can be deleted as well.
+    """
+    counts = Counter(file_keys)
+    if not counts:
+        return {}
+    assets = StoredAsset.query.filter(StoredAsset.file_key.in_(list(counts))).with_for_update().all()
+    assets = {asset.file_key: asset for asset in assets}
+
+    unreferenced = {}
+    for file_key, count in counts.items():
+        asset = assets.get(file_key)
+        if asset is None:
+            unreferenced[file_key] = None
+            continue
+        asset.ref_count = max((asset.ref_count or 1) - count, 0)
+        if asset.ref_count == 0:
+            unreferenced[file_key] = asset
+        else:
+            logger.info(f"{file_key} is still used by {asset.ref_count} order items, keeping it")
+        _forget_preloaded(file_key)
+    return unreferenced
+
+
+def remove(file_keys, commit=True):
+    """Delete the catalog entries for deleted originals"""
+    file_keys = list(file_keys)
+    if not file_keys:
+        return 0
+    deleted = StoredAsset.query.filter(StoredAsset.file_key.in_(file_keys)).delete(
+        synchronize_session=False
+    )
+    if commit:
+        db.session.commit()
+    for file_key in file_keys:
+        _forget_preloaded(file_key)
+    return deleted
+
+
+def get_assets(file_keys):
+    """Return {file_key: StoredAsset} for the given keys using one query"""
+    file_keys = list(set(file_keys))
+    if not file_keys:
+        return {}
+    assets = StoredAsset.query.filter(StoredAsset.file_key.in_(file_keys)).all()
+    return {asset.file_key: asset for asset in assets}
+
+
+def preload(file_keys):
+    """Load catalog entries for a page in one query and keep them for the request
+
+    Later calls to lookup() during the same request are answered from memory.
+    """
+    assets = get_assets(file_keys)
+    if has_request_context():
+        preloaded = g.setdefault('asset_catalog', {})
+        for file_key in file_keys:
+            preloaded[file_key] = assets.get(file_key)
+    return assets
+
+
+def lookup(file_key):
+    """Return the StoredAsset for file_key, or None if it is not cataloged"""
+    if has_request_context():
+        preloaded = g.get('asset_catalog')
+        if preloaded is not None and file_key in preloaded:
+            return preloaded[file_key]
+    return StoredAsset.query.filter_by(file_key=file_key).first()
+
+
+def derivatives_status(file_key):
+    """Return True/False if the catalog knows whether file_key has every preview size, or None if unknown"""
+    asset = lookup(file_key)
+    if asset is None:
+        return None
+    return asset.has_derivatives(derivative_names())
+
+
+def thumbnail_status(file_key):
+    """Return True/False if the catalog knows whether file_key has a thumbnail, or None if unknown"""
+    asset = lookup(file_key)
+    if asset is None:
+        return None
+    return asset.has_derivative(THUMBNAIL)
+
+
+def _forget_preloaded(file_key):
+    """Drop a request-local preloaded entry after it changed"""
+    if has_request_context():
+        preloaded = g.get('asset_catalog')
+        if preloaded is not None:
+            preloaded.pop(file_key, None)
+
+
+def reconcile(storage, compute_hashes=False):
+    """Rebuild the catalog from the storage listing
+
+    Every OrderItem.file_key found in storage gets an entry with its size,
+    pixel size and DPI (and content hash if compute_hashes is set), its
+    reference count is set to the number of OrderItems using it, and its
+    derivative list is made to match the previews that actually exist.
+    Entries for originals that are no longer in storage are removed.
+
+    Returns a dict of counts.
+    """
+    from storage import get_reader_size, hash_file
+    from utils import read_image_info
+
+    stored_keys = set(storage.list_files())
+    references = dict(db.session.query(OrderItem.file_key, func.count(OrderItem.id)).group_by(OrderItem.file_key))
+    file_keys = set(references)
+    assets = get_assets(file_keys)
+    counts = {'added': 0, 'updated': 0, 'removed': 0, 'missing': 0}
+
+    for file_key in sorted(file_keys):
+        asset = assets.get(file_key)
+        if file_key not in stored_keys:
+            counts['missing'] += 1
+            if asset is not None:
+                db.session.delete(asset)
+                counts['removed'] += 1
+            continue
+
+        if asset is None:
+            asset = StoredAsset(file_key=file_key, derivatives={})
+            db.session.add(asset)
+            counts['added'] += 1
+        else:
+            counts['updated'] += 1
+        asset.ref_count = references[file_key]
+
+        if asset.size_bytes is None or asset.width_px is None or (compute_hashes and not asset.content_hash):
+            reader = storage.open_file(file_key)
+            if reader is not None:
+                with reader:
+                    asset.size_bytes = get_reader_size(reader)
+                    try:
+                        info = read_image_info(reader)
+                        asset.width_px = info['width_px']
+                        asset.height_px = info['height_px']
+                        asset.dpi_x = info['dpi_x']
+                        asset.dpi_y = info['dpi_y']
+                    except Exception as e:
+                        logger.warning(f"Could not read image header for {file_key}: {str(e)}")
+                    if compute_hashes:
+                        asset.content_hash, _ = hash_file(reader)
+
+        derivatives = dict(asset.derivatives or {})
+        for name in derivative_names():
+            derivative_key = get_derivative_key(file_key, name)
+            if derivative_key in stored_keys:
+                derivatives.setdefault(name, {'key': derivative_key, 'size': None})
+            else:
+                derivatives.pop(name, None)
+        asset.derivatives = derivatives
+
+        db.session.commit()
+
+    # Entries whose original no longer belongs to any order item
+    orphans = StoredAsset.query.filter(~StoredAsset.file_key.in_(file_keys)).all() if file_keys else StoredAsset.query.all()
+    for asset in orphans:
+        if asset.file_key not in stored_keys:
+            db.session.delete(asset)
+            counts['removed'] += 1
+    db.session.commit()
+
+    logger.info(f"Asset catalog reconciled: {counts}")
+    return counts
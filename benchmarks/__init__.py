@@ -0,0 +1,6 @@
+"""
+Benchmark scripts for Apparel Decorating Network.
+Run from the project root, for example:
+
+    python -m benchmarks.storage --backend memory --latency 0.05
+"""
@@ -0,0 +1,81 @@
+"""
+Shared helpers for the benchmark scripts: timing statistics, synthetic PNG
+payloads and report output.
+"""
+
+import json
+import math
+import random
+import struct
+import zlib
+
+MB = 1024 * 1024
+
+
+def percentile(values, pct):
+    """Return the pct-th percentile of values using the nearest-rank method"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(latencies, total_bytes=0):
+    """Summarize a list of per-call latencies (seconds)"""
+    total_time = sum(latencies)
+    summary = {
+        'calls': len(latencies),
+        'total_seconds': round(total_time, 4),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'ops_per_second': round(len(latencies) / total_time, 2) if total_time else 0.0,
+    }
+    if total_bytes:
+        summary['mb_per_second'] = round(total_bytes / MB / total_time, 2) if total_time else 0.0
+    return summary
+
+
+def png_chunk(chunk_type, data):
+    """Encode one PNG chunk"""
+    crc = zlib.crc32(chunk_type + data) & 0xffffffff
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', crc)
+
+
+def make_png_payload(size_bytes, width=1024, dpi=300, seed=0):
+    """Build a valid RGBA PNG of roughly size_bytes
+
+    The pixel data is random and stored without compression, which is the
+    worst case for storage transfer and matches the size of real DTF artwork.
+    """
+    rng = random.Random(seed)
+    row_bytes = 1 + width * 4
+    height = max(1, size_bytes // row_bytes)
+    ppm = round(dpi / 0.0254)
+
+    raw = bytearray()
+    for _ in range(height):
+        raw += b'\x00' + rng.randbytes(width * 4)
+
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)),
+        png_chunk(b'pHYs', struct.pack('>IIB', ppm, ppm, 1)),
+        png_chunk(b'IDAT', zlib.compress(bytes(raw), 0)),
+        png_chunk(b'IEND', b''),
+    ])
+
+
+def print_table(rows, columns):
+    """Print a list of dicts as an aligned text table"""
+    widths = {col: max(len(col), *(len(str(row.get(col, ''))) for row in rows)) for col in columns}
+    print('  '.join(col.ljust(widths[col]) for col in columns))
+    for row in rows:
+        print('  '.join(str(row.get(col, '')).ljust(widths[col]) for col in columns))
+
+
+def write_report(path, report):
+    """Write a benchmark report as JSON"""
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote report to {path}")
@@ -0,0 +1,215 @@
+"""
+Reproducible corpus of synthetic DTF artwork for the image benchmarks.
+
+Every image is described by its color mode, DPI, physical size (longest
+side, up to 22"), transparency pattern and zlib compression level, and is
+generated from a seed, so the same spec always gives the same PNG. Files are
+written once to a corpus directory and reused by later runs.
+
+Patterns:
+    solid     opaque shapes on a white background
+    cutout    opaque shapes on a transparent background (typical DTF artwork)
+    gradient  shapes with soft, partially transparent edges and fades
+    photo     incompressible noise inside a cutout, like a photographic print
+
+Examples:
+    python -m benchmarks.corpus --profile quick
+    python -m benchmarks.corpus --modes RGBA --dpis 300 --inches 22 --patterns photo
+"""
+
+import argparse
+import itertools
+import json
+import random
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageFilter
+
+DEFAULT_DIR = '/tmp/dtf-corpus'
+
+PATTERNS = ('solid', 'cutout', 'gradient', 'photo')
+
+PROFILES = {
+    'quick': {
+        'modes': ['RGBA', 'RGB'],
+        'dpis': [300],
+        'inches': [4, 11, 22],
+        'patterns': ['cutout', 'gradient'],
+        'compress_levels': [6],
+    },
+    'full': {
+        'modes': ['RGBA', 'RGB'],
+        'dpis': [150, 300, 600],
+        'inches': [2, 6, 11, 22],
+        'patterns': list(PATTERNS),
+        'compress_levels': [1, 6, 9],
+    },
+}
+
+# Height as a fraction of width, so both orientations appear in the corpus
+ASPECTS = (0.75, 1.4)
+
+
+class ImageSpec:
+    """Parameters of one synthetic image"""
+
+    def __init__(self, mode, dpi, inches, pattern, compress_level, seed=0):
+        self.mode = mode
+        self.dpi = dpi
+        self.inches = inches
+        self.pattern = pattern
+        self.compress_level = compress_level
+        self.seed = seed
+
+    @property
+    def name(self):
+        return (f"{self.mode.lower()}-{self.pattern}-{self.dpi}dpi-{self.inches}in-"
+                f"z{self.compress_level}-s{self.seed}.png")
+
+    @property
+    def size(self):
+        """Pixel (width, height); the longest side is inches * dpi"""
+        longest = round(self.inches * self.dpi)
+        aspect = ASPECTS[self.seed % len(ASPECTS)]
+        if aspect < 1:
+            return longest, max(1, round(longest * aspect))
+        return max(1, round(longest / aspect)), longest
+
+    def to_dict(self):
+        width, height = self.size
+        return {
+            'name': self.name,
+            'mode': self.mode,
+            'dpi': self.dpi,
+            'inches': self.inches,
+            'pattern': self.pattern,
+            'compress_level': self.compress_level,
+            'seed': self.seed,
+            'width_px': width,
+            'height_px': height,
+        }
+
+
+def specs_for(modes, dpis, inches, patterns, compress_levels, seed=0):
+    """Every combination of the given parameters, skipping solid RGBA (same as RGB)"""
+    specs = []
+    for index, (mode, dpi, size, pattern, level) in enumerate(
+            itertools.product(modes, dpis, inches, patterns, compress_levels)):
+        if mode == 'RGBA' and pattern == 'solid':
+            continue
+        specs.append(ImageSpec(mode, dpi, size, pattern, level, seed + index))
+    return specs
+
+
+def render(spec):
+    """Draw the image described by spec"""
+    width, height = spec.size
+    rng = random.Random(spec.seed)
+    background = (255, 255, 255, 255) if spec.pattern == 'solid' else (0, 0, 0, 0)
+    img = Image.new('RGBA', (width, height), background)
+
+    if spec.pattern == 'photo':
+        # Noise inside a large cutout shape
+        noise = Image.frombytes('RGB', (width, height), rng.randbytes(width * height * 3))
+        mask = Image.new('L', (width, height), 0)
+        ImageDraw.Draw(mask).ellipse([width // 10, height // 10, width * 9 // 10, height * 9 // 10], fill=255)
+        img.paste(noise, (0, 0), mask)
+    else:
+        draw = ImageDraw.Draw(img)
+        scale = max(width, height)
+        for _ in range(120):
+            x, y = rng.randrange(width), rng.randrange(height)
+            w = rng.randrange(max(2, scale // 80), max(3, scale // 5))
+            h = rng.randrange(max(2, scale // 80), max(3, scale // 5))
+            color = (rng.randrange(256), rng.randrange(256), rng.randrange(256), 255)
+            shape = rng.random()
+            if shape < 0.4:
+                draw.ellipse([x, y, x + w, y + h], fill=color)
+            elif shape < 0.7:
+                draw.rectangle([x, y, x + w, y + h], fill=color)
+            else:
+                draw.line([x, y, x + w, y + h], fill=color, width=max(1, scale // 200))
+
+        if spec.pattern == 'gradient':
+            # Soft edges plus a fade across the image
+            alpha = img.getchannel('A').filter(ImageFilter.GaussianBlur(max(1, scale // 300)))
+            fade = Image.linear_gradient('L').resize((width, height))
+            img.putalpha(Image.composite(alpha, Image.new('L', (width, height), 0), fade))
+
+    if spec.mode != 'RGBA':
+        img = img.convert(spec.mode)
+    return img
+
+
+def build(specs, directory=DEFAULT_DIR, log=print):
+    """Write every spec that isn't in directory yet
+
+    Returns a manifest: one dict per image with its spec, path and file size.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    manifest = []
+    for spec in specs:
+        path = directory / spec.name
+        if not path.exists():
+            log(f"Generating {spec.name}")
+            tmp = path.with_suffix('.tmp')
+            render(spec).save(tmp, 'PNG', dpi=(spec.dpi, spec.dpi), compress_level=spec.compress_level)
+            tmp.replace(path)
+        entry = spec.to_dict()
+        entry.update({'path': str(path), 'file_bytes': path.stat().st_size})
+        manifest.append(entry)
+    return manifest
+
+
+def add_arguments(parser):
+    """Add the corpus selection options to an argparse parser"""
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='quick',
+                        help='Preset corpus; the options below override parts of it')
+    parser.add_argument('--corpus-dir', default=DEFAULT_DIR, help='Where generated images are kept')
+    parser.add_argument('--modes', help='Comma-separated color modes (RGBA,RGB)')
+    parser.add_argument('--dpis', help='Comma-separated DPIs')
+    parser.add_argument('--inches', help='Comma-separated longest sides in inches (max 22)')
+    parser.add_argument('--patterns', help=f"Comma-separated patterns ({','.join(PATTERNS)})")
+    parser.add_argument('--compress-levels', help='Comma-separated zlib levels (0-9)')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def specs_from_args(args):
+    """The specs selected by the options of add_arguments"""
+    profile = dict(PROFILES[args.profile])
+    if args.modes:
+        profile['modes'] = args.modes.split(',')
+    if args.dpis:
+        profile['dpis'] = [int(d) for d in args.dpis.split(',')]
+    if args.inches:
+        profile['inches'] = [float(i) if '.' in i else int(i) for i in args.inches.split(',')]
+    if args.patterns:
+        profile['patterns'] = args.patterns.split(',')
+    if args.compress_levels:
+        profile['compress_levels'] = [int(z) for z in args.compress_levels.split(',')]
+
+    if max(profile['inches']) > 22:
+        raise SystemExit("Artwork is at most 22 inches")
+    unknown = set(profile['patterns']) - set(PATTERNS)
+    if unknown:
+        raise SystemExit(f"Unknown patterns: {', '.join(sorted(unknown))}")
+    return specs_for(seed=args.seed, **profile)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    parser.add_argument('--json', help='Write the manifest to this JSON file')
+    args = parser.parse_args()
+
+    manifest = build(specs_from_args(args), args.corpus_dir)
+    total = sum(entry['file_bytes'] for entry in manifest)
+    print(f"{len(manifest)} images, {total / 1024 / 1024:.1f} MB in {args.corpus_dir}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
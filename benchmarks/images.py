@@ -0,0 +1,157 @@
+"""
+Image pipeline benchmark.
+
+Runs the image functions of utils over a reproducible synthetic DTF corpus
+(see benchmarks/corpus.py) and reports throughput, p50/p99 latency and peak
+RSS per function, overall and per image. The JSON report records the commit
+and library versions so runs can be compared between commits.
+
+Examples:
+    python -m benchmarks.images --json before.json
+    python -m benchmarks.images --json after.json --compare before.json
+    python -m benchmarks.images --profile full --functions generate_derivatives --iterations 1
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import time
+from io import BytesIO
+
+import PIL
+
+from benchmarks import corpus
+from benchmarks.common import print_table, summarize, write_report
+from image_decode import peak_memory_bytes, reset_peak_memory
+from utils import DERIVATIVE_SIZES, calculate_cost, generate_derivatives, get_image_dimensions, validate_image
+
+MB = 1024 * 1024
+
+# Name -> (function of (image bytes, manifest entry), calls per image and iteration)
+FUNCTIONS = {
+    'get_image_dimensions': (lambda data, entry: get_image_dimensions(BytesIO(data)), 100),
+    'validate_image': (lambda data, entry: validate_image(BytesIO(data)), 100),
+    'calculate_cost': (lambda data, entry: calculate_cost(entry['width_px'] / entry['dpi'],
+                                                          entry['height_px'] / entry['dpi']), 1000),
+    # The thumbnail size alone, through the same code path as every preview
+    'thumbnail': (lambda data, entry: generate_derivatives(
+        data, sizes={'thumbnail': DERIVATIVE_SIZES['thumbnail']}), 1),
+    'generate_derivatives': (lambda data, entry: generate_derivatives(data), 1),
+}
+
+
+def git_commit():
+    """Current commit hash, or None outside a git checkout"""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_function(name, manifest, iterations):
+    """Run one function over the whole corpus
+
+    Returns (summary row, per-image rows).
+    """
+    func, repeat = FUNCTIONS[name]
+    peak_is_per_function = reset_peak_memory()
+    latencies = []
+    total_bytes = 0
+    per_image = []
+    for entry in manifest:
+        with open(entry['path'], 'rb') as f:
+            data = f.read()
+        image_latencies = []
+        for _ in range(iterations * repeat):
+            start = time.perf_counter()
+            func(data, entry)
+            image_latencies.append(time.perf_counter() - start)
+        latencies.extend(image_latencies)
+        total_bytes += len(data) * len(image_latencies)
+        row = {'function': name, 'image': entry['name']}
+        row.update(summarize(image_latencies, len(data) * len(image_latencies)))
+        per_image.append(row)
+        del data
+
+    peak = peak_memory_bytes()
+    row = {'function': name, 'images': len(manifest)}
+    row.update(summarize(latencies, total_bytes))
+    row['peak_rss_mb'] = round(peak / MB, 1) if peak is not None else None
+    row['peak_is_per_function'] = peak_is_per_function
+    return row, per_image
+
+
+def compare(rows, baseline_path):
+    """Print p50 latency and peak RSS against an earlier report"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    before = {row['function']: row for row in baseline['results']}
+    comparison = []
+    for row in rows:
+        old = before.get(row['function'])
+        if old is None:
+            continue
+        comparison.append({
+            'function': row['function'],
+            'p50_ms_before': old['p50_ms'],
+            'p50_ms_after': row['p50_ms'],
+            'p50_change': f"{(row['p50_ms'] / old['p50_ms'] - 1) * 100:+.1f}%" if old['p50_ms'] else '',
+            'peak_rss_mb_before': old.get('peak_rss_mb'),
+            'peak_rss_mb_after': row.get('peak_rss_mb'),
+        })
+    print(f"\nCompared with {baseline_path} (commit {baseline.get('commit') or 'unknown'}):")
+    print_table(comparison, ['function', 'p50_ms_before', 'p50_ms_after', 'p50_change',
+                             'peak_rss_mb_before', 'peak_rss_mb_after'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    corpus.add_arguments(parser)
+    parser.add_argument('--functions', default=','.join(FUNCTIONS),
+                        help=f"Comma-separated functions ({','.join(FUNCTIONS)})")
+    parser.add_argument('--iterations', type=int, default=3, help='Passes over the corpus per function')
+    parser.add_argument('--per-image', action='store_true', help='Also print the per-image table')
+    parser.add_argument('--json', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='Earlier JSON report to compare against')
+    args = parser.parse_args()
+
+    names = args.functions.split(',')
+    unknown = set(names) - set(FUNCTIONS)
+    if unknown:
+        raise SystemExit(f"Unknown functions: {', '.join(sorted(unknown))}")
+
+    manifest = corpus.build(corpus.specs_from_args(args), args.corpus_dir)
+
+    rows = []
+    per_image = []
+    for name in names:
+        row, image_rows = run_function(name, manifest, args.iterations)
+        rows.append(row)
+        per_image.extend(image_rows)
+
+    print_table(rows, ['function', 'images', 'calls', 'p50_ms', 'p99_ms', 'ops_per_second', 'mb_per_second',
+                       'peak_rss_mb'])
+    if args.per_image:
+        print()
+        print_table(per_image, ['function', 'image', 'calls', 'p50_ms', 'p99_ms', 'mb_per_second'])
+    if args.compare:
+        compare(rows, args.compare)
+
+    if args.json:
+        write_report(args.json, {
+            'benchmark': 'images',
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'profile': args.profile,
+            'iterations': args.iterations,
+            'corpus': manifest,
+            'results': rows,
+            'per_image': per_image,
+        })
+
+
+if __name__ == '__main__':
+    main()
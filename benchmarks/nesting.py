@@ -0,0 +1,132 @@
+"""
+Gang-sheet nesting benchmark.
+
+Packs synthetic workloads onto a roll with nesting.pack and with a simple
+shelf layout (rows of pieces, tallest first, roughly what a manual layout
+looks like), and reports film length, packing efficiency and runtime.
+
+Workloads:
+    uniform   random sizes up to the roll width, one copy each
+    logos     many copies of a few small sizes (left chest, sleeves, tags)
+    orders    real-shaped shop orders: a mix of chest logos, full fronts,
+              backs and sleeves in typical quantities
+
+Examples:
+    python -m benchmarks.nesting
+    python -m benchmarks.nesting --pieces 5000 --spacing 0.5 --json nesting.json
+"""
+
+import argparse
+import random
+import time
+
+from benchmarks.common import print_table, write_report
+from nesting import Piece, pack
+
+# (width, height) in inches of common DTF print locations, with how often they're ordered
+ORDER_SIZES = [
+    ((3.5, 3.5), 30),   # Left chest
+    ((4.0, 2.5), 10),   # Left chest, wide
+    ((11.0, 11.0), 20),  # Full front
+    ((11.0, 14.0), 15),  # Full front, tall
+    ((12.0, 16.0), 10),  # Back
+    ((3.0, 11.0), 8),   # Sleeve
+    ((2.5, 1.5), 7),    # Neck tag
+    ((8.0, 10.0), 10),  # Youth front
+]
+
+
+def uniform_workload(count, roll_width, rng):
+    return [Piece(i, round(rng.uniform(1, roll_width), 2), round(rng.uniform(1, roll_width), 2))
+            for i in range(count)]
+
+
+def logos_workload(count, roll_width, rng):
+    sizes = [(3.5, 3.5), (3.0, 11.0), (2.5, 1.5), (4.0, 4.0)]
+    return [Piece(i % 4, *sizes[i % 4]) for i in range(count)]
+
+
+def orders_workload(count, roll_width, rng):
+    """Items of typical sizes, each ordered in a typical quantity, up to count pieces"""
+    sizes, weights = zip(*ORDER_SIZES)
+    pieces = []
+    item = 0
+    while len(pieces) < count:
+        width, height = rng.choices(sizes, weights)[0]
+        # Customers resize artwork a little
+        scale = rng.choice([1.0, 1.0, 0.9, 0.8, 1.1])
+        width, height = round(min(width * scale, roll_width), 2), round(height * scale, 2)
+        quantity = rng.choice([1, 2, 5, 10, 12, 24, 50])
+        pieces.extend(Piece(item, width, height) for _ in range(min(quantity, count - len(pieces))))
+        item += 1
+    return pieces
+
+
+WORKLOADS = {
+    'uniform': uniform_workload,
+    'logos': logos_workload,
+    'orders': orders_workload,
+}
+
+
+def shelf_length(pieces, roll_width, spacing):
+    """Film length of a row-by-row layout, tallest pieces first, no rotation"""
+    ordered = sorted(pieces, key=lambda p: p.height, reverse=True)
+    length = 0.0
+    row_height = 0.0
+    x = 0.0
+    for piece in ordered:
+        if x and x + piece.width > roll_width:
+            length += row_height + spacing
+            x = 0.0
+            row_height = 0.0
+        x += piece.width + spacing
+        row_height = max(row_height, piece.height)
+    return length + row_height
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pieces', default='100,1000,5000', help='Comma-separated piece counts')
+    parser.add_argument('--workloads', default=','.join(WORKLOADS), help='Comma-separated workloads')
+    parser.add_argument('--roll-width', type=float, default=22.0)
+    parser.add_argument('--spacing', type=float, default=0.25)
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per case; the fastest is reported')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    rows = []
+    for name in args.workloads.split(','):
+        for count in [int(c) for c in args.pieces.split(',')]:
+            pieces = WORKLOADS[name](count, args.roll_width, random.Random(args.seed))
+            area = sum(p.width * p.height for p in pieces)
+            shelf = shelf_length(pieces, args.roll_width, args.spacing)
+            row = {
+                'workload': name,
+                'pieces': len(pieces),
+                'min_length_in': round(area / args.roll_width, 1),
+                'shelf_length_in': round(shelf, 1),
+                'shelf_efficiency': round(area / (args.roll_width * shelf), 3),
+            }
+            for rotate in (False, True):
+                times = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    layout = pack(pieces, args.roll_width, args.spacing, allow_rotation=rotate)
+                    times.append(time.perf_counter() - start)
+                suffix = '_rotate' if rotate else ''
+                row[f'length_in{suffix}'] = round(layout.length, 1)
+                row[f'efficiency{suffix}'] = round(layout.efficiency, 3)
+                row[f'ms{suffix}'] = round(min(times) * 1000, 1)
+            rows.append(row)
+
+    print_table(rows, ['workload', 'pieces', 'min_length_in', 'shelf_length_in', 'shelf_efficiency',
+                       'length_in', 'efficiency', 'ms', 'length_in_rotate', 'efficiency_rotate', 'ms_rotate'])
+    if args.json:
+        write_report(args.json, {'benchmark': 'nesting', 'roll_width': args.roll_width,
+                                 'spacing': args.spacing, 'results': rows})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+PNG header benchmark.
+
+Compares reading pixel size and DPI with png_header.read_png_header against
+opening the file with PIL (the path get_image_dimensions used before) on
+large DTF-sized PNGs, and reports latency and bytes read per call.
+
+Examples:
+    python -m benchmarks.png_header
+    python -m benchmarks.png_header --sizes 8,32,64 --iterations 50 --json png_header.json
+"""
+
+import argparse
+import io
+import tempfile
+import time
+
+from PIL import Image
+
+from benchmarks.common import MB, make_png_payload, print_table, summarize, write_report
+from png_header import read_png_header
+
+
+class CountingReader(io.RawIOBase):
+    """Seekable file wrapper that counts the bytes actually read"""
+
+    def __init__(self, f):
+        self.f = f
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.f.seek(offset, whence)
+
+    def tell(self):
+        return self.f.tell()
+
+    def readinto(self, buffer):
+        n = self.f.readinto(buffer)
+        self.bytes_read += n
+        return n
+
+
+def header_path(f):
+    info = read_png_header(f)
+    return info.width, info.height, info.dpi_or_default
+
+
+def pil_path(f):
+    # The old approach: open with PIL and load to read the mode reliably
+    with Image.open(f) as img:
+        img.load()
+        return img.size[0], img.size[1], img.info.get('dpi', (96, 96))
+
+
+METHODS = {
+    'png_header': header_path,
+    'pil': pil_path,
+}
+
+
+def run_size(path, size_mb, payload_bytes, iterations):
+    """Benchmark every method against one file"""
+    rows = []
+    expected = None
+    for name, method in METHODS.items():
+        latencies = []
+        bytes_read = 0
+        for _ in range(iterations):
+            with open(path, 'rb', buffering=0) as raw:
+                reader = CountingReader(raw)
+                start = time.perf_counter()
+                width, height, dpi = method(reader)
+                latencies.append(time.perf_counter() - start)
+                bytes_read = reader.bytes_read
+        result = (width, height, tuple(round(d, 2) for d in dpi))
+        if expected is None:
+            expected = result
+        elif result != expected:
+            raise RuntimeError(f"{name} read {result}, expected {expected}")
+        row = {'method': name, 'size_mb': size_mb, 'payload_bytes': payload_bytes, 'bytes_read': bytes_read}
+        row.update(summarize(latencies))
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1,8,32', help='Comma-separated payload sizes in MB')
+    parser.add_argument('--iterations', type=int, default=20, help='Reads per method and size')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    sizes = [float(s) if '.' in s else int(s) for s in args.sizes.split(',')]
+    rows = []
+    with tempfile.TemporaryDirectory(prefix='png-header-bench-') as tmp:
+        for size_mb in sizes:
+            payload = make_png_payload(int(size_mb * MB), seed=args.seed)
+            path = f"{tmp}/{size_mb}mb.png"
+            with open(path, 'wb') as f:
+                f.write(payload)
+            rows.extend(run_size(path, size_mb, len(payload), args.iterations))
+
+    print_table(rows, ['method', 'size_mb', 'bytes_read', 'p50_ms', 'p99_ms', 'ops_per_second'])
+
+    if args.json:
+        write_report(args.json, {
+            'benchmark': 'png_header',
+            'iterations': args.iterations,
+            'results': rows,
+        })
+
+
+if __name__ == '__main__':
+    main()
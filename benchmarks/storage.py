@@ -0,0 +1,166 @@
+"""
+Storage benchmark for ObjectStorage.
+
+Runs upload_file, get_file, list_files and delete_file against a storage
+backend with PNG payloads at realistic DTF sizes and reports throughput and
+p50/p99 latency per operation and size.
+
+Examples:
+    python -m benchmarks.storage --backend memory --latency 0.05 --bandwidth 50
+    python -m benchmarks.storage --backend local --sizes 1,8,32 --json storage.json
+    python -m benchmarks.storage --backend memory --latency 0.05 --cache-mb 512
+    python -m benchmarks.storage --backend memory --latency 0.01 --failure-rate 0.2
+
+With --failure-rate the memory backend fails calls at random; failed calls are
+counted instead of aborting the run, and the retry/circuit-breaker counters are
+printed at the end.
+"""
+
+import argparse
+import tempfile
+import time
+from io import BytesIO
+
+from benchmarks.common import MB, make_png_payload, print_table, summarize, write_report
+from storage import ObjectStorage
+from storage_backends import LocalStorageBackend, MemoryStorageBackend, create_backend
+from storage_cache import DiskCache
+
+KEY_PREFIX = 'benchmark/'
+
+
+def build_backend(args):
+    """Create the backend selected on the command line"""
+    if args.backend == 'memory':
+        bandwidth = args.bandwidth * MB if args.bandwidth else None
+        return MemoryStorageBackend(latency=args.latency, jitter=args.jitter,
+                                    bandwidth=bandwidth, seed=args.seed)
+    if args.backend == 'local':
+        return LocalStorageBackend(args.local_path or tempfile.mkdtemp(prefix='storage-bench-'))
+    return create_backend(args.backend)
+
+
+def timed(func, *args):
+    """Call func and return (result, elapsed seconds)"""
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def list_keys(storage):
+    """Consume the benchmark key listing, or return None if it failed"""
+    try:
+        return list(storage.list_files(KEY_PREFIX))
+    except Exception:
+        return None
+
+
+def run_size(storage, size_mb, iterations, seed, tolerate_failures=False):
+    """Benchmark every operation for one payload size"""
+    payload = make_png_payload(int(size_mb * MB), seed=seed)
+    keys = [f"{KEY_PREFIX}{size_mb}mb-{i}.png" for i in range(iterations)]
+    results = {'upload_file': [], 'get_file': [], 'list_files': [], 'delete_file': []}
+    failures = dict.fromkeys(results, 0)
+
+    def check(operation, ok, message):
+        if ok:
+            return True
+        if not tolerate_failures:
+            raise RuntimeError(message)
+        failures[operation] += 1
+        return False
+
+    uploaded = []
+    for key in keys:
+        ok, elapsed = timed(storage.upload_file, BytesIO(payload), key)
+        results['upload_file'].append(elapsed)
+        if check('upload_file', ok, f"Upload failed for {key}"):
+            uploaded.append(key)
+
+    for key in uploaded:
+        data, elapsed = timed(storage.get_file, key)
+        results['get_file'].append(elapsed)
+        check('get_file', data == payload, f"Downloaded data does not match for {key}")
+
+    if storage.cache is not None:
+        # Second pass is served from the disk cache
+        results['get_file (cached)'] = []
+        for key in uploaded:
+            reader, elapsed = timed(storage.open_file, key)
+            if reader is not None:
+                reader.close()
+            results['get_file (cached)'].append(elapsed)
+
+    for _ in range(iterations):
+        names, elapsed = timed(list_keys, storage)
+        results['list_files'].append(elapsed)
+        check('list_files', names is not None, "Listing failed")
+
+    for key in uploaded:
+        ok, elapsed = timed(storage.delete_file, key)
+        results['delete_file'].append(elapsed)
+        check('delete_file', ok, f"Delete failed for {key}")
+
+    rows = []
+    for operation, latencies in results.items():
+        transferred = len(payload) * len(latencies) if operation.startswith(('upload_file', 'get_file')) else 0
+        row = {'operation': operation, 'size_mb': size_mb, 'payload_bytes': len(payload),
+               'failed': failures.get(operation, 0)}
+        row.update(summarize(latencies, transferred))
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', choices=['memory', 'local', 'replit'], default='memory')
+    parser.add_argument('--sizes', default='1,4,16,32', help='Comma-separated payload sizes in MB')
+    parser.add_argument('--iterations', type=int, default=5, help='Objects per size')
+    parser.add_argument('--latency', type=float, default=0.0, help='Memory backend: seconds added per call')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Memory backend: max random extra seconds per call')
+    parser.add_argument('--bandwidth', type=float, default=0.0, help='Memory backend: transfer rate in MB/s (0 = unlimited)')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='Memory backend: probability (0-1) that a storage call fails')
+    parser.add_argument('--local-path', help='Local backend: directory to store objects in (default: a temp dir)')
+    parser.add_argument('--cache-mb', type=int, default=0, help='Put a disk cache of this size in front of the backend')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    cache = DiskCache(tempfile.mkdtemp(prefix='storage-cache-bench-'), args.cache_mb * MB) if args.cache_mb else None
+    backend = build_backend(args)
+    storage = ObjectStorage(backend=backend, cache=cache, use_cache=False)
+    if args.failure_rate:
+        # Injected after the connection test so the run can start
+        backend.failure_rate = args.failure_rate
+    sizes = [float(s) if '.' in s else int(s) for s in args.sizes.split(',')]
+
+    rows = []
+    for size_mb in sizes:
+        rows.extend(run_size(storage, size_mb, args.iterations, args.seed,
+                             tolerate_failures=bool(args.failure_rate)))
+
+    print_table(rows, ['operation', 'size_mb', 'calls', 'failed', 'p50_ms', 'p99_ms', 'ops_per_second',
+                       'mb_per_second'])
+    if cache is not None:
+        print(f"Cache: {cache.stats()}")
+    print(f"Resilience: {storage.resilience_stats()}")
+
+    if args.json:
+        write_report(args.json, {
+            'benchmark': 'storage',
+            'backend': args.backend,
+            'latency': args.latency,
+            'jitter': args.jitter,
+            'bandwidth_mb_per_second': args.bandwidth,
+            'failure_rate': args.failure_rate,
+            'iterations': args.iterations,
+            'cache_mb': args.cache_mb,
+            'cache_stats': cache.stats() if cache is not None else None,
+            'resilience_stats': storage.resilience_stats(),
+            'results': rows,
+        })
+
+
+if __name__ == '__main__':
+    main()
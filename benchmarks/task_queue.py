@@ -0,0 +1,118 @@
+"""
+Task queue benchmark.
+
+Fills a queue with --tasks tasks and measures enqueue and dequeue throughput
+of the SQLite queue (task_queue.py) against the directory of task_*.json
+files the worker used to scan, where every dequeue lists and sorts the whole
+directory. Dequeues are measured with the queue full, so each one pays the
+cost of the backlog.
+
+Examples:
+    python -m benchmarks.task_queue
+    python -m benchmarks.task_queue --tasks 100000 --dequeues 2000 --json queue.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.common import print_table, summarize, write_report
+from task_queue import TaskQueue
+
+BATCH = 1000  # Tasks per enqueue_many call
+
+
+def task_data(i):
+    return {'file_key': f"cas/{i:064x}.png"}
+
+
+def bench_sqlite(directory, tasks, single, dequeues):
+    queue = TaskQueue(os.path.join(directory, 'queue.db'))
+    rows = []
+
+    latencies = []
+    for i in range(single):
+        start = time.perf_counter()
+        queue.enqueue('thumbnail', task_data(i), i % 3)
+        latencies.append(time.perf_counter() - start)
+    rows.append(dict(backend='sqlite', operation='enqueue', **summarize(latencies)))
+
+    latencies = []
+    for first in range(single, tasks, BATCH):
+        batch = [('thumbnail', task_data(i), i % 3) for i in range(first, min(first + BATCH, tasks))]
+        start = time.perf_counter()
+        queue.enqueue_many(batch)
+        # Per task, so the rates compare with single enqueues
+        latencies.extend([(time.perf_counter() - start) / len(batch)] * len(batch))
+    rows.append(dict(backend='sqlite', operation=f'enqueue_many({BATCH})', **summarize(latencies)))
+
+    latencies = []
+    for _ in range(dequeues):
+        start = time.perf_counter()
+        task = queue.lease()
+        queue.complete(task)
+        latencies.append(time.perf_counter() - start)
+    rows.append(dict(backend='sqlite', operation='lease+complete', **summarize(latencies)))
+    queue.close()
+    return rows
+
+
+def bench_directory(directory, tasks, single, dequeues):
+    """The old format: one JSON file per task, the oldest found by sorting a listing"""
+    path = Path(directory) / 'worker_tasks'
+    path.mkdir()
+    rows = []
+
+    latencies = []
+    for i in range(tasks):
+        start = time.perf_counter()
+        # Unique names; the old task_{ms}_{pid} names collided within a millisecond
+        task_file = path / f"task_{int(time.time() * 1000)}_{os.getpid()}_{i}.json"
+        with open(task_file, 'w') as f:
+            json.dump({'type': 'thumbnail', 'data': task_data(i), 'priority': i % 3,
+                       'timestamp': time.time()}, f)
+        latencies.append(time.perf_counter() - start)
+    rows.append(dict(backend='directory', operation='enqueue', **summarize(latencies)))
+
+    latencies = []
+    for _ in range(dequeues):
+        start = time.perf_counter()
+        task_file = sorted(path.glob("task_*.json"))[0]
+        with open(task_file) as f:
+            json.load(f)
+        task_file.unlink()
+        latencies.append(time.perf_counter() - start)
+    rows.append(dict(backend='directory', operation='scan+delete', **summarize(latencies)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tasks', type=int, default=100000, help='Tasks in the queue')
+    parser.add_argument('--single', type=int, default=2000, help='Tasks enqueued one at a time (SQLite)')
+    parser.add_argument('--dequeues', type=int, default=1000, help='Tasks dequeued from the full SQLite queue')
+    parser.add_argument('--directory-dequeues', type=int, default=20,
+                        help='Tasks dequeued from the full directory (each one lists every file)')
+    parser.add_argument('--json', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    rows = []
+    for bench, dequeues in ((bench_sqlite, args.dequeues), (bench_directory, args.directory_dequeues)):
+        directory = tempfile.mkdtemp(prefix='queue-bench-')
+        try:
+            rows.extend(bench(directory, args.tasks, args.single, dequeues))
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    print(f"{args.tasks} tasks queued")
+    print_table(rows, ['backend', 'operation', 'calls', 'p50_ms', 'p99_ms', 'ops_per_second'])
+    if args.json:
+        write_report(args.json, {'benchmark': 'task_queue', 'tasks': args.tasks, 'results': rows})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Thumbnail format benchmark.
+
+Encodes the previews of synthetic DTF artwork (shapes on a transparent
+background) as PNG and as each variant format Pillow supports, and reports
+bytes per preview and encode time for every format and preview size.
+
+Examples:
+    python -m benchmarks.thumbnail_formats
+    python -m benchmarks.thumbnail_formats --images 5 --width 4000 --height 3000 --json formats.json
+"""
+
+import argparse
+import random
+import time
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+from benchmarks.common import print_table, summarize, write_report
+from utils import DERIVATIVE_SIZES, SUPPORTED_VARIANTS, VARIANT_FORMATS
+
+
+def make_artwork(width, height, seed):
+    """Opaque shapes and text-like strokes on a transparent background"""
+    rng = random.Random(seed)
+    img = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    for _ in range(200):
+        x, y = rng.randrange(width), rng.randrange(height)
+        w, h = rng.randrange(10, width // 4), rng.randrange(10, height // 4)
+        color = (rng.randrange(256), rng.randrange(256), rng.randrange(256), rng.choice([255, 255, 160]))
+        if rng.random() < 0.5:
+            draw.ellipse([x, y, x + w, y + h], fill=color)
+        else:
+            draw.line([x, y, x + w, y + h], fill=color, width=rng.randrange(2, 30))
+    return img
+
+
+def encode(img, fmt, size):
+    """Return the encoded bytes of one preview"""
+    output = BytesIO()
+    if fmt == 'png':
+        # Same options as utils.generate_derivatives
+        img.save(output, 'PNG', optimize=size <= 100)
+    else:
+        img.save(output, fmt.upper(), **VARIANT_FORMATS[fmt][1])
+    return output.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=3, help='Number of synthetic artworks')
+    parser.add_argument('--width', type=int, default=3000)
+    parser.add_argument('--height', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    formats = ['png'] + SUPPORTED_VARIANTS
+    latencies = {(fmt, name): [] for fmt in formats for name in DERIVATIVE_SIZES}
+    sizes = {key: [] for key in latencies}
+
+    for i in range(args.images):
+        img = make_artwork(args.width, args.height, args.seed + i)
+        for name, size in sorted(DERIVATIVE_SIZES.items(), key=lambda item: item[1], reverse=True):
+            img.thumbnail((size, size), Image.Resampling.LANCZOS)
+            for fmt in formats:
+                start = time.perf_counter()
+                data = encode(img, fmt, size)
+                latencies[(fmt, name)].append(time.perf_counter() - start)
+                sizes[(fmt, name)].append(len(data))
+
+    rows = []
+    for (fmt, name), values in latencies.items():
+        png_bytes = sum(sizes[('png', name)]) / len(sizes[('png', name)])
+        avg_bytes = sum(sizes[(fmt, name)]) / len(sizes[(fmt, name)])
+        row = {'format': fmt, 'derivative': name, 'pixels': DERIVATIVE_SIZES[name],
+               'avg_bytes': round(avg_bytes), 'vs_png': round(avg_bytes / png_bytes, 3)}
+        row.update(summarize(values))
+        rows.append(row)
+    rows.sort(key=lambda row: (-row['pixels'], formats.index(row['format'])))
+
+    print_table(rows, ['derivative', 'pixels', 'format', 'avg_bytes', 'vs_png', 'p50_ms', 'p99_ms'])
+
+    if args.json:
+        write_report(args.json, {
+            'benchmark': 'thumbnail_formats',
+            'images': args.images,
+            'width': args.width,
+            'height': args.height,
+            'formats': formats,
+            'results': rows,
+        })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Thumbnail throughput benchmark for the worker's process pool.
+
+Uploads a batch of synthetic DTF PNGs to a memory backend, then runs
+ThumbnailPool.process (fetch, render every preview size, upload) over the
+batch with 1..N processes and reports files per second for each pool size, and
+the highest peak memory of a single render (use it to size
+WORKER_TASK_MEMORY_MB).
+
+Examples:
+    python -m benchmarks.thumbnails
+    python -m benchmarks.thumbnails --files 16 --size 32 --processes 1,2,4,8 --latency 0.05
+    python -m benchmarks.thumbnails --json thumbnails.json
+"""
+
+import argparse
+import os
+import time
+from io import BytesIO
+
+from benchmarks.common import MB, make_png_payload, print_table, write_report
+from storage import ObjectStorage
+from storage_backends import MemoryStorageBackend
+from thumbnail_pool import ThumbnailPool
+
+KEY_PREFIX = 'benchmark/'
+
+
+def run_pool(storage, keys, processes, memory_limit_mb):
+    """Process the whole batch with one pool size"""
+    pool = ThumbnailPool(processes=processes, memory_limit_mb=memory_limit_mb)
+    try:
+        # Start the processes outside the timed section
+        pool.start()
+
+        failed = 0
+        peaks = []
+        start = time.perf_counter()
+        for _, _, _, error, stats in pool.process(keys, storage):
+            if error is not None:
+                failed += 1
+            if stats.get('peak_memory_mb') is not None:
+                peaks.append(stats['peak_memory_mb'])
+        elapsed = time.perf_counter() - start
+    finally:
+        pool.shutdown()
+    return elapsed, failed, max(peaks, default=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=8, help='Originals in the batch')
+    parser.add_argument('--size', type=float, default=16, help='Size of each original in MB')
+    parser.add_argument('--width', type=int, default=2048, help='Pixel width of each original')
+    parser.add_argument('--processes', help='Comma-separated pool sizes (default: 1 up to the CPU count)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Memory backend: seconds added per call')
+    parser.add_argument('--memory-mb', type=int, default=0, help='Memory budget per process (0 = no limit)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    if args.processes:
+        pool_sizes = [int(p) for p in args.processes.split(',')]
+    else:
+        pool_sizes = list(range(1, (os.cpu_count() or 1) + 1))
+
+    storage = ObjectStorage(backend=MemoryStorageBackend(latency=args.latency, seed=args.seed), use_cache=False)
+    keys = [f"{KEY_PREFIX}original-{i}.png" for i in range(args.files)]
+    # Different seeds so no two files compress alike
+    result = storage.put_many({key: make_png_payload(int(args.size * MB), width=args.width, seed=args.seed + i)
+                               for i, key in enumerate(keys)})
+    if not result.ok:
+        raise RuntimeError(f"Upload failed: {result.errors}")
+
+    rows = []
+    baseline = None
+    for processes in pool_sizes:
+        elapsed, failed, peak_memory_mb = run_pool(storage, keys, processes, args.memory_mb)
+        files_per_second = args.files / elapsed if elapsed else 0.0
+        baseline = baseline or files_per_second
+        rows.append({
+            'processes': processes,
+            'files': args.files,
+            'failed': failed,
+            'total_seconds': round(elapsed, 3),
+            'files_per_second': round(files_per_second, 2),
+            'mb_per_second': round(args.files * args.size / elapsed, 2) if elapsed else 0.0,
+            'speedup': round(files_per_second / baseline, 2) if baseline else 0.0,
+            'peak_memory_mb': peak_memory_mb,
+        })
+
+    print_table(rows, ['processes', 'files', 'failed', 'total_seconds', 'files_per_second', 'mb_per_second',
+                       'speedup', 'peak_memory_mb'])
+
+    if args.json:
+        write_report(args.json, {
+            'benchmark': 'thumbnails',
+            'file_size_mb': args.size,
+            'width': args.width,
+            'latency': args.latency,
+            'memory_mb': args.memory_mb,
+            'cpu_count': os.cpu_count(),
+            'results': rows,
+        })
+
+
+if __name__ == '__main__':
+    main()
@@ -20,6 +20,71 @@ class Config:
     REQUEST_TIMEOUT = 1200  # 20 minutes timeout for large uploads
     ALLOWED_EXTENSIONS = {'png'}
 
+    # Object storage settings
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'replit')  # 'replit', 'local' or 'memory'
+    STORAGE_BUCKET_ID = os.environ.get('STORAGE_BUCKET_ID', 'replit-objstore-c3fb67d8-cc58-4f6a-8303-0ada7212ebd1')
+    STORAGE_LOCAL_PATH = os.environ.get('STORAGE_LOCAL_PATH', '/tmp/object_storage')
+    STORAGE_MEMORY_LATENCY = float(os.environ.get('STORAGE_MEMORY_LATENCY', '0'))  # Seconds per call
+    STORAGE_MAX_CONCURRENCY = int(os.environ.get('STORAGE_MAX_CONCURRENCY', '8'))  # Threads for batched operations
+
+    # Storage retries and circuit breaker (see storage_resilience.py)
+    STORAGE_RETRY_BASE_DELAY = float(os.environ.get('STORAGE_RETRY_BASE_DELAY', '0.2'))  # Seconds, doubles per retry
+    STORAGE_RETRY_MAX_DELAY = float(os.environ.get('STORAGE_RETRY_MAX_DELAY', '2.0'))  # Cap for a single backoff
+    STORAGE_BREAKER_THRESHOLD = int(os.environ.get('STORAGE_BREAKER_THRESHOLD', '5'))  # Consecutive failures to open
+    STORAGE_BREAKER_RESET_TIMEOUT = float(os.environ.get('STORAGE_BREAKER_RESET_TIMEOUT', '30'))  # Seconds open before a trial call
+
+    # Local disk cache in front of object storage, shared by all processes on the host
+    STORAGE_CACHE_DIR = os.environ.get('STORAGE_CACHE_DIR', '/tmp/storage_cache')
+    STORAGE_CACHE_MAX_BYTES = int(os.environ.get('STORAGE_CACHE_MAX_BYTES', str(2 * 1024 * 1024 * 1024)))  # 2GB, 0 disables
+
+    # Image worker: processes that generate previews and the address space each may use
+    WORKER_PROCESSES = int(os.environ.get('WORKER_PROCESSES', '0'))  # 0 = one per CPU
+    WORKER_TASK_MEMORY_MB = int(os.environ.get('WORKER_TASK_MEMORY_MB', '2048'))  # 0 disables the limit
+
+    # Worker task queue (see task_queue.py), shared by the app and worker processes on the host
+    TASK_QUEUE_PATH = os.environ.get('TASK_QUEUE_PATH', 'worker_tasks/queue.db')
+    TASK_LEASE_SECONDS = float(os.environ.get('TASK_LEASE_SECONDS', '60'))  # Renewed by heartbeats while a task runs
+    TASK_MAX_ATTEMPTS = int(os.environ.get('TASK_MAX_ATTEMPTS', '5'))  # Then the task is dead-lettered
+    TASK_RETRY_BASE_DELAY = float(os.environ.get('TASK_RETRY_BASE_DELAY', '5'))  # Seconds, doubles per attempt
+    TASK_RETRY_MAX_DELAY = float(os.environ.get('TASK_RETRY_MAX_DELAY', '600'))
+    TASK_DEDUP_WINDOW_SECONDS = float(os.environ.get('TASK_DEDUP_WINDOW_SECONDS', '60'))  # Resubmits ignored after a task completes
+    TASK_WAKE_DIR = os.environ.get('TASK_WAKE_DIR', 'worker_tasks/wake')  # Worker notification sockets (task_wakeup.py)
+    WORKER_IDLE_POLL_SECONDS = float(os.environ.get('WORKER_IDLE_POLL_SECONDS', '60'))  # Safety poll when notified
+
+    # Worker pool run by worker_manager.py, sized by queue depth
+    WORKER_POOL_MIN = int(os.environ.get('WORKER_POOL_MIN', '1'))
+    WORKER_POOL_MAX = int(os.environ.get('WORKER_POOL_MAX', '4'))
+    WORKER_SCALE_TASKS_PER_WORKER = int(os.environ.get('WORKER_SCALE_TASKS_PER_WORKER', '20'))  # Ready tasks per worker
+    WORKER_SCALE_UP_AGE = float(os.environ.get('WORKER_SCALE_UP_AGE', '30'))  # Oldest ready task (s) that adds a worker
+    WORKER_SCALE_DOWN_DELAY = float(os.environ.get('WORKER_SCALE_DOWN_DELAY', '60'))  # Seconds between stopping idle workers
+    WORKER_RESTART_BASE_DELAY = float(os.environ.get('WORKER_RESTART_BASE_DELAY', '1'))  # Seconds, doubles per crash
+    WORKER_RESTART_MAX_DELAY = float(os.environ.get('WORKER_RESTART_MAX_DELAY', '60'))
+    WORKER_STABLE_SECONDS = float(os.environ.get('WORKER_STABLE_SECONDS', '300'))  # Uptime that resets the crash backoff
+    WORKER_DRAIN_SECONDS = float(os.environ.get('WORKER_DRAIN_SECONDS', '120'))  # Wait for running tasks on shutdown
+    WORKER_STATUS_PATH = os.environ.get('WORKER_STATUS_PATH', 'worker_tasks/manager_status.json')
+
+    # Scan of new order items for missing previews (see thumbnail_scanner.py), scheduled by worker_manager
+    THUMBNAIL_SCAN_INTERVAL = float(os.environ.get('THUMBNAIL_SCAN_INTERVAL', '300'))  # Seconds, 0 disables
+    THUMBNAIL_SCAN_BATCH = int(os.environ.get('THUMBNAIL_SCAN_BATCH', '500'))  # Order items per query
+    THUMBNAIL_SCAN_BACKFILL_HOURS = float(os.environ.get('THUMBNAIL_SCAN_BACKFILL_HOURS', '24'))  # Orders the first scan covers
+    THUMBNAIL_SCAN_MAX_ATTEMPTS = int(os.environ.get('THUMBNAIL_SCAN_MAX_ATTEMPTS', '5'))  # Then the item stays recorded but is not queued again
+    THUMBNAIL_SCAN_MAX_QUEUED = int(os.environ.get('THUMBNAIL_SCAN_MAX_QUEUED', '200'))  # Thumbnail tasks per scan
+
+    # Decode budget for preview generation (see image_decode.py)
+    IMAGE_FULL_DECODE_PIXELS = int(os.environ.get('IMAGE_FULL_DECODE_PIXELS', '40000000'))  # Larger images are decoded in strips
+    IMAGE_MAX_PIXELS = int(os.environ.get('IMAGE_MAX_PIXELS', '500000000'))  # Refused above this
+    IMAGE_DECODE_STRIP_MB = int(os.environ.get('IMAGE_DECODE_STRIP_MB', '16'))  # Decompressed data per strip
+
+    # Gang sheets (see nesting.py): film width and the gap kept between pieces
+    NESTING_ROLL_WIDTH_INCHES = float(os.environ.get('NESTING_ROLL_WIDTH_INCHES', '22'))
+    NESTING_SPACING_INCHES = float(os.environ.get('NESTING_SPACING_INCHES', '0.25'))
+    GANG_SHEET_CACHE_MB = int(os.environ.get('GANG_SHEET_CACHE_MB', '512'))  # Prepared sources kept while rendering a sheet
+    GANG_SHEET_MIN_DPI = int(os.environ.get('GANG_SHEET_MIN_DPI', '72'))  # Render resolutions /admin/gang-sheet accepts
+    GANG_SHEET_MAX_DPI = int(os.environ.get('GANG_SHEET_MAX_DPI', '1200'))
+
+    # Number of files fetched ahead while streaming a download-all ZIP
+    DOWNLOAD_ALL_PREFETCH = 3
+
     # Proxy settings
     PROXY_FIX = True
     PREFERRED_URL_SCHEME = 'https'
@@ -0,0 +1,418 @@
+"""
+Streaming gang-sheet renderer.
+A gang sheet is one PNG at print resolution with every piece of a layout
+(nesting.py) composited at its position: 22" x several feet at 300 DPI is
+billions of bytes of pixels, far too many to hold as one PIL canvas. The
+sheet is built one strip of rows at a time instead, and each strip is
+filtered, deflated and written out before the next one is drawn, so memory
+depends on the strip height and the pieces crossing it, not on the length
+of the sheet.
+
+Sources are read from object storage and prepared (decoded, scaled to the
+placement and rotated) once per file and size; pieces spanning several
+strips and the copies of one item share the prepared image, which is kept
+in a cache of GANG_SHEET_CACHE_MB until the renderer has passed the last
+row that uses it. An entry is never evicted while it is still needed, so
+every source is read from storage once per render.
+
+Pieces that don't fit in the cache next to the ones still in use are
+streamed instead: upright pieces at their own size (the usual case) are
+decoded row by row as the strips reach them (image_decode), and rotated or
+resized pieces are decoded once into a temporary file of raw pixels and
+scaled a strip at a time from there.
+"""
+
+import math
+import os
+import struct
+import logging
+import tempfile
+import zlib
+
+import numpy as np
+from PIL import Image
+
+from config import Config
+from image_decode import ImageTooLarge, can_decode_strips, iter_decoded_strips
+from png_header import PNG_SIGNATURE, PNGHeaderError, read_png_header
+from storage_backends import CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# Sources up to this many pixels off the placement size are cropped or
+# padded instead of resampled (sizes in inches are rounded to 0.01")
+SIZE_TOLERANCE_PX = 3
+
+# Radius in source pixels of Pillow's Lanczos filter, per unit of downscaling
+LANCZOS_SUPPORT = 3
+
+
+class PNGStripWriter:
+    """Writes an 8-bit RGBA PNG to a file object a strip of rows at a time"""
+
+    def __init__(self, output, width, height, dpi=None, compress_level=6, chunk_size=CHUNK_SIZE):
+        self.output = output
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self.chunk_size = chunk_size
+        self._compressor = zlib.compressobj(compress_level)
+        self._pending = bytearray()
+
+        output.write(PNG_SIGNATURE)
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+        if dpi:
+            ppm = round(dpi / 0.0254)
+            self._chunk(b'pHYs', struct.pack('>IIB', ppm, ppm, 1))
+
+    def _chunk(self, chunk_type, data):
+        self.output.write(struct.pack('>I', len(data)) + chunk_type)
+        self.output.write(data)
+        self.output.write(struct.pack('>I', zlib.crc32(chunk_type + data)))
+
+    def write(self, strip):
+        """Append the rows of an RGBA image as wide as the sheet"""
+        rows = np.asarray(strip, dtype=np.uint8).reshape(strip.height, self.width * 4)
+        # Sub filter: each byte minus the same channel of the pixel to its left
+        filtered = np.empty((strip.height, self.width * 4 + 1), dtype=np.uint8)
+        filtered[:, 0] = 1
+        filtered[:, 1:5] = rows[:, :4]
+        np.subtract(rows[:, 4:], rows[:, :-4], out=filtered[:, 5:])
+        self._pending += self._compressor.compress(filtered.tobytes())
+        self.rows_written += strip.height
+        if len(self._pending) >= self.chunk_size:
+            self._chunk(b'IDAT', bytes(self._pending))
+            self._pending.clear()
+
+    def close(self):
+        if self.rows_written != self.height:
+            raise ValueError(f"PNG has {self.rows_written} of {self.height} rows")
+        self._pending += self._compressor.flush()
+        self._chunk(b'IDAT', bytes(self._pending))
+        self._pending.clear()
+        self._chunk(b'IEND', b'')
+
+
+class _Piece:
+    """A placement in sheet pixels"""
+
+    def __init__(self, file_key, left, top, width, height, rotated):
+        self.file_key = file_key
+        self.left = left
+        self.top = top
+        self.width = width
+        self.height = height
+        self.rotated = rotated
+        self.rows = None  # _RowSource while the piece is streamed upright
+        self.spool = None  # _Spool while the piece is streamed rotated or resized
+
+    @property
+    def bottom(self):
+        return self.top + self.height
+
+    @property
+    def cache_key(self):
+        return self.file_key, self.width, self.height, self.rotated
+
+
+def _to_pixels(placement, dpi):
+    get = placement.get if isinstance(placement, dict) else lambda name: getattr(placement, name)
+    left, top = round(get('x') * dpi), round(get('y') * dpi)
+    return _Piece(get('file_key'), left, top, round(get('width') * dpi), round(get('height') * dpi),
+                  bool(get('rotated')))
+
+
+class _RowSource:
+    """Rows of an upright source decoded in strips, handed out top to bottom"""
+
+    def __init__(self, reader, info, width):
+        self.reader = reader
+        self.width = width
+        self._strips = iter_decoded_strips(reader, info)
+        self._buffer = None
+
+    def take(self, rows):
+        """The next rows rows as RGBA, cropped or padded to the placement width"""
+        parts = []
+        while rows > 0:
+            if self._buffer is None:
+                strip = next(self._strips, None)
+                if strip is None:
+                    break  # Source is a little shorter than the placement
+                self._buffer = strip if strip.mode == 'RGBA' else strip.convert('RGBA')
+            part = self._buffer
+            if part.height > rows:
+                self._buffer = part.crop((0, rows, part.width, part.height))
+                part = part.crop((0, 0, part.width, rows))
+            else:
+                self._buffer = None
+            if part.width > self.width:
+                part = part.crop((0, 0, self.width, part.height))
+            parts.append(part)
+            rows -= part.height
+        return parts
+
+    def close(self):
+        self._strips.close()
+        self.reader.close()
+
+
+class _Spool:
+    """A source decoded to a temporary file of raw RGBA pixels, rotated but not yet scaled
+
+    Rows of the placement are made from it on demand, so a piece larger than
+    the cache only needs memory for the strip being drawn. Copies of a piece
+    share one spool.
+    """
+
+    def __init__(self, reader, info, piece, strip_bytes=None):
+        self.width = piece.width
+        self.height = piece.height
+        self._file = tempfile.TemporaryFile()
+        try:
+            with reader:
+                if info is not None and can_decode_strips(info):
+                    strips = iter_decoded_strips(reader, info, strip_bytes)
+                    source_size = info.width, info.height
+                else:
+                    if info is not None and info.width * info.height > Config.IMAGE_FULL_DECODE_PIXELS:
+                        raise ImageTooLarge(f"{piece.file_key} is {info.width}x{info.height} pixels, "
+                                            f"too large to decode in full")
+                    image = Image.open(reader)
+                    image.load()
+                    strips = iter([image])
+                    source_size = image.size
+                self._fill(strips, source_size, piece.rotated)
+        except BaseException:
+            self._file.close()
+            raise
+        self.resize = (abs(self._width - self.width) > SIZE_TOLERANCE_PX
+                       or abs(self._height - self.height) > SIZE_TOLERANCE_PX)
+
+    def _fill(self, strips, source_size, rotated):
+        source_width, source_height = source_size
+        self._height, self._width = (source_width, source_height) if rotated else (source_height, source_width)
+        fd = self._file.fileno()
+        row_bytes = self._width * 4
+        os.ftruncate(fd, self._height * row_bytes)
+        top = 0
+        for strip in strips:
+            if strip.mode != 'RGBA':
+                strip = strip.convert('RGBA')
+            if rotated:
+                # Rows of the source become columns of the rotated image
+                pixels = np.asarray(strip.transpose(Image.Transpose.ROTATE_90))
+                for y in range(self._height):
+                    os.pwrite(fd, pixels[y].tobytes(), y * row_bytes + top * 4)
+            else:
+                os.pwrite(fd, strip.tobytes(), top * row_bytes)
+            top += strip.height
+
+    def _read(self, first, last):
+        """Rows [first, last) of the rotated source as an image, read with pread (not mapped, to bound memory)"""
+        row_bytes = self._width * 4
+        data = os.pread(self._file.fileno(), (last - first) * row_bytes, first * row_bytes)
+        return Image.frombuffer('RGBA', (self._width, last - first), data, 'raw', 'RGBA', 0, 1)
+
+    def rows(self, first, last):
+        """Rows [first, last) of the piece at its placed size, as RGBA"""
+        height, width = self._height, self._width
+        if not self.resize:
+            # Within the tolerance: crop, or pad with transparent pixels
+            return self._read(first, min(last, height)).crop((0, 0, self.width, last - first))
+
+        scale = height / self.height
+        top, bottom = first * scale, last * scale
+        # Source rows the filter reads around [top, bottom), as in a resize of the whole image
+        margin = math.ceil(LANCZOS_SUPPORT * max(scale, 1.0)) + 1
+        start, end = max(0, math.floor(top) - margin), min(height, math.ceil(bottom) + margin)
+        return self._read(start, end).resize((self.width, last - first), Image.Resampling.LANCZOS,
+                                             box=(0, top - start, width, bottom - start))
+
+    def close(self):
+        self._file.close()
+
+
+class SheetRenderer:
+    """Composites placements into a PNG strip by strip"""
+
+    def __init__(self, storage_client, dpi=300, strip_bytes=None, cache_bytes=None):
+        self.storage = storage_client
+        self.dpi = dpi
+        self.strip_bytes = strip_bytes or Config.IMAGE_DECODE_STRIP_MB * MB
+        self.cache_bytes = Config.GANG_SHEET_CACHE_MB * MB if cache_bytes is None else cache_bytes
+        self._cache = {}  # cache_key -> prepared RGBA image
+        self._cached_bytes = 0
+        self._spools = {}  # cache_key -> _Spool
+        self.stats = {'prepared': 0, 'cache_hits': 0, 'streamed': 0, 'spooled': 0, 'evicted': 0}
+
+    def render(self, placements, output, roll_width, length):
+        """Write the sheet for placements (dicts or nesting.Placement with file_key) to output
+
+        Positions and sizes are in inches; the sheet is roll_width x length.
+        Returns the sheet size in pixels.
+        """
+        width, height = round(roll_width * self.dpi), round(length * self.dpi)
+        pieces = sorted((_to_pixels(p, self.dpi) for p in placements), key=lambda p: p.top)
+        # Last sheet row that needs each prepared image, to drop it after that strip
+        last_use = {}
+        for piece in pieces:
+            last_use[piece.cache_key] = max(last_use.get(piece.cache_key, 0), piece.bottom)
+
+        rows_per_strip = max(1, self.strip_bytes // (width * 4))
+        writer = PNGStripWriter(output, width, height, self.dpi)
+        active = []
+        next_piece = 0
+        try:
+            for strip_top in range(0, height, rows_per_strip):
+                strip_bottom = min(strip_top + rows_per_strip, height)
+                while next_piece < len(pieces) and pieces[next_piece].top < strip_bottom:
+                    active.append(pieces[next_piece])
+                    next_piece += 1
+
+                strip = Image.new('RGBA', (width, strip_bottom - strip_top))
+                for piece in active:
+                    self._draw(piece, strip, strip_top, strip_bottom)
+                writer.write(strip)
+                del strip
+
+                for piece in [p for p in active if p.bottom <= strip_bottom]:
+                    active.remove(piece)
+                    if piece.rows is not None:
+                        piece.rows.close()
+                        piece.rows = None
+                # Only sources no later row needs; the rest stay pinned
+                for key in [k for k in self._cache if last_use[k] <= strip_bottom]:
+                    self._evict(key)
+                for key in [k for k in self._spools if last_use[k] <= strip_bottom]:
+                    self._spools.pop(key).close()
+            writer.close()
+        finally:
+            for piece in active:
+                if piece.rows is not None:
+                    piece.rows.close()
+            for key in list(self._cache):
+                self._evict(key)
+            for spool in self._spools.values():
+                spool.close()
+            self._spools.clear()
+        return width, height
+
+    def render_to_storage(self, placements, key, roll_width, length):
+        """Render the sheet and upload it to storage under key
+
+        The PNG is spooled to a temporary file, not memory, so the upload can
+        be retried. Returns True on success.
+        """
+        with tempfile.TemporaryFile() as tmp:
+            self.render(placements, tmp, roll_width, length)
+            tmp.seek(0)
+            return self.storage.upload_file(tmp, key)
+
+    def _draw(self, piece, strip, strip_top, strip_bottom):
+        """Composite the rows of piece that fall in [strip_top, strip_bottom)"""
+        first = max(piece.top, strip_top)
+        last = min(piece.bottom, strip_bottom)
+        if last <= first:
+            return
+
+        if piece.rows is None and piece.spool is None:
+            image = self._prepared(piece)
+            if image is not None:
+                region = image.crop((0, first - piece.top, image.width, last - piece.top))
+                self._composite(strip, region, piece.left, first - strip_top)
+                return
+
+        if piece.spool is not None:
+            region = piece.spool.rows(first - piece.top, last - piece.top)
+            self._composite(strip, region, piece.left, first - strip_top)
+            return
+
+        y = first - strip_top
+        for part in piece.rows.take(last - first):
+            self._composite(strip, part, piece.left, y)
+            y += part.height
+
+    def _composite(self, strip, image, left, top):
+        # Clip to the sheet: placements may overhang by rounding
+        image = image.crop((0, 0, min(image.width, strip.width - left), image.height))
+        strip.alpha_composite(image, (left, top))
+
+    def _prepared(self, piece):
+        """The prepared image of piece, or None if it is streamed (piece.rows or piece.spool is set)"""
+        key = piece.cache_key
+        image = self._cache.get(key)
+        if image is not None:
+            self.stats['cache_hits'] += 1
+            return image
+        spool = self._spools.get(key)
+        if spool is not None:
+            piece.spool = spool
+            self.stats['cache_hits'] += 1
+            return None
+
+        reader = self.storage.open_file(piece.file_key)
+        if reader is None:
+            raise FileNotFoundError(f"Source {piece.file_key} not found in storage")
+        try:
+            info = read_png_header(reader)
+        except PNGHeaderError:
+            info = None
+
+        size = piece.width * piece.height * 4
+        too_large = info is not None and info.width * info.height > Config.IMAGE_FULL_DECODE_PIXELS
+        if self._cached_bytes + size > self.cache_bytes or (too_large and can_decode_strips(info)):
+            # Cached entries are all still needed, so stream this piece instead of evicting them
+            if info is not None and self._streamable(piece, info):
+                piece.rows = _RowSource(reader, info, piece.width)
+                self.stats['streamed'] += 1
+                return None
+            piece.spool = self._spools[key] = _Spool(reader, info, piece, self.strip_bytes)
+            self.stats['spooled'] += 1
+            return None
+
+        with reader:
+            if too_large:
+                raise ImageTooLarge(f"{piece.file_key} is {info.width}x{info.height} pixels, "
+                                    f"too large to decode in full")
+            image = _prepare(Image.open(reader), piece)
+        self.stats['prepared'] += 1
+
+        self._cache[key] = image
+        self._cached_bytes += image.width * image.height * 4
+        return image
+
+    def _streamable(self, piece, info):
+        return (not piece.rotated and can_decode_strips(info)
+                and abs(info.width - piece.width) <= SIZE_TOLERANCE_PX
+                and abs(info.height - piece.height) <= SIZE_TOLERANCE_PX)
+
+    def _evict(self, key):
+        image = self._cache.pop(key)
+        self._cached_bytes -= image.width * image.height * 4
+        self.stats['evicted'] += 1
+
+
+def _prepare(image, piece):
+    """Decode a source and fit it to its placement: RGBA, rotated, at the placed size"""
+    if image.mode != 'RGBA':
+        image = image.convert('RGBA')
+    if piece.rotated:
+        image = image.transpose(Image.Transpose.ROTATE_90)
+    if (abs(image.width - piece.width) > SIZE_TOLERANCE_PX
+            or abs(image.height - piece.height) > SIZE_TOLERANCE_PX):
+        image = image.resize((piece.width, piece.height), Image.Resampling.LANCZOS)
+    elif image.size != (piece.width, piece.height):
+        image = image.crop((0, 0, piece.width, piece.height))
+    else:
+        image.load()
+    return image
+
+
+def render_sheet(placements, output, storage_client, roll_width, length, dpi=300):
+    """Render a gang sheet to a binary file object; see SheetRenderer.render"""
+    renderer = SheetRenderer(storage_client, dpi)
+    renderer.render(placements, output, roll_width, length)
+    return renderer.stats
@@ -0,0 +1,249 @@
+"""
+Memory-bounded decoding of large artwork for preview generation.
+A 22" x 22" RGBA file at 300 DPI is 6600 x 6600 pixels, about 175 MB
+decoded, and several of those at once have run worker processes out of
+memory. Previews only need a fraction of those pixels, so images above
+IMAGE_FULL_DECODE_PIXELS are decoded in strips of rows: each strip is
+decompressed, unfiltered by Pillow and box-reduced straight away, and only
+the reduced image is kept. Peak memory is one strip plus the reduced image,
+whatever the size of the original.
+
+Strips are reduced by the factors Image.thumbnail uses (reducing_gap=2)
+and then resampled like Image.resize does, so RGB previews are identical to
+those from a full decode. Pillow resamples images with alpha at full size
+instead; reducing them first (premultiplied) differs by a few levels at most.
+
+Images above IMAGE_MAX_PIXELS, and large images the strip decoder can't
+read (interlaced, 16-bit or palette PNGs), raise ImageTooLarge instead.
+"""
+
+import math
+import zlib
+import logging
+from io import BytesIO
+
+from PIL import Image
+
+from config import Config
+from png_header import PNGHeaderError, iter_png_chunks, read_png_header
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# Same as the default reducing_gap of Image.thumbnail
+REDUCING_GAP = 2.0
+
+# Bytes per pixel of the 8-bit PNG modes the strip decoder handles
+STRIP_MODES = {'L': 1, 'LA': 2, 'RGB': 3, 'RGBA': 4}
+
+
+class ImageTooLarge(ValueError):
+    """Raised when an image is over the decode budget"""
+
+
+def open_for_previews(image_data, max_size, analysis=None):
+    """Open an image for previews of at most max_size pixels
+
+    Small images are decoded in full. Large ones are reduced while they are
+    decoded and come back already at the size img.thumbnail((max_size,
+    max_size)) would give.
+
+    Args:
+        image_data: Image bytes or a seekable binary file object
+        max_size: Longest side of the largest preview
+        analysis: Optional artwork_analysis.AlphaAnalysis that is given the
+            full-resolution pixels while they are decoded
+
+    Returns a loaded RGB or RGBA image.
+
+    Raises:
+        ImageTooLarge: The image is over the pixel budget
+    """
+    source = BytesIO(image_data) if isinstance(image_data, (bytes, bytearray)) else image_data
+
+    try:
+        info = read_png_header(source)
+    except PNGHeaderError:
+        info = None  # Not a PNG: leave it to PIL
+
+    if info is not None and info.width * info.height > Config.IMAGE_FULL_DECODE_PIXELS:
+        if info.width * info.height > Config.IMAGE_MAX_PIXELS:
+            raise ImageTooLarge(f"Image is {info.width}x{info.height} pixels, "
+                                f"over the limit of {Config.IMAGE_MAX_PIXELS} pixels")
+        size = thumbnail_size(info.width, info.height, max_size)
+        if size is not None:
+            if not can_decode_strips(info):
+                raise ImageTooLarge(f"Image is {info.width}x{info.height} pixels, too large to decode "
+                                    f"in full, and {'interlaced' if info.interlaced else info.mode} "
+                                    f"PNGs can't be decoded in strips")
+            return decode_reduced(source, info, size, on_strip=analysis.add if analysis else None)
+
+    img = Image.open(source)
+    # Keep original mode (RGBA or RGB)
+    if img.mode not in ('RGBA', 'RGB'):
+        img = img.convert('RGBA')
+    img.load()
+    if analysis is not None:
+        analysis.add(img)
+    return img
+
+
+def can_decode_strips(info):
+    """Whether decode_reduced can read a PNG with this header"""
+    return not info.interlaced and info.bit_depth == 8 and info.mode in STRIP_MODES
+
+
+def thumbnail_size(width, height, max_size):
+    """The size Image.thumbnail((max_size, max_size)) gives, or None if it wouldn't shrink"""
+    if max_size >= width and max_size >= height:
+        return None
+
+    def round_aspect(number, key):
+        return max(min(math.floor(number), math.ceil(number), key=key), 1)
+
+    aspect = width / height
+    x = y = max_size
+    if x / y >= aspect:
+        x = round_aspect(y * aspect, key=lambda n: abs(aspect - n / y))
+    else:
+        y = round_aspect(x / aspect, key=lambda n: 0 if n == 0 else abs(aspect - x / n))
+    return x, y
+
+
+def decode_reduced(source, info, size, strip_bytes=None, on_strip=None):
+    """Decode a PNG in strips of rows and resize it to size
+
+    Each strip is box-reduced as soon as it is decoded, by the factors
+    Image.resize would use, and the reduced image is resampled like
+    Image.resize does after its own reduce().
+
+    Args:
+        source: Seekable binary file positioned at the PNG signature
+        info: The file's PNGInfo
+        size: Target (width, height)
+        strip_bytes: Decompressed bytes per strip (default IMAGE_DECODE_STRIP_MB)
+        on_strip: Optional callable given each full-resolution strip, top to bottom
+
+    Returns the image at size (RGBA, or RGB for RGB originals).
+    """
+    width, height = info.width, info.height
+    factor_x = int(width / size[0] / REDUCING_GAP) or 1
+    factor_y = int(height / size[1] / REDUCING_GAP) or 1
+
+    # Same modes as a full decode: RGB stays RGB, the rest becomes RGBA,
+    # which is reduced premultiplied (RGBa) like Image.resize does
+    out_mode = 'RGB' if info.mode == 'RGB' else 'RGBA'
+    work_mode = 'RGB' if out_mode == 'RGB' else 'RGBa'
+    reduced = Image.new(work_mode, (math.ceil(width / factor_x), math.ceil(height / factor_y)))
+
+    y = 0
+    # Whole boxes per strip, so strips reduce independently without seams
+    for part in iter_decoded_strips(source, info, strip_bytes, rows_multiple=factor_y):
+        if on_strip is not None:
+            on_strip(part)
+        if part.mode != out_mode:
+            part = part.convert(out_mode)
+        part = part.convert(work_mode).reduce((factor_x, factor_y))
+        reduced.paste(part, (0, y))
+        y += part.height
+
+    box = (0, 0, width / factor_x, height / factor_y)
+    return reduced.resize(size, Image.Resampling.LANCZOS, box=box).convert(out_mode)
+
+
+def iter_decoded_strips(source, info, strip_bytes=None, rows_multiple=1):
+    """Decode a PNG in strips of rows and yield each as an image in info.mode
+
+    Only one strip is held at a time.
+
+    Args:
+        source: Seekable binary file positioned at the PNG signature
+        info: The file's PNGInfo (see can_decode_strips)
+        strip_bytes: Decompressed bytes per strip (default IMAGE_DECODE_STRIP_MB)
+        rows_multiple: Every strip but the last has a multiple of this many rows
+
+    Raises:
+        PNGHeaderError: The image data is damaged or ends early
+    """
+    width, height = info.width, info.height
+    row_bytes = width * STRIP_MODES[info.mode]
+    strip_bytes = strip_bytes or Config.IMAGE_DECODE_STRIP_MB * MB
+    rows_per_strip = max(1, strip_bytes // (row_bytes + 1) // rows_multiple) * rows_multiple
+
+    previous = bytes(row_bytes)  # Row above the first one is all zeros for the PNG filters
+    rows_done = 0
+    for strip in _iter_strips(source, row_bytes + 1, rows_per_strip):
+        rows = min(len(strip) // (row_bytes + 1), height - rows_done)
+        if rows <= 0:
+            break
+        # Pillow unfilters the rows if they come after the previous row, unfiltered
+        data = zlib.compress(b'\x00' + previous + strip[:rows * (row_bytes + 1)], 0)
+        decoded = Image.frombytes(info.mode, (width, rows + 1), data, 'zip', info.mode)
+        del data
+        previous = decoded.crop((0, rows, width, rows + 1)).tobytes()
+        rows_done += rows
+        part = decoded.crop((0, 1, width, rows + 1))
+        del decoded
+        yield part
+
+    if rows_done < height:
+        raise PNGHeaderError(f"Image data ends after {rows_done} of {height} rows")
+
+
+def _iter_strips(source, row_len, rows_per_strip):
+    """Yield the decompressed image data in strips of rows_per_strip rows"""
+    decompressor = zlib.decompressobj()
+    strip_len = row_len * rows_per_strip
+    pending = bytearray()
+    for chunk_type, data in iter_png_chunks(source):
+        if chunk_type == b'IEND':
+            break
+        if chunk_type != b'IDAT':
+            continue
+        while data:
+            # Cap the output so a highly compressed chunk can't blow the budget
+            pending += decompressor.decompress(data, strip_len - len(pending) + row_len)
+            data = decompressor.unconsumed_tail
+            while len(pending) >= strip_len:
+                yield bytes(pending[:strip_len])
+                del pending[:strip_len]
+    pending += decompressor.flush()
+    while pending:
+        yield bytes(pending[:strip_len])
+        del pending[:strip_len]
+
+
+def reset_peak_memory():
+    """Reset the peak resident memory of this process, where the OS allows it
+
+    Returns True if the next peak_memory_bytes() covers only what runs after
+    this call; otherwise it reports the peak since the process started.
+    """
+    try:
+        # Linux: writing 5 to clear_refs resets VmHWM
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_memory_bytes():
+    """Peak resident memory of this process in bytes, or None if unknown"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is not None:
+        # ru_maxrss is in KB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return None
@@ -0,0 +1,89 @@
+"""
+Ingest pipeline for uploaded artwork.
+An upload is read from the request spool once to hash it, then streamed to
+storage, and nothing in between decodes pixels:
+
+- pixel size and DPI come from the PNG header (png_header), which also
+  rejects files that aren't PNGs; files over the 22 inch print limit or in
+  a colour mode we can't print are rejected before anything is hashed or
+  uploaded. Palette PNGs are accepted, unlike in validate_image, because
+  customers have always uploaded them.
+- the SHA-256 digest gives the content-addressed storage key, so content we
+  already have only gets another catalog reference
+- new content is copied into the local disk cache while it is uploaded, so
+  thumbnail generation on this host (in process or in the image worker)
+  reads the original from local disk instead of downloading what was just
+  uploaded, and decodes it exactly once for every preview size
+
+Needs an application context for the catalog updates.
+"""
+
+import logging
+
+import asset_catalog
+from png_header import read_png_header
+from storage import hash_file
+from utils import PRINT_MODES, check_image, get_content_key, header_image_info
+
+logger = logging.getLogger(__name__)
+
+# Colour modes accepted on upload
+UPLOAD_MODES = PRINT_MODES + ('P',)
+
+
+class InvalidArtwork(ValueError):
+    """Raised for a PNG that can't be printed, e.g. one over the size limit"""
+
+
+class IngestedFile:
+    """An uploaded original after ingest"""
+
+    def __init__(self, file_key, content_hash, size_bytes, image_info, stored):
+        self.file_key = file_key
+        self.content_hash = content_hash
+        self.size_bytes = size_bytes
+        self.image_info = image_info  # width_px, height_px, dpi_x, dpi_y
+        self.stored = stored  # False if the content was already in storage
+
+    def __repr__(self):
+        return f"<IngestedFile {self.file_key} stored={self.stored}>"
+
+
+def ingest_upload(file, original_filename, storage):
+    """Validate, measure, hash and store an uploaded PNG
+
+    Adds a catalog reference for the upload; the caller commits the session
+    together with the OrderItem that uses it.
+
+    Raises:
+        PNGHeaderError: The file is not a PNG or its header is damaged
+        InvalidArtwork: The file is too large to print or in an unsupported colour mode
+        RuntimeError: The file could not be written to storage
+    """
+    # Header only: validates the file and gives pixel size and DPI
+    info = read_png_header(file)
+    problem = check_image(info, UPLOAD_MODES)
+    if problem is not None:
+        raise InvalidArtwork(problem)
+    image_info = header_image_info(info)
+
+    content_hash, size_bytes = hash_file(file)
+    file_key = get_content_key(content_hash, original_filename)
+
+    if asset_catalog.add_reference(file_key) and storage.file_exists(file_key):
+        logger.info(f"{original_filename} is already stored as {file_key}, skipping upload")
+        return IngestedFile(file_key, content_hash, size_bytes, image_info, stored=False)
+
+    # Keep a local copy for thumbnail generation while uploading
+    if not storage.upload_file(file, file_key, keep_cached=True):
+        raise RuntimeError(f"Failed to upload file {original_filename} to storage")
+    logger.info(f"Successfully uploaded {original_filename} to storage as {file_key}")
+
+    asset_catalog.record_upload(
+        file_key,
+        size_bytes=size_bytes,
+        content_hash=content_hash,
+        commit=False,
+        **image_info
+    )
+    return IngestedFile(file_key, content_hash, size_bytes, image_info, stored=True)
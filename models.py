@@ -47,7 +47,10 @@ class Order(db.Model):
 class OrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False, index=True)
+    # Storage key of the artwork; identical uploads share one content-addressed key
     file_key = db.Column(db.String(255), nullable=False, index=True)
+    # Name used for downloads, e.g. ORDER-1_logo_qty-3.png (None for items that predate it)
+    filename = db.Column(db.String(255), nullable=True)
     width_inches = db.Column(db.Float, nullable=False)
     height_inches = db.Column(db.Float, nullable=False)
     quantity = db.Column(db.Integer, nullable=False, default=1)
@@ -62,12 +65,102 @@ class OrderItem(db.Model):
     def format_dimensions(self):
         return f"{self.width_inches:.2f}\" × {self.height_inches:.2f}\""
 
+    @property
+    def display_name(self):
+        """Name shown to users and used for downloads"""
+        return self.filename or self.file_key
+
     def to_dict(self):
         return {
             'id': self.id,
             'file_key': self.file_key,
+            'filename': self.display_name,
             'dimensions': self.format_dimensions(),
             'quantity': self.quantity,
             'cost': f"${self.cost:.2f}",
             'notes': self.notes or ''
-        }
\ No newline at end of file
+        }
+
+class StoredAsset(db.Model):
+    """Catalog entry for an original file in object storage, keyed by OrderItem.file_key"""
+    id = db.Column(db.Integer, primary_key=True)
+    file_key = db.Column(db.String(255), unique=True, nullable=False, index=True)
+    size_bytes = db.Column(db.BigInteger, nullable=True)
+    content_hash = db.Column(db.String(64), nullable=True, index=True)  # SHA-256 hex digest
+    # Number of OrderItems pointing at file_key; the blob is deleted when it drops to 0
+    ref_count = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    width_px = db.Column(db.Integer, nullable=True)
+    height_px = db.Column(db.Integer, nullable=True)
+    dpi_x = db.Column(db.Float, nullable=True)
+    dpi_y = db.Column(db.Float, nullable=True)
+    # Derivative name -> {'key': storage key, 'size': bytes}, e.g. {'thumbnail': {...}}
+    derivatives = db.Column(db.JSON, nullable=False, default=dict)
+    # Alpha analysis from the image worker (artwork_analysis); None until analyzed
+    content_box = db.Column(db.JSON, nullable=True)  # [left, top, right, bottom] of visible pixels
+    ink_coverage = db.Column(db.Float, nullable=True)  # Alpha-weighted percent of the image
+    analyzed_at = db.Column(db.DateTime(timezone=True), nullable=True)
+    created_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def has_derivative(self, name):
+        return name in (self.derivatives or {})
+
+    def has_derivatives(self, names):
+        return all(self.has_derivative(name) for name in names)
+
+    def derivative_key(self, name):
+        entry = (self.derivatives or {}).get(name)
+        return entry['key'] if entry else None
+
+    def derivative_etag(self, name):
+        """Strong ETag of a derivative: the original's hash plus the derivative's name and size"""
+        entry = (self.derivatives or {}).get(name)
+        if not entry or not self.content_hash:
+            return None
+        return f"{self.content_hash}:{name}:{entry.get('size') or 0}"
+
+    @property
+    def printable_size(self):
+        """(width, height) in inches of the visible area at print size, or None if unknown"""
+        if not self.content_box or not self.dpi_x or not self.dpi_y:
+            return None
+        left, top, right, bottom = self.content_box
+        return (right - left) / self.dpi_x, (bottom - top) / self.dpi_y
+
+    def dpi_at(self, width_inches, height_inches):
+        """Effective DPI when the whole image is printed at the given size"""
+        if not self.width_px or not self.height_px or not width_inches or not height_inches:
+            return None
+        return min(self.width_px / width_inches, self.height_px / height_inches)
+
+    def to_dict(self):
+        return {
+            'file_key': self.file_key,
+            'size_bytes': self.size_bytes,
+            'content_hash': self.content_hash,
+            'ref_count': self.ref_count,
+            'width_px': self.width_px,
+            'height_px': self.height_px,
+            'dpi_x': self.dpi_x,
+            'dpi_y': self.dpi_y,
+            'derivatives': self.derivatives or {},
+            'content_box': self.content_box,
+            'ink_coverage': self.ink_coverage,
+            'printable_size': self.printable_size,
+        }
+
+class ScanWatermark(db.Model):
+    """Highest OrderItem id an incremental scan has looked at (see thumbnail_scanner)"""
+    name = db.Column(db.String(50), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class MissingDerivatives(db.Model):
+    """An order item whose previews did not all exist when it was scanned"""
+    __tablename__ = 'missing_derivatives'
+    # No foreign key: rows of deleted items are dropped by the next scan
+    order_item_id = db.Column(db.Integer, primary_key=True)
+    file_key = db.Column(db.String(255), nullable=False, index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)  # Times thumbnails were queued for it
+    found_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow)
+    queued_at = db.Column(db.DateTime(timezone=True), nullable=True)
@@ -0,0 +1,254 @@
+"""
+Gang-sheet nesting: packs order items onto fixed-width roll film.
+Every copy of an item (OrderItem.quantity) becomes one rectangular piece,
+and pieces are placed with a skyline bottom-left heuristic: the roll is
+described by the profile of its current top edge, and each piece, largest
+first, goes where its top edge ends lowest, optionally turned 90 degrees.
+The goal is the shortest length of film; since no single "largest first"
+order is best for every mix of sizes, a few are tried and the shortest
+layout wins.
+
+Positions are computed in integer thousandths of an inch, so the packer
+is exact and fast: thousands of pieces take well under a second.
+"""
+
+import logging
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+UNITS_PER_INCH = 1000
+
+
+class Piece:
+    """One rectangle to place; key identifies what it is a copy of"""
+
+    def __init__(self, key, width, height):
+        self.key = key
+        self.width = width
+        self.height = height
+
+    def __repr__(self):
+        return f"<Piece {self.key} {self.width}x{self.height}>"
+
+
+class Placement:
+    """Where a piece went on the roll, in inches from the top-left corner"""
+
+    def __init__(self, key, x, y, width, height, rotated):
+        self.key = key
+        self.x = x
+        self.y = y
+        self.width = width  # As placed, i.e. swapped if rotated
+        self.height = height
+        self.rotated = rotated
+
+    def to_dict(self):
+        return {
+            'key': self.key,
+            'x': self.x,
+            'y': self.y,
+            'width': self.width,
+            'height': self.height,
+            'rotated': self.rotated,
+        }
+
+    def __repr__(self):
+        return f"<Placement {self.key} at {self.x},{self.y}{' rotated' if self.rotated else ''}>"
+
+
+class Layout:
+    """A packed roll"""
+
+    def __init__(self, roll_width, length, placements, spacing=0.0):
+        self.roll_width = roll_width
+        self.length = length
+        self.placements = placements
+        self.spacing = spacing
+
+    @property
+    def used_area(self):
+        return sum(p.width * p.height for p in self.placements)
+
+    @property
+    def efficiency(self):
+        """Share of the film covered by pieces, 0-1"""
+        film = self.roll_width * self.length
+        return self.used_area / film if film else 0.0
+
+    def to_dict(self):
+        return {
+            'roll_width': self.roll_width,
+            'length': self.length,
+            'spacing': self.spacing,
+            'efficiency': round(self.efficiency, 4),
+            'placements': [p.to_dict() for p in self.placements],
+        }
+
+
+def pieces_from_items(items):
+    """One Piece per copy of each OrderItem, keyed by the item"""
+    pieces = []
+    for item in items:
+        pieces.extend(Piece(item, item.width_inches, item.height_inches) for _ in range(item.quantity or 1))
+    return pieces
+
+
+def pack_items(items, roll_width=None, spacing=None, allow_rotation=True):
+    """Pack OrderItems (quantity copies each) onto a roll; see pack()"""
+    return pack(pieces_from_items(items), roll_width, spacing, allow_rotation)
+
+
+def _units(inches):
+    return round(inches * UNITS_PER_INCH)
+
+
+def pack(pieces, roll_width=None, spacing=None, allow_rotation=True):
+    """Place pieces on a roll of roll_width inches, minimising its length
+
+    Args:
+        pieces: Iterable of Piece
+        roll_width: Printable film width (default NESTING_ROLL_WIDTH_INCHES)
+        spacing: Gap kept between pieces (default NESTING_SPACING_INCHES);
+            there is none at the edges of the film
+        allow_rotation: Whether pieces may be turned 90 degrees
+
+    Returns a Layout with one Placement per piece.
+
+    Raises:
+        ValueError: A piece doesn't fit across the roll in any allowed orientation
+    """
+    roll_width = Config.NESTING_ROLL_WIDTH_INCHES if roll_width is None else roll_width
+    spacing = Config.NESTING_SPACING_INCHES if spacing is None else spacing
+    gap = _units(spacing)
+    # Every piece is padded by the gap on its right and bottom, so widen the
+    # roll by one gap to allow pieces flush with the right edge
+    roll = _units(roll_width) + gap
+
+    sized = []
+    for piece in pieces:
+        w, h = _units(piece.width), _units(piece.height)
+        if w <= 0 or h <= 0:
+            raise ValueError(f"Piece {piece.key} has no area")
+        fits, fits_rotated = w + gap <= roll, allow_rotation and h + gap <= roll
+        if not fits and not fits_rotated:
+            raise ValueError(f"Piece {piece.key} ({piece.width}\" x {piece.height}\") "
+                             f"is wider than the {roll_width}\" roll")
+        sized.append((piece, w + gap, h + gap, fits, fits_rotated))
+
+    # No order suits every mix of sizes, so try each and keep the shortest roll.
+    # Turning pieces greedily can also lose to keeping them upright (e.g. many
+    # copies of one size), so with rotation both are tried.
+    best = None
+    for order in ORDERS:
+        ordered = sorted(sized, key=order, reverse=True)
+        for rotate in ((True, False) if allow_rotation else (False,)):
+            skyline, placements = _place(ordered, roll, gap, rotate)
+            if best is None or skyline.height < best[0].height:
+                best = skyline, placements
+    skyline, placements = best
+
+    length = max((skyline.height - gap) / UNITS_PER_INCH, 0.0)
+    return Layout(roll_width, length, placements, spacing)
+
+
+# Sort keys for (piece, width, height, ...) entries, largest first
+ORDERS = (
+    lambda s: (max(s[1], s[2]), min(s[1], s[2])),  # Longest side
+    lambda s: (s[2], s[1]),  # Height
+    lambda s: (s[1] * s[2], s[2]),  # Area
+    lambda s: (s[1], s[2]),  # Width
+)
+
+
+def _place(sized, roll, gap, rotate):
+    """Place sized pieces in the given order; returns (skyline, placements)
+
+    Without rotate, only pieces that don't fit upright are turned.
+    """
+    skyline = _Skyline(roll)
+    placements = []
+    for piece, w, h, fits, fits_rotated in sized:
+        best = skyline.find(w, h) if fits else None
+        rotated = False
+        if fits_rotated and (rotate or not fits) and w != h:
+            turned = skyline.find(h, w, best[0] if best else None)
+            if turned is not None and (best is None or turned < best):
+                best, rotated = turned, True
+        top, x, index = best
+        if rotated:
+            w, h = h, w
+        skyline.place(index, x, w, top)
+        placements.append(Placement(piece.key, x / UNITS_PER_INCH, (top - h) / UNITS_PER_INCH,
+                                    (w - gap) / UNITS_PER_INCH, (h - gap) / UNITS_PER_INCH, rotated))
+    return skyline, placements
+
+
+class _Skyline:
+    """Top edge of the placed pieces as segments of (x, y, width), left to right"""
+
+    def __init__(self, width):
+        self.xs = [0]
+        self.ys = [0]
+        self.ws = [width]
+        self.width = width
+        self.height = 0
+
+    def find(self, w, h, limit=None):
+        """Lowest (top, x, segment index) for a w x h piece, or None
+
+        Positions whose top would not be lower than limit are skipped.
+        """
+        xs, ys, ws = self.xs, self.ys, self.ws
+        right_edge = self.width
+        best = None
+        best_top = limit
+        count = len(xs)
+        for i in range(count):
+            x = xs[i]
+            if x + w > right_edge:
+                break
+            y = ys[i]
+            if best_top is not None and y + h >= best_top:
+                continue
+            # The piece rests on the highest segment it spans
+            right = x + w
+            j = i
+            while xs[j] + ws[j] < right:
+                j += 1
+                if ys[j] > y:
+                    y = ys[j]
+                    if best_top is not None and y + h >= best_top:
+                        break
+            top = y + h
+            if best_top is None or top < best_top:
+                best_top = top
+                best = (top, x, i)
+        return best
+
+    def place(self, index, x, w, top):
+        """Raise the skyline to top over [x, x + w), starting at segment index"""
+        xs, ys, ws = self.xs, self.ys, self.ws
+        right = x + w
+        # Drop the segments the piece covers entirely, trim the last one
+        end = index
+        while end < len(xs) and xs[end] + ws[end] <= right:
+            end += 1
+        if end < len(xs) and xs[end] < right:
+            ws[end] -= right - xs[end]
+            xs[end] = right
+        xs[index:end] = [x]
+        ys[index:end] = [top]
+        ws[index:end] = [w]
+
+        # Merge with neighbours at the same height
+        if index + 1 < len(xs) and ys[index + 1] == top:
+            ws[index] += ws[index + 1]
+            del xs[index + 1], ys[index + 1], ws[index + 1]
+        if index > 0 and ys[index - 1] == top:
+            ws[index - 1] += ws[index]
+            del xs[index], ys[index], ws[index]
+
+        if top > self.height:
+            self.height = top
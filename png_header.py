@@ -0,0 +1,158 @@
+"""
+Header-only PNG reader.
+Reads the signature, the IHDR chunk (pixel size, bit depth, color type) and
+the pHYs chunk (DPI) and stops at the first IDAT chunk, so only the first
+few KB of a file are read however large it is. Chunks in between (ICC
+profiles, text) are skipped with seek() when the file supports it.
+
+DPI follows PIL: pixels per metre * 0.0254 when pHYs is in metres, else
+unknown (callers default to 96).
+"""
+
+import io
+import struct
+import zlib
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# IHDR color type -> PIL image mode
+COLOR_TYPE_MODES = {
+    0: 'L',
+    2: 'RGB',
+    3: 'P',
+    4: 'LA',
+    6: 'RGBA',
+}
+
+DEFAULT_DPI = 96
+MAX_HEADER_BYTES = 1024 * 1024  # Give up looking for pHYs after this much ancillary data
+
+
+class PNGHeaderError(ValueError):
+    """Raised when a file is not a readable PNG"""
+
+
+class PNGInfo:
+    """Header fields of a PNG file"""
+
+    def __init__(self, width, height, bit_depth, color_type, interlaced, dpi=None, bytes_read=0):
+        self.width = width
+        self.height = height
+        self.bit_depth = bit_depth
+        self.color_type = color_type
+        self.interlaced = interlaced
+        self.dpi = dpi  # (x, y) or None if the file doesn't say
+        self.bytes_read = bytes_read
+
+    @property
+    def mode(self):
+        """PIL image mode the file decodes to, e.g. 'RGBA'"""
+        mode = COLOR_TYPE_MODES.get(self.color_type, 'unknown')
+        if mode == 'L' and self.bit_depth == 16:
+            return 'I;16'
+        if mode == 'L' and self.bit_depth == 1:
+            return '1'
+        return mode
+
+    @property
+    def dpi_or_default(self):
+        return self.dpi or (DEFAULT_DPI, DEFAULT_DPI)
+
+    def __repr__(self):
+        return f"<PNGInfo {self.width}x{self.height} {self.mode} dpi={self.dpi}>"
+
+
+def _read_exact(file_data, size):
+    data = file_data.read(size)
+    if len(data) != size:
+        raise PNGHeaderError("Unexpected end of file in PNG header")
+    return data
+
+
+def _skip(file_data, size):
+    """Skip size bytes, seeking when possible"""
+    try:
+        if file_data.seekable():
+            file_data.seek(size, io.SEEK_CUR)
+            return
+    except (AttributeError, io.UnsupportedOperation):
+        pass
+    _read_exact(file_data, size)
+
+
+def _read_chunk(file_data, check_crc=True):
+    """Read one whole chunk and return (type, data)"""
+    length, chunk_type = struct.unpack('>I4s', _read_exact(file_data, 8))
+    data = _read_exact(file_data, length)
+    crc, = struct.unpack('>I', _read_exact(file_data, 4))
+    if check_crc and zlib.crc32(chunk_type + data) != crc:
+        raise PNGHeaderError(f"Corrupt {chunk_type.decode('latin-1')} chunk in PNG header")
+    return chunk_type, data
+
+
+def read_png_header(file_data, max_header_bytes=MAX_HEADER_BYTES):
+    """Read the header of a PNG file without decoding any pixels
+
+    The file position is restored afterwards so the file can still be read
+    or uploaded.
+
+    Raises:
+        PNGHeaderError: The file is not a PNG or its header is damaged
+    """
+    position = file_data.tell()
+    try:
+        return _read_png_header(file_data, max_header_bytes)
+    finally:
+        file_data.seek(position)
+
+
+def _read_png_header(file_data, max_header_bytes):
+    start = file_data.tell()
+    if file_data.read(len(PNG_SIGNATURE)) != PNG_SIGNATURE:
+        raise PNGHeaderError("Only PNG files are supported")
+
+    chunk_type, data = _read_chunk(file_data)
+    if chunk_type != b'IHDR' or len(data) != 13:
+        raise PNGHeaderError("PNG file does not start with an IHDR chunk")
+    width, height, bit_depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', data)
+    if width == 0 or height == 0 or color_type not in COLOR_TYPE_MODES:
+        raise PNGHeaderError("Invalid PNG header")
+
+    info = PNGInfo(width, height, bit_depth, color_type, interlace == 1)
+
+    # pHYs must come before the image data; skip everything else until then
+    while file_data.tell() - start < max_header_bytes:
+        length, chunk_type = struct.unpack('>I4s', _read_exact(file_data, 8))
+        if chunk_type in (b'IDAT', b'IEND'):
+            break
+        if chunk_type == b'pHYs' and length == 9:
+            data = _read_exact(file_data, length)
+            crc, = struct.unpack('>I', _read_exact(file_data, 4))
+            if zlib.crc32(chunk_type + data) != crc:
+                raise PNGHeaderError("Corrupt pHYs chunk in PNG header")
+            px, py, unit = struct.unpack('>IIB', data)
+            if unit == 1:  # Pixels per metre
+                info.dpi = (px * 0.0254, py * 0.0254)
+            break
+        _skip(file_data, length + 4)
+
+    info.bytes_read = file_data.tell() - start
+    return info
+
+
+def iter_png_chunks(file_data, check_crc=True):
+    """Yield (type, data) for every chunk of a PNG file from its current position
+
+    Reads one chunk at a time, so memory use is bounded by the largest chunk
+    (IDAT chunks are usually 8-64 KB) rather than the file size.
+
+    Raises:
+        PNGHeaderError: The file is not a PNG or a chunk is damaged
+    """
+    if file_data.read(len(PNG_SIGNATURE)) != PNG_SIGNATURE:
+        raise PNGHeaderError("Only PNG files are supported")
+    while True:
+        chunk_type, data = _read_chunk(file_data, check_crc)
+        yield chunk_type, data
+        if chunk_type == b'IEND':
+            return
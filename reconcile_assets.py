@@ -0,0 +1,29 @@
+"""
+Rebuild the asset catalog (StoredAsset table) from the object storage listing.
+Run this once after deploying the catalog, and again whenever storage was
+changed outside the app.
+
+Usage:
+    python reconcile_assets.py [--hash]
+"""
+import argparse
+import logging
+from app import app, storage
+import asset_catalog
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the asset catalog from object storage")
+    parser.add_argument('--hash', action='store_true',
+                        help="Also download each original to compute its content hash")
+    args = parser.parse_args()
+
+    with app.app_context():
+        counts = asset_catalog.reconcile(storage, compute_hashes=args.hash)
+        logger.info("Added %d, updated %d, removed %d entries; %d order files missing from storage",
+                    counts['added'], counts['updated'], counts['removed'], counts['missing'])
+
+if __name__ == "__main__":
+    main()
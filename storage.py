@@ -1,109 +1,522 @@
 import os
+import io
+import shutil
+import hashlib
 import logging
-from replit.object_storage import Client as ObjectStorageClient
-import time
+import tempfile
+import threading
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from storage_backends import CHUNK_SIZE, LIST_PAGE_SIZE, StorageObjectNotFound, create_backend
+from storage_resilience import CircuitBreaker, ResiliencePolicy, default_breaker
+from storage_cache import CacheFillReader, create_cache
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)  # Changed from DEBUG to INFO to reduce logging overhead
 
-BUCKET_ID = "replit-objstore-c3fb67d8-cc58-4f6a-8303-0ada7212ebd1"
+BUCKET_ID = Config.STORAGE_BUCKET_ID
+
+def iter_chunks(reader, chunk_size=CHUNK_SIZE):
+    """Yield chunks from a file object and close it when done"""
+    try:
+        while True:
+            chunk = reader.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        reader.close()
+
+class HashingReader:
+    """File-like wrapper that hashes data as it is read
+
+    Rewinding to the start (as an upload retry does) resets the hash.
+    """
+
+    def __init__(self, reader, algorithm='sha256'):
+        self.reader = reader
+        self.algorithm = algorithm
+        self.bytes_read = 0
+        self._hash = hashlib.new(algorithm)
+
+    def read(self, size=-1):
+        data = self.reader.read(size)
+        self._hash.update(data)
+        self.bytes_read += len(data)
+        return data
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if offset != 0 or whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("HashingReader can only be rewound to the start")
+        self._hash = hashlib.new(self.algorithm)
+        self.bytes_read = 0
+        return self.reader.seek(0)
+
+    def tell(self):
+        return self.bytes_read
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+def hash_file(reader, algorithm='sha256', chunk_size=CHUNK_SIZE):
+    """Hash a seekable file object in chunks and rewind it
+
+    Returns (hex digest, size in bytes).
+    """
+    reader.seek(0)
+    hashing_reader = HashingReader(reader, algorithm)
+    while hashing_reader.read(chunk_size):
+        pass
+    reader.seek(0)
+    return hashing_reader.hexdigest(), hashing_reader.bytes_read
+
+class BatchResult:
+    """Per-key outcome of a batched storage operation
+
+    Attributes:
+        results: key -> result of the operation for keys that succeeded
+        errors: key -> error message for keys that failed
+    """
+
+    def __init__(self):
+        self.results = {}
+        self.errors = {}
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def __repr__(self):
+        return f"<BatchResult {len(self.results)} ok, {len(self.errors)} failed>"
+
+def get_reader_size(reader):
+    """Return the size in bytes of a seekable file object without reading it"""
+    try:
+        return os.fstat(reader.fileno()).st_size
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        position = reader.tell()
+        size = reader.seek(0, io.SEEK_END)
+        reader.seek(position)
+        return size
 
 class ObjectStorage:
-    def __init__(self, max_retries=3, retry_delay=1):
-        """Initialize object storage client with retry logic"""
+    def __init__(self, max_retries=3, retry_delay=None, backend=None, cache=None, use_cache=True,
+                 max_concurrency=None, policy=None):
+        """Initialize object storage client with retry logic
+
+        Nothing is sent to storage here; the backend connection is created on
+        first use (see the backend property and health_check).
+
+        Args:
+            max_retries: Number of attempts for each storage call
+            retry_delay: Backoff before the first retry in seconds, doubled for
+                         every further retry (defaults to STORAGE_RETRY_BASE_DELAY)
+            backend: A storage_backends.StorageBackend instance, or None to
+                     use the backend configured by STORAGE_BACKEND
+            cache: A storage_cache.DiskCache for reads, or None to use the
+                   cache configured by STORAGE_CACHE_DIR
+            use_cache: Set to False to read straight from the backend
+            max_concurrency: Size of the thread pool behind get_many, put_many,
+                             delete_many and open_many (defaults to STORAGE_MAX_CONCURRENCY)
+            policy: A storage_resilience.ResiliencePolicy, or None to build one.
+                    The configured backend shares the process-wide circuit
+                    breaker; an explicitly passed backend gets its own.
+        """
         self.max_retries = max_retries
-        self.retry_delay = retry_delay
-        self._init_client()
+        self.retry_delay = retry_delay if retry_delay is not None else Config.STORAGE_RETRY_BASE_DELAY
+        self.max_concurrency = max_concurrency or Config.STORAGE_MAX_CONCURRENCY
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self.policy = policy or ResiliencePolicy(
+            max_attempts=max_retries,
+            base_delay=self.retry_delay,
+            max_delay=Config.STORAGE_RETRY_MAX_DELAY,
+            breaker=default_breaker if backend is None else CircuitBreaker(
+                failure_threshold=Config.STORAGE_BREAKER_THRESHOLD,
+                reset_timeout=Config.STORAGE_BREAKER_RESET_TIMEOUT,
+            ),
+        )
+        self._backend = backend
+        self._backend_lock = threading.Lock()
+        self.cache = cache if cache is not None or not use_cache else create_cache()
 
-    def _init_client(self):
-        """Initialize the client with retry logic"""
-        attempt = 0
-        last_error = None
+    @property
+    def backend(self):
+        """The storage backend, created on first access"""
+        if self._backend is None:
+            with self._backend_lock:
+                if self._backend is None:
+                    try:
+                        self._backend = create_backend()
+                    except Exception as e:
+                        logger.error(f"Failed to initialize storage backend: {str(e)}")
+                        raise RuntimeError(f"Failed to initialize storage: {str(e)}")
+                    logger.info(f"Successfully initialized {self._backend.name} storage backend")
+        return self._backend
 
-        while attempt < self.max_retries:
-            try:
-                # Initialize with specific bucket ID
-                self.client = ObjectStorageClient(bucket_id=BUCKET_ID)
-                # Test the connection by listing bucket contents
-                files = self.client.list()
-                logger.info(f"Successfully initialized Replit Object Storage client for bucket: {BUCKET_ID}")
-                logger.debug(f"Found {len(files)} files in bucket")
-                return
-            except Exception as e:
-                last_error = e
-                attempt += 1
-                if attempt < self.max_retries:
-                    logger.warning(f"Failed to initialize storage (attempt {attempt}): {str(e)}")
-                    time.sleep(self.retry_delay)
-                else:
-                    logger.error(f"Failed to initialize Replit Object Storage client after {self.max_retries} attempts: {str(e)}")
-                    raise RuntimeError(f"Failed to initialize storage: {str(e)}")
-
-    def upload_file(self, file_data, filename):
-        """Upload a file to object storage with retry logic"""
-        attempt = 0
-        while attempt < self.max_retries:
-            try:
-                logger.debug(f"Attempting to upload file: {filename}")
-                # Read file content
-                file_content = file_data.read()
-                # Upload using the client's method
-                self.client.upload_from_bytes(filename, file_content)
-                logger.info(f"Successfully uploaded file {filename} to storage")
-                return True
-            except Exception as e:
-                attempt += 1
-                if attempt < self.max_retries:
-                    logger.warning(f"Failed to upload file (attempt {attempt}): {str(e)}")
-                    time.sleep(self.retry_delay)
-                    # Reset file pointer for next attempt
-                    file_data.seek(0)
-                else:
-                    logger.error(f"Error uploading file to object storage after {self.max_retries} attempts: {str(e)}")
-                    return False
+    def health_check(self):
+        """Return True if storage answers a minimal listing request"""
+        try:
+            self._call('list', self.backend.health_check)
+            return True
+        except Exception as e:
+            logger.error(f"Storage health check failed: {str(e)}")
+            return False
+
+    def _call(self, operation, func, *args, on_retry=None):
+        """Run a backend call under the retry/circuit-breaker policy"""
+        return self.policy.call(operation, func, *args, on_retry=on_retry)
+
+    def upload_file(self, file_data, filename, keep_cached=False):
+        """Upload a file to object storage with retry logic
+
+        With keep_cached the file is copied into the disk cache while it is
+        uploaded, so the next read of it on this host is local.
+        """
+        try:
+            self._upload(file_data, filename, keep_cached)
+            return True
+        except Exception as e:
+            logger.error(f"Error uploading file {filename} to object storage: {str(e)}")
+            return False
+
+    def _upload(self, file_data, filename, keep_cached=False):
+        """Upload a file or raise the storage error"""
+        logger.debug(f"Attempting to upload file: {filename}")
+        source = self._wrap_for_cache(filename, file_data, auto_commit=False) if keep_cached else file_data
+        # Stream the file content to the backend in chunks, rewinding before a retry
+        try:
+            self._call('upload', self.backend.upload_stream, filename, source,
+                       on_retry=lambda: source.seek(0))
+        except Exception:
+            if source is not file_data:
+                source.finish(keep=False)
+            raise
+        logger.info(f"Successfully uploaded file {filename} to storage")
+        generation = self._invalidate_cached(filename)
+        if source is not file_data:
+            # This upload's own copy is the new content, so it survives the invalidation
+            source.finish(generation=generation)
 
     def get_file(self, filename):
         """Get a file from object storage with retry logic"""
-        attempt = 0
-        while attempt < self.max_retries:
-            try:
-                logger.debug(f"Attempting to retrieve file {filename}")
-                # Download file content as bytes
-                data = self.client.download_as_bytes(filename)
-                logger.info(f"Successfully retrieved file {filename} from storage")
-                return data
-            except Exception as e:
-                attempt += 1
-                if attempt < self.max_retries:
-                    logger.warning(f"Failed to retrieve file (attempt {attempt}): {str(e)}")
-                    time.sleep(self.retry_delay)
-                else:
-                    logger.error(f"Error retrieving file from object storage after {self.max_retries} attempts: {str(e)}")
-                    return None
+        try:
+            return self._get(filename)
+        except StorageObjectNotFound:
+            logger.warning(f"File {filename} not found in storage")
+        except Exception as e:
+            logger.error(f"Error retrieving file {filename} from object storage: {str(e)}")
+        return None
+
+    def _get(self, filename):
+        """Return the content of a file or raise the storage error"""
+        cached = self._open_cached(filename)
+        if cached is not None:
+            with cached:
+                return cached.read()
+
+        logger.debug(f"Attempting to retrieve file {filename}")
+        generation = self._cache_generation(filename)
+        data = self._call('get', self.backend.download_bytes, filename)
+        logger.info(f"Successfully retrieved file {filename} from storage")
+        self._cache_bytes(filename, data, generation)
+        return data
+
+    def open_file(self, filename):
+        """Open a file in object storage for streaming reads with retry logic
+
+        Returns a seekable binary file object that the caller must close,
+        or None if the file could not be opened.
+        """
+        try:
+            return self._open(filename)
+        except StorageObjectNotFound:
+            logger.warning(f"File {filename} not found in storage")
+        except Exception as e:
+            logger.error(f"Error opening file {filename} from object storage: {str(e)}")
+        return None
+
+    def _open(self, filename):
+        """Open a file for streaming reads or raise the storage error"""
+        cached = self._open_cached(filename)
+        if cached is not None:
+            return cached
+        generation = self._cache_generation(filename)
+        return self._wrap_for_cache(filename, self._open_remote(filename), generation=generation)
+
+    def _open_remote(self, filename):
+        """Open a file in the backend, bypassing the cache, or raise the storage error"""
+        logger.debug(f"Attempting to open file {filename}")
+        reader = self._call('open', self.backend.open_read, filename)
+        logger.info(f"Successfully opened file {filename} from storage")
+        return reader
+
+    def iter_file(self, filename, chunk_size=CHUNK_SIZE):
+        """Get an iterator over the chunks of a file, or None if it could not be opened"""
+        reader = self.open_file(filename)
+        if reader is None:
+            return None
+        return iter_chunks(reader, chunk_size)
 
     def delete_file(self, filename):
         """Delete a file from object storage with retry logic"""
-        attempt = 0
-        while attempt < self.max_retries:
+        try:
+            self._delete(filename)
+            return True
+        except Exception as e:
+            logger.error(f"Error deleting file {filename} from object storage: {str(e)}")
+            return False
+
+    def _delete(self, filename):
+        """Delete a file or raise the storage error"""
+        self._invalidate_cached(filename)
+        self._call('delete', self.backend.delete, filename)
+        logger.info(f"Successfully deleted file {filename} from storage")
+
+    def file_exists(self, filename):
+        """Check whether a file exists without downloading it"""
+        try:
+            return self._call('exists', self.backend.exists, filename)
+        except Exception as e:
+            logger.error(f"Error checking file {filename} in storage: {str(e)}")
+            return False
+
+    def list_files(self, prefix=None, page_size=LIST_PAGE_SIZE):
+        """Yield the names of files in the bucket, fetched page by page
+
+        Args:
+            prefix: Only list files whose names start with prefix
+            page_size: Number of names requested from storage at a time
+
+        Unlike the other methods this raises on a storage error instead of
+        returning an empty result, so a failed listing can't be mistaken
+        for an empty bucket.
+        """
+        start_after = None
+        count = 0
+        while True:
             try:
-                self.client.delete(filename)
-                logger.info(f"Successfully deleted file {filename} from storage")
-                return True
+                names = self._call('list', self.backend.list_page, prefix, start_after, page_size)
             except Exception as e:
-                attempt += 1
-                if attempt < self.max_retries:
-                    logger.warning(f"Failed to delete file (attempt {attempt}): {str(e)}")
-                    time.sleep(self.retry_delay)
-                else:
-                    logger.error(f"Error deleting file from object storage after {self.max_retries} attempts: {str(e)}")
-                    return False
-
-    def list_files(self):
-        """List all files in the bucket"""
-        try:
-            files = self.client.list()
-            logger.info(f"Successfully listed {len(files)} files from storage")
-            return files
+                logger.error(f"Error listing files in storage after {count} files: {str(e)}")
+                raise
+            count += len(names)
+            yield from names
+            if len(names) < page_size:
+                break
+            start_after = names[-1]
+        logger.info(f"Successfully listed {count} files from storage")
+
+    def resilience_stats(self):
+        """Return circuit breaker state and per-operation retry/failure counters"""
+        return self.policy.stats()
+
+    def get_many(self, filenames, max_concurrency=None):
+        """Get several files concurrently
+
+        Returns a BatchResult whose results map each filename to its bytes.
+        """
+        batch = BatchResult()
+        for filename, data, error in self._map_ordered(self._get, filenames, max_concurrency):
+            if error is None:
+                batch.results[filename] = data
+            else:
+                batch.errors[filename] = error
+        return batch
+
+    def put_many(self, files, max_concurrency=None):
+        """Upload several files concurrently
+
+        Args:
+            files: Mapping of filename -> bytes or readable file object
+
+        Returns a BatchResult whose results map each uploaded filename to True.
+        """
+        def put(filename):
+            data = files[filename]
+            self._upload(BytesIO(data) if isinstance(data, bytes) else data, filename)
+            return True
+
+        batch = BatchResult()
+        for filename, ok, error in self._map_ordered(put, list(files), max_concurrency):
+            if error is None:
+                batch.results[filename] = True
+            else:
+                batch.errors[filename] = error
+        return batch
+
+    def delete_many(self, filenames, max_concurrency=None):
+        """Delete several files concurrently
+
+        Returns a BatchResult whose results map each deleted filename to True.
+        """
+        def delete(filename):
+            self._delete(filename)
+            return True
+
+        batch = BatchResult()
+        for filename, ok, error in self._map_ordered(delete, filenames, max_concurrency):
+            if error is None:
+                batch.results[filename] = True
+            else:
+                batch.errors[filename] = error
+        return batch
+
+    def exists_many(self, filenames, max_concurrency=None):
+        """Check several files for existence concurrently
+
+        Returns a BatchResult whose results map each filename to True/False.
+        """
+        def exists(filename):
+            return self._call('exists', self.backend.exists, filename)
+
+        batch = BatchResult()
+        for filename, exists, error in self._map_ordered(exists, filenames, max_concurrency):
+            if error is None:
+                batch.results[filename] = exists
+            else:
+                batch.errors[filename] = error
+        return batch
+
+    def open_many(self, filenames, max_concurrency=None):
+        """Fetch several files concurrently and yield them in order as they are needed
+
+        Each file is downloaded into a temporary file, at most max_concurrency
+        ahead of the one being consumed, so memory stays bounded no matter how
+        many files there are. Yields (filename, file object or None, error);
+        the caller must close each file object.
+        """
+        results = self._map_ordered(self._fetch_to_tempfile, filenames, max_concurrency,
+                                    discard=_close_quietly)
+        try:
+            for filename, reader, error in results:
+                yield filename, reader, error
+        finally:
+            results.close()
+
+    def _fetch_to_tempfile(self, filename):
+        """Copy a storage file into a rewound temporary file or raise the storage error
+
+        Files in the disk cache are already local and are returned as they are.
+        """
+        cached = self._open_cached(filename)
+        if cached is not None:
+            return cached
+        generation = self._cache_generation(filename)
+        reader = self._wrap_for_cache(filename, self._open_remote(filename), generation=generation)
+        tmp = tempfile.TemporaryFile()
+        try:
+            with reader:
+                shutil.copyfileobj(reader, tmp, CHUNK_SIZE)
+            tmp.seek(0)
+            return tmp
+        except Exception:
+            tmp.close()
+            raise
+
+    def _executor(self):
+        """Return the shared thread pool for batched operations"""
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                                thread_name_prefix='storage')
+            return self._pool
+
+    def _map_ordered(self, func, keys, max_concurrency=None, discard=None):
+        """Run func over keys on the shared pool and yield (key, result, error) in key order
+
+        At most max_concurrency calls are in flight for this batch. If the
+        consumer stops early, results still in flight are passed to discard.
+        """
+        keys = list(keys)
+        limit = max(1, min(max_concurrency or self.max_concurrency, self.max_concurrency))
+        pool = self._executor()
+        futures = [pool.submit(func, key) for key in keys[:limit]]
+        try:
+            for index, key in enumerate(keys):
+                if index + limit < len(keys):
+                    futures.append(pool.submit(func, keys[index + limit]))
+                future, futures[index] = futures[index], None
+                try:
+                    yield key, future.result(), None
+                except StorageObjectNotFound:
+                    logger.warning(f"File {key} not found in storage")
+                    yield key, None, "File not found"
+                except Exception as e:
+                    logger.error(f"Error in batched storage operation for {key}: {str(e)}")
+                    yield key, None, str(e)
+        finally:
+            for future in futures:
+                if future is not None and not future.cancel() and discard is not None:
+                    future.add_done_callback(lambda f: f.exception() is None and discard(f.result()))
+
+    def cache_stats(self):
+        """Return disk cache statistics, or None if the cache is disabled"""
+        if self.cache is None:
+            return None
+        try:
+            return self.cache.stats()
+        except Exception as e:
+            logger.warning(f"Error reading storage cache stats: {str(e)}")
+            return None
+
+    def _open_cached(self, filename):
+        """Open the cached copy of a file, or return None"""
+        if self.cache is None:
+            return None
+        try:
+            return self.cache.open(filename)
+        except Exception as e:
+            logger.warning(f"Error reading {filename} from storage cache: {str(e)}")
+            return None
+
+    def _cache_generation(self, filename):
+        """The cache generation of a file, taken before it is read from storage (see DiskCache)"""
+        if self.cache is None:
+            return None
+        try:
+            return self.cache.generation(filename)
         except Exception as e:
-            logger.error(f"Error listing files in storage: {str(e)}")
-            return []
\ No newline at end of file
+            logger.warning(f"Error reading storage cache generation of {filename}: {str(e)}")
+            return None
+
+    def _wrap_for_cache(self, filename, reader, auto_commit=True, generation=None):
+        """Wrap a reader so the cache fills while the caller streams the file"""
+        if self.cache is None:
+            return reader
+        try:
+            return CacheFillReader(reader, self.cache.new_writer(filename, generation), auto_commit)
+        except Exception as e:
+            logger.warning(f"Error preparing storage cache entry for {filename}: {str(e)}")
+            return reader
+
+    def _cache_bytes(self, filename, data, generation=None):
+        """Add downloaded file content to the cache"""
+        if self.cache is None:
+            return
+        try:
+            self.cache.put_bytes(filename, data, generation)
+        except Exception as e:
+            logger.warning(f"Error adding {filename} to storage cache: {str(e)}")
+
+    def _invalidate_cached(self, filename):
+        """Drop a file from the cache after it was replaced or deleted
+
+        Returns the file's new cache generation, or None.
+        """
+        if self.cache is None:
+            return None
+        try:
+            return self.cache.invalidate(filename)
+        except Exception as e:
+            logger.warning(f"Error invalidating {filename} in storage cache: {str(e)}")
+            return None
+
+def _close_quietly(file_obj):
+    """Close a file object returned by a batched read that nobody consumed"""
+    if file_obj is not None:
+        try:
+            file_obj.close()
+        except Exception:
+            pass
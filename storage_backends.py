@@ -0,0 +1,333 @@
+"""
+Storage backends for ObjectStorage.
+ObjectStorage keeps the retry logic and the public API used by the app and the
+worker; the backend only knows how to move bytes in and out of one place:
+- ReplitStorageBackend: Replit Object Storage (production)
+- LocalStorageBackend: a directory on the local disk
+- MemoryStorageBackend: an in-process dict with optional latency/failure injection
+
+The backend is chosen with the STORAGE_BACKEND setting (see config.Config).
+"""
+
+import os
+import bisect
+import random
+import shutil
+import threading
+import time
+import logging
+import tempfile
+from io import BytesIO
+from pathlib import Path
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 256 * 1024  # Read/write granularity for streaming transfers
+LIST_PAGE_SIZE = 1000  # Keys fetched per listing request
+
+
+class StorageObjectNotFound(Exception):
+    """Raised by a backend when the requested key does not exist"""
+
+
+class InjectedStorageError(ConnectionError):
+    """Raised by MemoryStorageBackend to simulate a failing storage call"""
+
+
+class StorageBackend:
+    """Interface every storage backend implements"""
+    name = 'base'
+
+    def upload_bytes(self, key, data):
+        """Store data (bytes) under key, replacing any existing object"""
+        raise NotImplementedError
+
+    def upload_stream(self, key, file_data):
+        """Store the contents of a readable file object under key
+
+        Backends override this to avoid holding the whole object in memory.
+        """
+        self.upload_bytes(key, file_data.read())
+
+    def download_bytes(self, key):
+        """Return the contents of key as bytes or raise StorageObjectNotFound"""
+        raise NotImplementedError
+
+    def open_read(self, key):
+        """Return a seekable binary file object for key or raise StorageObjectNotFound
+
+        The caller is responsible for closing the returned object.
+        """
+        return BytesIO(self.download_bytes(key))
+
+    def delete(self, key):
+        """Delete key or raise StorageObjectNotFound"""
+        raise NotImplementedError
+
+    def exists(self, key):
+        """Return True if key exists"""
+        raise NotImplementedError
+
+    def list_page(self, prefix=None, start_after=None, max_results=LIST_PAGE_SIZE):
+        """Return up to max_results object names in lexicographic order
+
+        Only names starting with prefix (if given) and sorting after
+        start_after (if given) are returned.
+        """
+        raise NotImplementedError
+
+    def iter_keys(self, prefix=None, page_size=LIST_PAGE_SIZE):
+        """Yield object names page by page, optionally filtered by prefix"""
+        start_after = None
+        while True:
+            names = self.list_page(prefix=prefix, start_after=start_after, max_results=page_size)
+            yield from names
+            if len(names) < page_size:
+                return
+            start_after = names[-1]
+
+    def list(self, prefix=None):
+        """Return the names of all objects, optionally filtered by prefix"""
+        return list(self.iter_keys(prefix))
+
+    def health_check(self):
+        """Make the cheapest possible call that proves the store is reachable"""
+        self.list_page(max_results=1)
+
+
+class ReplitStorageBackend(StorageBackend):
+    """Backend for Replit Object Storage"""
+    name = 'replit'
+
+    def __init__(self, bucket_id=None):
+        # Imported here so the local backends work off the Replit platform
+        from google.auth import identity_pool
+        from google.cloud import storage as gcs
+        from google.cloud.exceptions import NotFound
+        from replit.object_storage import Client as ObjectStorageClient
+        from replit.object_storage.errors import ObjectNotFoundError
+
+        self.bucket_id = bucket_id or Config.STORAGE_BUCKET_ID
+        self.client = ObjectStorageClient(bucket_id=self.bucket_id)
+        self._not_found_errors = (ObjectNotFoundError, NotFound)
+
+        # The Replit client only offers whole-object transfers, so streaming
+        # goes straight to the underlying GCS bucket with the same credentials.
+        # Those live in a private module of replit-object-storage; if a release
+        # moves them, fall back to whole-object transfers through the client.
+        self.bucket = None
+        try:
+            from replit.object_storage._config import REPLIT_ADC
+            credentials = identity_pool.Credentials(**REPLIT_ADC)
+            self.bucket = gcs.Client(credentials=credentials, project="").bucket(self.bucket_id)
+        except Exception as e:
+            logger.error(f"Replit storage credentials unavailable ({e}); streaming transfers are disabled "
+                         f"and every upload and download holds the whole object in memory")
+
+    def upload_bytes(self, key, data):
+        self.client.upload_from_bytes(key, data)
+
+    def upload_stream(self, key, file_data):
+        if self.bucket is None:
+            return super().upload_stream(key, file_data)
+        # Resumable upload, sent in CHUNK_SIZE-aligned pieces
+        blob = self.bucket.blob(key, chunk_size=CHUNK_SIZE * 32)
+        blob.upload_from_file(file_data, rewind=False)
+
+    def download_bytes(self, key):
+        try:
+            return self.client.download_as_bytes(key)
+        except self._not_found_errors as e:
+            raise StorageObjectNotFound(key) from e
+
+    def open_read(self, key):
+        if self.bucket is None:
+            return super().open_read(key)
+        blob = self.bucket.blob(key)
+        try:
+            # Fetch metadata first so missing objects fail here and the
+            # reader knows the object size without another request
+            blob.reload()
+        except self._not_found_errors as e:
+            raise StorageObjectNotFound(key) from e
+        return blob.open('rb', chunk_size=CHUNK_SIZE * 4)
+
+    def delete(self, key):
+        try:
+            self.client.delete(key)
+        except self._not_found_errors as e:
+            raise StorageObjectNotFound(key) from e
+
+    def exists(self, key):
+        return self.client.exists(key)
+
+    def list_page(self, prefix=None, start_after=None, max_results=LIST_PAGE_SIZE):
+        # start_offset is inclusive; the smallest name after start_after is start_after + NUL
+        start_offset = start_after + '\x00' if start_after is not None else None
+        return [obj.name for obj in self.client.list(prefix=prefix, start_offset=start_offset,
+                                                     max_results=max_results)]
+
+
+class LocalStorageBackend(StorageBackend):
+    """Backend that stores objects as files below a root directory"""
+    name = 'local'
+
+    def __init__(self, root=None):
+        self.root = Path(root or Config.STORAGE_LOCAL_PATH)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key):
+        """Map a storage key to a path inside the root directory"""
+        path = (self.root / key).resolve()
+        if self.root.resolve() not in path.parents:
+            raise ValueError(f"Invalid storage key: {key}")
+        return path
+
+    def _write(self, key, write):
+        """Write an object through a temporary file so readers never see a partial object"""
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp_name, path)
+        except Exception:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+
+    def upload_bytes(self, key, data):
+        self._write(key, lambda f: f.write(data))
+
+    def upload_stream(self, key, file_data):
+        self._write(key, lambda f: shutil.copyfileobj(file_data, f, CHUNK_SIZE))
+
+    def download_bytes(self, key):
+        try:
+            return self._path(key).read_bytes()
+        except FileNotFoundError as e:
+            raise StorageObjectNotFound(key) from e
+
+    def open_read(self, key):
+        try:
+            return open(self._path(key), 'rb')
+        except FileNotFoundError as e:
+            raise StorageObjectNotFound(key) from e
+
+    def delete(self, key):
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError as e:
+            raise StorageObjectNotFound(key) from e
+
+    def exists(self, key):
+        return self._path(key).is_file()
+
+    def list_page(self, prefix=None, start_after=None, max_results=LIST_PAGE_SIZE):
+        # Only descend into the directory the prefix points at
+        base = self.root
+        if prefix and '/' in prefix:
+            base = self.root / prefix.rsplit('/', 1)[0]
+        names = []
+        for path in base.rglob('*') if base.is_dir() else ():
+            if not path.is_file() or path.name.startswith('.upload-'):
+                continue
+            name = path.relative_to(self.root).as_posix()
+            if prefix is not None and not name.startswith(prefix):
+                continue
+            if start_after is not None and name <= start_after:
+                continue
+            names.append(name)
+        names.sort()
+        return names[:max_results]
+
+
+class MemoryStorageBackend(StorageBackend):
+    """In-memory backend that can simulate a slow or unreliable store
+
+    Args:
+        latency: Fixed delay in seconds added to every call
+        jitter: Maximum extra random delay in seconds added to every call
+        bandwidth: Transfer rate in bytes per second used to delay uploads
+                   and downloads by their size, or None for no limit
+        failure_rate: Probability (0-1) that a call raises InjectedStorageError
+        seed: Seed for the random generator, for reproducible runs
+    """
+    name = 'memory'
+
+    def __init__(self, latency=0.0, jitter=0.0, bandwidth=None, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._objects = {}
+        self._lock = threading.Lock()
+
+    def _simulate(self, nbytes=0):
+        """Sleep for the configured latency and maybe raise an injected failure"""
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            fail = self._random.random() < self.failure_rate
+        if self.bandwidth and nbytes:
+            delay += nbytes / self.bandwidth
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            raise InjectedStorageError("Injected storage failure")
+
+    def upload_bytes(self, key, data):
+        self._simulate(len(data))
+        with self._lock:
+            self._objects[key] = bytes(data)
+
+    def upload_stream(self, key, file_data):
+        buffer = BytesIO()
+        shutil.copyfileobj(file_data, buffer, CHUNK_SIZE)
+        self.upload_bytes(key, buffer.getvalue())
+
+    def download_bytes(self, key):
+        with self._lock:
+            data = self._objects.get(key)
+        self._simulate(len(data) if data is not None else 0)
+        if data is None:
+            raise StorageObjectNotFound(key)
+        return data
+
+    def delete(self, key):
+        self._simulate()
+        with self._lock:
+            if self._objects.pop(key, None) is None:
+                raise StorageObjectNotFound(key)
+
+    def exists(self, key):
+        self._simulate()
+        with self._lock:
+            return key in self._objects
+
+    def list_page(self, prefix=None, start_after=None, max_results=LIST_PAGE_SIZE):
+        self._simulate()
+        with self._lock:
+            names = sorted(self._objects)
+        start = max(prefix or '', start_after or '')
+        index = bisect.bisect_right(names, start) if start == start_after else bisect.bisect_left(names, start)
+        page = []
+        for name in names[index:]:
+            if len(page) >= max_results or (prefix is not None and not name.startswith(prefix)):
+                break
+            page.append(name)
+        return page
+
+
+def create_backend(name=None):
+    """Create the storage backend configured by STORAGE_BACKEND"""
+    name = (name or Config.STORAGE_BACKEND).lower()
+    if name == 'replit':
+        return ReplitStorageBackend()
+    if name == 'local':
+        return LocalStorageBackend()
+    if name == 'memory':
+        return MemoryStorageBackend(latency=Config.STORAGE_MEMORY_LATENCY)
+    raise ValueError(f"Unknown storage backend: {name}")
@@ -0,0 +1,415 @@
+"""
+Read-through disk cache for ObjectStorage.
+Objects fetched from storage are kept as files in a local directory with a
+byte-size budget and least-recently-used eviction. The index lives in a SQLite
+database next to the files, so every gunicorn worker and the image worker on
+the same host share one cache and one set of hit/miss/eviction counters.
+
+invalidate() bumps a per-key generation. A fill that started before the
+bump is dropped when it commits, so an old read still in flight when the
+object is overwritten can't put the stale bytes back.
+"""
+
+import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import logging
+import tempfile
+import threading
+from pathlib import Path
+
+from config import Config
+from storage_backends import CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries (last_access);
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS generations (
+    key TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL
+);
+"""
+
+# fill_restarts: fills started over after a rewind (e.g. an upload retry);
+# fills_abandoned: fills dropped because the object wasn't read in order
+STAT_NAMES = ('hits', 'misses', 'evictions', 'invalidations', 'fill_restarts', 'fills_abandoned')
+
+
+class DiskCache:
+    """Size-bounded LRU cache of storage objects on the local disk
+
+    Args:
+        directory: Directory for the cached files and the index database
+        max_bytes: Total size budget for cached files
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.objects_dir = self.directory / 'objects'
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.directory / 'index.sqlite3'
+        self._local = threading.local()
+
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        conn.executemany("INSERT OR IGNORE INTO stats (name, value) VALUES (?, 0)",
+                         [(name,) for name in STAT_NAMES])
+
+    def _connect(self):
+        """Return this thread's connection to the index database"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.index_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _path_for(self, key):
+        """Return the cache file path for a storage key"""
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return self.objects_dir / digest[:2] / digest
+
+    def _bump(self, conn, name, amount=1):
+        conn.execute("UPDATE stats SET value = value + ? WHERE name = ?", (amount, name))
+
+    def count(self, name, amount=1):
+        """Add amount to one of the shared STAT_NAMES counters"""
+        self._bump(self._connect(), name, amount)
+
+    def open(self, key):
+        """Open the cached copy of key, or return None on a miss
+
+        The returned file reads straight from the local disk, so hits never
+        copy the object into Python memory.
+        """
+        conn = self._connect()
+        row = conn.execute("SELECT path FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            try:
+                reader = open(row[0], 'rb')
+            except FileNotFoundError:
+                # File was removed behind our back; forget the entry
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            else:
+                conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+                self._bump(conn, 'hits')
+                return reader
+
+        self._bump(conn, 'misses')
+        return None
+
+    def new_writer(self, key, generation=None):
+        """Return a CacheWriter for filling the cache entry of key
+
+        generation is the key's generation (see generation()) from before
+        the object was read; by default it is taken now.
+        """
+        return CacheWriter(self, key, generation)
+
+    def put_stream(self, key, reader, generation=None):
+        """Copy a readable file object into the cache"""
+        writer = self.new_writer(key, generation)
+        try:
+            while True:
+                chunk = reader.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                writer.write(chunk)
+            writer.commit()
+        except Exception:
+            writer.discard()
+            raise
+
+    def put_bytes(self, key, data, generation=None):
+        """Store bytes in the cache"""
+        writer = self.new_writer(key, generation)
+        try:
+            writer.write(data)
+            writer.commit()
+        except Exception:
+            writer.discard()
+            raise
+
+    def _generation(self, conn, key):
+        row = conn.execute("SELECT generation FROM generations WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else 0
+
+    def generation(self, key):
+        """Number of times key has been invalidated"""
+        return self._generation(self._connect(), key)
+
+    def _add(self, key, tmp_name, path, size, generation):
+        """Move a completed cache file into place and evict entries over the budget
+
+        The file is dropped if key was invalidated after the fill started
+        (generation is the key's generation back then). Returns True if the
+        entry was added.
+        """
+        if size > self.max_bytes:
+            Path(tmp_name).unlink(missing_ok=True)
+            return False
+
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if self._generation(conn, key) != generation:
+                conn.execute("ROLLBACK")
+                Path(tmp_name).unlink(missing_ok=True)
+                logger.debug(f"Dropped a stale storage cache fill of {key}")
+                return False
+            # Under the index lock, so a newer fill can't be overwritten
+            os.replace(tmp_name, path)
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, path, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, str(path), size, time.time())
+            )
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            evicted = []
+            if total > self.max_bytes:
+                for old_key, old_path, old_size in conn.execute(
+                        "SELECT key, path, size FROM entries WHERE key != ? ORDER BY last_access",
+                        (key,)).fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    evicted.append((old_key, old_path))
+                    total -= old_size
+                conn.executemany("DELETE FROM entries WHERE key = ?", [(k,) for k, _ in evicted])
+                if evicted:
+                    self._bump(conn, 'evictions', len(evicted))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        # Readers that already have an evicted file open keep their handle
+        for _, old_path in evicted:
+            Path(old_path).unlink(missing_ok=True)
+        if evicted:
+            logger.debug(f"Evicted {len(evicted)} entries from storage cache")
+        return True
+
+    def invalidate(self, key):
+        """Remove key from the cache; returns its new generation"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Fences off fills of the old object that are still running
+            conn.execute("INSERT INTO generations (key, generation) VALUES (?, 1) "
+                         "ON CONFLICT (key) DO UPDATE SET generation = generation + 1", (key,))
+            row = conn.execute("DELETE FROM entries WHERE key = ? RETURNING path", (key,)).fetchone()
+            if row is not None:
+                self._bump(conn, 'invalidations')
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if row is not None:
+            Path(row[0]).unlink(missing_ok=True)
+        return self._generation(conn, key)
+
+    def clear(self):
+        """Remove every entry from the cache"""
+        conn = self._connect()
+        conn.execute("DELETE FROM entries")
+        shutil.rmtree(self.objects_dir, ignore_errors=True)
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+
+    def stats(self):
+        """Return cache counters and usage shared by all processes on the host"""
+        conn = self._connect()
+        result = dict(conn.execute("SELECT name, value FROM stats").fetchall())
+        entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        lookups = result.get('hits', 0) + result.get('misses', 0)
+        result.update({
+            'entries': entries,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+            'hit_rate': round(result.get('hits', 0) / lookups, 4) if lookups else 0.0,
+        })
+        return result
+
+
+class CacheWriter:
+    """Writes one cache entry through a temporary file
+
+    Nothing is visible to other readers until commit() atomically moves the
+    file into place, so a partially downloaded object is never served.
+    """
+
+    def __init__(self, cache, key, generation=None):
+        self.cache = cache
+        self.key = key
+        self.path = cache._path_for(key)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # An invalidation after this point drops the fill at commit
+        self.generation = cache.generation(key) if generation is None else generation
+        fd, self.tmp_name = tempfile.mkstemp(dir=self.path.parent, prefix='.fill-')
+        self.file = os.fdopen(fd, 'wb')
+        self.size = 0
+
+    def write(self, data):
+        self.file.write(data)
+        self.size += len(data)
+
+    def restart(self):
+        """Drop what was written so far and start the entry again"""
+        self.file.seek(0)
+        self.file.truncate()
+        self.size = 0
+
+    def commit(self):
+        """Add the entry; returns False if it was dropped as stale or too large"""
+        self.file.close()
+        try:
+            return self.cache._add(self.key, self.tmp_name, self.path, self.size, self.generation)
+        except Exception:
+            Path(self.tmp_name).unlink(missing_ok=True)
+            raise
+
+    def discard(self):
+        self.file.close()
+        Path(self.tmp_name).unlink(missing_ok=True)
+
+
+class CacheFillReader:
+    """File-like wrapper that copies a storage stream into the cache as it is read
+
+    The caller gets bytes as soon as storage sends them; the cache entry is
+    committed only if the whole object was read from start to end. Rewinding
+    to the start (as an upload retry does) starts the entry over; reads after
+    any other seek that skipped data just pass through without caching.
+
+    With auto_commit=False the entry is only committed by finish(), e.g. once
+    an upload read through this wrapper has succeeded.
+    """
+
+    def __init__(self, reader, writer, auto_commit=True):
+        self.reader = reader
+        self.writer = writer
+        self.cache = writer.cache
+        self.key = writer.key
+        self.generation = writer.generation
+        self.auto_commit = auto_commit
+        self._complete = False
+        self._done = False  # Committed or dropped by finish(); a rewind doesn't restart it
+
+    def read(self, size=-1):
+        data = self.reader.read(size)
+        if self.writer is not None:
+            if self.reader.tell() - len(data) != self.writer.size:
+                # Not a sequential read from the start; give up on caching
+                self.writer.discard()
+                self.writer = None
+                self._count('fills_abandoned')
+            elif data:
+                self.writer.write(data)
+            elif self.auto_commit:
+                self._commit()
+            else:
+                self._complete = True
+        return data
+
+    def finish(self, keep=True, generation=None):
+        """Commit the entry if keep and the whole file was read, else drop it
+
+        generation replaces the writer's, e.g. the one invalidate() returned
+        after the upload read through this wrapper. Returns True if the entry
+        was committed. The wrapped reader stays open.
+        """
+        writer, self.writer = self.writer, None
+        self._done = True
+        if writer is None:
+            return False
+        if keep and self._complete:
+            if generation is not None:
+                writer.generation = generation
+            try:
+                return writer.commit()
+            except Exception as e:
+                logger.warning(f"Failed to add {writer.key} to storage cache: {str(e)}")
+        writer.discard()
+        return False
+
+    def _commit(self):
+        writer, self.writer = self.writer, None
+        self._done = True
+        try:
+            writer.commit()
+        except Exception as e:
+            logger.warning(f"Failed to add {writer.key} to storage cache: {str(e)}")
+            writer.discard()
+
+    def _count(self, name):
+        try:
+            self.cache.count(name)
+        except Exception as e:
+            logger.warning(f"Error updating storage cache stats: {str(e)}")
+
+    def _restart(self):
+        """Start the entry over after a rewind to the start of the object"""
+        try:
+            if self.writer is not None:
+                self.writer.restart()
+            else:
+                self.writer = self.cache.new_writer(self.key, self.generation)
+        except Exception as e:
+            logger.warning(f"Failed to restart storage cache entry for {self.key}: {str(e)}")
+            if self.writer is not None:
+                self.writer.discard()
+                self.writer = None
+            return
+        self._complete = False
+        self._count('fill_restarts')
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        position = self.reader.seek(offset, whence)
+        if position == 0 and not self._done and (self.writer is None or self.writer.size or self._complete):
+            self._restart()
+        return position
+
+    def tell(self):
+        return self.reader.tell()
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.discard()
+            self.writer = None
+        self.reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def create_cache():
+    """Create the disk cache configured by STORAGE_CACHE_DIR/STORAGE_CACHE_MAX_BYTES, or None if disabled"""
+    if Config.STORAGE_CACHE_MAX_BYTES <= 0:
+        return None
+    try:
+        return DiskCache(Config.STORAGE_CACHE_DIR, Config.STORAGE_CACHE_MAX_BYTES)
+    except Exception as e:
+        logger.warning(f"Storage cache disabled, failed to open {Config.STORAGE_CACHE_DIR}: {str(e)}")
+        return None
@@ -0,0 +1,214 @@
+"""
+Retry and circuit-breaker policy for object storage calls.
+ObjectStorage runs every backend call through a ResiliencePolicy:
+- retries use exponential backoff with full jitter instead of fixed sleeps
+- each operation has a deadline that bounds its total time including retries
+- a circuit breaker shared by all ObjectStorage instances in the process
+  fails calls fast while storage is unhealthy, so request threads don't pile
+  up in retry loops; after a cool-down a trial call decides whether to close it
+
+Breaker state and retry/failure counters are exposed through stats().
+"""
+
+import time
+import random
+import logging
+import threading
+
+from config import Config
+from storage_backends import StorageObjectNotFound
+
+logger = logging.getLogger(__name__)
+
+# Total time allowed per operation, including retries (seconds)
+DEFAULT_DEADLINES = {
+    'upload': 300,
+    'get': 60,
+    'open': 30,
+    'delete': 15,
+    'exists': 10,
+    'list': 30,
+}
+
+# Errors that retrying cannot fix and that say nothing about storage health
+NON_RETRYABLE_ERRORS = (StorageObjectNotFound, ValueError, TypeError)
+
+
+class StorageUnavailable(Exception):
+    """Raised without calling storage while the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """Circuit breaker for calls to one storage service
+
+    States:
+        closed: calls go through; failure_threshold consecutive failures open it
+        open: calls fail fast until reset_timeout seconds have passed
+        half_open: up to half_open_max_calls trial calls go through; a success
+                   closes the breaker and a failure opens it again
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, half_open_max_calls=1, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self.times_opened = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            self._update_state()
+            return self._state
+
+    def _update_state(self):
+        """Move from open to half-open once the cool-down has passed (lock held)"""
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._half_open_calls = 0
+
+    def allow(self):
+        """Return True if a call may go to storage now"""
+        with self._lock:
+            self._update_state()
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and self._half_open_calls < self.half_open_max_calls:
+                self._half_open_calls += 1
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("Storage circuit breaker closed")
+            self._state = self.CLOSED
+            self._consecutive_failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive_failures += 1
+            if self._state == self.HALF_OPEN or (
+                    self._state == self.CLOSED and self._consecutive_failures >= self.failure_threshold):
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+                self.times_opened += 1
+                logger.error(f"Storage circuit breaker opened after {self._consecutive_failures} consecutive failures")
+
+    def stats(self):
+        with self._lock:
+            self._update_state()
+            return {
+                'state': self._state,
+                'consecutive_failures': self._consecutive_failures,
+                'times_opened': self.times_opened,
+            }
+
+
+class ResiliencePolicy:
+    """Retry policy with exponential backoff, full jitter, deadlines and a circuit breaker
+
+    Args:
+        max_attempts: Maximum number of attempts per call
+        base_delay: Backoff before the second attempt (doubles every retry)
+        max_delay: Upper bound for a single backoff
+        deadlines: Mapping of operation name -> total seconds allowed
+        breaker: CircuitBreaker to use, or None for no breaker
+        sleep: Function used to wait between attempts
+    """
+
+    def __init__(self, max_attempts=3, base_delay=0.2, max_delay=2.0, deadlines=None, breaker=None,
+                 sleep=time.sleep, seed=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadlines = dict(DEFAULT_DEADLINES, **(deadlines or {}))
+        self.breaker = breaker
+        self._sleep = sleep
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def backoff(self, attempt):
+        """Return the wait before retry number attempt (1-based), with full jitter"""
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        with self._lock:
+            return self._random.uniform(0, ceiling)
+
+    def _count(self, operation, name):
+        with self._lock:
+            counters = self._counters.setdefault(operation, {
+                'calls': 0, 'retries': 0, 'failures': 0, 'short_circuited': 0,
+            })
+            counters[name] += 1
+
+    def call(self, operation, func, *args, on_retry=None):
+        """Call func(*args) under the policy and return its result
+
+        Args:
+            operation: Operation name, used for the deadline and the counters
+            func: The storage call
+            on_retry: Optional function called before each retry (e.g. to rewind a stream)
+
+        Raises:
+            StorageUnavailable: The circuit breaker is open
+            The last error from func when attempts or the deadline run out
+        """
+        self._count(operation, 'calls')
+        if self.breaker is not None and not self.breaker.allow():
+            self._count(operation, 'short_circuited')
+            raise StorageUnavailable(f"Storage unavailable, skipped {operation}")
+
+        deadline = time.monotonic() + self.deadlines.get(operation, 60)
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result = func(*args)
+            except NON_RETRYABLE_ERRORS:
+                # The service answered; it is healthy even if the key is missing
+                if self.breaker is not None:
+                    self.breaker.record_success()
+                raise
+            except Exception as e:
+                if self.breaker is not None:
+                    self.breaker.record_failure()
+                delay = self.backoff(attempt)
+                breaker_open = self.breaker is not None and self.breaker.state == CircuitBreaker.OPEN
+                if attempt >= self.max_attempts or breaker_open or time.monotonic() + delay > deadline:
+                    self._count(operation, 'failures')
+                    raise
+                self._count(operation, 'retries')
+                logger.warning(f"Storage {operation} failed (attempt {attempt}), retrying in {delay:.2f}s: {str(e)}")
+                self._sleep(delay)
+                if on_retry is not None:
+                    on_retry()
+                continue
+
+            if self.breaker is not None:
+                self.breaker.record_success()
+            return result
+
+    def stats(self):
+        """Return breaker state and per-operation counters"""
+        with self._lock:
+            counters = {operation: dict(values) for operation, values in self._counters.items()}
+        return {
+            'breaker': self.breaker.stats() if self.breaker is not None else None,
+            'operations': counters,
+        }
+
+
+# One breaker per process, shared by every ObjectStorage using the configured backend
+default_breaker = CircuitBreaker(
+    failure_threshold=Config.STORAGE_BREAKER_THRESHOLD,
+    reset_timeout=Config.STORAGE_BREAKER_RESET_TIMEOUT,
+)
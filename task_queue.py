@@ -0,0 +1,449 @@
+"""
+Durable task queue for the image worker, stored in SQLite.
+The web processes enqueue tasks and worker processes lease them. The
+database runs in WAL mode, so enqueues and leases from several processes
+don't block each other's reads.
+
+- Tasks are leased in priority order (highest first), then oldest first,
+  from a partial index over the tasks nobody holds.
+- A lease lasts TASK_LEASE_SECONDS. The worker extends it with heartbeats
+  while it runs the task. A task whose lease runs out (its worker died) is
+  handed out again after the retry backoff, or dead-lettered if that was its
+  last attempt, so an image that kills its worker isn't retried forever.
+- A failed task is retried after an exponential backoff. After
+  TASK_MAX_ATTEMPTS attempts it moves to the dead_letters table with its
+  last error, instead of being dropped.
+- enqueue_many adds any number of tasks in one transaction.
+- A task may carry a deduplication key such as "thumbnail:<file_key>".
+  Submitting a key that is already pending or running merges into that
+  task (raising its priority if needed), and for TASK_DEDUP_WINDOW_SECONDS
+  after it completes the key is suppressed. Both are counted in stats().
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+import logging
+from contextlib import contextmanager
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    task_type TEXT NOT NULL,
+    data TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    available_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    leased_by TEXT,
+    lease_expires REAL,
+    last_error TEXT,
+    dedup_key TEXT
+);
+-- Dequeue order over the tasks nobody holds
+CREATE INDEX IF NOT EXISTS idx_tasks_ready ON tasks (priority DESC, id) WHERE lease_expires IS NULL;
+-- Next task due after a backoff
+CREATE INDEX IF NOT EXISTS idx_tasks_available ON tasks (available_at) WHERE lease_expires IS NULL;
+-- Expired leases
+CREATE INDEX IF NOT EXISTS idx_tasks_lease ON tasks (lease_expires) WHERE lease_expires IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS dead_letters (
+    id INTEGER PRIMARY KEY,
+    task_type TEXT NOT NULL,
+    data TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL,
+    last_error TEXT,
+    failed_at REAL NOT NULL,
+    dedup_key TEXT
+);
+
+-- Deduplication keys of recently completed tasks
+CREATE TABLE IF NOT EXISTS completed_keys (
+    dedup_key TEXT PRIMARY KEY,
+    completed_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+# Task types the worker no longer runs; rows left from older versions are
+# dead-lettered when the queue is opened
+RETIRED_TASK_TYPES = ('recent_orders',)  # Replaced by thumbnail_scan
+
+# Created after _add_dedup_columns has upgraded an older queue
+DEDUP_INDEX = """
+-- One pending or running task per deduplication key
+CREATE UNIQUE INDEX IF NOT EXISTS idx_tasks_dedup ON tasks (dedup_key) WHERE dedup_key IS NOT NULL;
+"""
+
+
+class QueuedTask:
+    """A task leased from the queue"""
+
+    def __init__(self, id, task_type, data, priority, created_at, attempts, lease=None, dedup_key=None):
+        self.id = id
+        self.task_type = task_type
+        self.data = data
+        self.priority = priority
+        self.created_at = created_at
+        self.attempts = attempts  # Including the current one
+        self.lease = lease  # Token of this lease: owner plus a random suffix
+        self.dedup_key = dedup_key
+        self.lease_lost = threading.Event()  # Set by keep_alive when another worker took the task over
+
+    def __repr__(self):
+        return f"<QueuedTask {self.id} {self.task_type} attempt {self.attempts}>"
+
+
+def worker_id():
+    """Lease owner name of this process"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class TaskQueue:
+    """SQLite task queue shared by every process on the host"""
+
+    def __init__(self, path=None, lease_seconds=None, max_attempts=None, retry_base_delay=None,
+                 retry_max_delay=None, dedup_window=None):
+        self.path = path or Config.TASK_QUEUE_PATH
+        self.lease_seconds = lease_seconds or Config.TASK_LEASE_SECONDS
+        self.max_attempts = max_attempts or Config.TASK_MAX_ATTEMPTS
+        self.retry_base_delay = Config.TASK_RETRY_BASE_DELAY if retry_base_delay is None else retry_base_delay
+        self.retry_max_delay = Config.TASK_RETRY_MAX_DELAY if retry_max_delay is None else retry_max_delay
+        self.dedup_window = Config.TASK_DEDUP_WINDOW_SECONDS if dedup_window is None else dedup_window
+        # sqlite3 connections can't be shared between threads (the heartbeat runs in its own)
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Autocommit; transactions are opened explicitly with BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            with self._init_lock:
+                if not self._initialized:
+                    conn.executescript(SCHEMA)
+                    _add_dedup_columns(conn)
+                    _retire_task_types(conn)
+                    conn.executescript(DEDUP_INDEX)
+                    self._initialized = True
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """Write transaction that takes the database lock up front"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def enqueue(self, task_type, data, priority=0, dedup_key=None):
+        """Add one task; returns its id, see enqueue_many"""
+        return self.enqueue_many([(task_type, data, priority, dedup_key)])[0]
+
+    def enqueue_many(self, tasks):
+        """Add (task_type, data, priority[, dedup_key]) tuples in one transaction
+
+        Returns their ids. A task whose dedup_key is pending or running gets
+        the id of that task instead, and one whose key completed within the
+        dedup window gets None.
+        """
+        now = time.time()
+        ids = []
+        merged = suppressed = 0
+        with self._transaction() as conn:
+            for task in tasks:
+                task_type, data, priority = task[:3]
+                dedup_key = task[3] if len(task) > 3 else None
+                if dedup_key is not None:
+                    row = conn.execute("SELECT id FROM tasks WHERE dedup_key = ?", (dedup_key,)).fetchone()
+                    if row is not None:
+                        conn.execute("UPDATE tasks SET priority = MAX(priority, ?) WHERE id = ?", (priority, row[0]))
+                        ids.append(row[0])
+                        merged += 1
+                        continue
+                    if self.dedup_window > 0 and conn.execute(
+                            "SELECT 1 FROM completed_keys WHERE dedup_key = ? AND completed_at > ?",
+                            (dedup_key, now - self.dedup_window)).fetchone():
+                        ids.append(None)
+                        suppressed += 1
+                        continue
+                cursor = conn.execute(
+                    "INSERT INTO tasks (task_type, data, priority, created_at, available_at, dedup_key) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (task_type, json.dumps(data), priority, now, now, dedup_key))
+                ids.append(cursor.lastrowid)
+            _count(conn, 'merged', merged)
+            _count(conn, 'suppressed', suppressed)
+        return ids
+
+    def lease(self, owner=None):
+        """Take the next task that is due, or None if there is none
+
+        The task is held for lease_seconds; call heartbeat() to keep it
+        longer and complete() or fail() when done.
+        """
+        lease = f"{owner or worker_id()}:{uuid.uuid4().hex[:8]}"
+        now = time.time()
+        with self._transaction() as conn:
+            self._expire_leases(conn, now)
+            row = conn.execute(
+                "SELECT id, task_type, data, priority, created_at, attempts, dedup_key FROM tasks "
+                "WHERE lease_expires IS NULL AND available_at <= ? "
+                "ORDER BY priority DESC, id LIMIT 1", (now,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE tasks SET leased_by = ?, lease_expires = ?, attempts = attempts + 1 "
+                         "WHERE id = ?", (lease, now + self.lease_seconds, row[0]))
+        task_id, task_type, data, priority, created_at, attempts, dedup_key = row
+        return QueuedTask(task_id, task_type, json.loads(data), priority, created_at, attempts + 1, lease,
+                          dedup_key)
+
+    def _expire_leases(self, conn, now):
+        """Treat tasks whose worker stopped renewing its lease as failed attempts"""
+        expired = conn.execute("SELECT id, task_type, attempts FROM tasks "
+                               "WHERE lease_expires IS NOT NULL AND lease_expires < ?", (now,)).fetchall()
+        for task_id, task_type, attempts in expired:
+            error = "Lease expired, the worker stopped or crashed"
+            if attempts >= self.max_attempts:
+                _dead_letter(conn, task_id, error, now)
+                logger.warning(f"Task {task_id} ({task_type}) lost its worker on attempt {attempts}, "
+                               f"moved to dead letters")
+                continue
+            conn.execute("UPDATE tasks SET leased_by = NULL, lease_expires = NULL, available_at = ?, "
+                         "last_error = ? WHERE id = ?", (now + self._retry_delay(attempts), error, task_id))
+            logger.warning(f"Task {task_id} ({task_type}) lost its worker, retrying after backoff")
+
+    def _retry_delay(self, attempts):
+        """Backoff before the attempt after attempt number attempts"""
+        return min(self.retry_base_delay * 2 ** (attempts - 1), self.retry_max_delay)
+
+    def heartbeat(self, task):
+        """Extend the lease of task; returns False if the lease ran out and was lost"""
+        with self._transaction() as conn:
+            cursor = conn.execute("UPDATE tasks SET lease_expires = ? WHERE id = ? AND leased_by = ?",
+                                  (time.time() + self.lease_seconds, task.id, task.lease))
+        return cursor.rowcount > 0
+
+    def complete(self, task):
+        """Remove a finished task; its dedup_key is suppressed for the dedup window
+
+        Returns False, leaving the task alone, if its lease was lost to another worker.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute("DELETE FROM tasks WHERE id = ? AND (leased_by = ? OR leased_by IS NULL)",
+                                  (task.id, task.lease))
+            if not cursor.rowcount:
+                logger.warning(f"Task {task.id} finished after its lease was lost, leaving it to its new worker")
+                return False
+            if task.dedup_key is not None and self.dedup_window > 0:
+                conn.execute("INSERT OR REPLACE INTO completed_keys (dedup_key, completed_at) VALUES (?, ?)",
+                             (task.dedup_key, now))
+                conn.execute("DELETE FROM completed_keys WHERE completed_at <= ?", (now - self.dedup_window,))
+        return True
+
+    def fail(self, task, error=None, retry=True):
+        """Record a failed attempt: retry after a backoff, or dead-letter the task
+
+        Returns True if the task will be retried. A task whose lease was
+        lost to another worker is left to that worker.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            held, = conn.execute("SELECT COUNT(*) FROM tasks WHERE id = ? AND (leased_by = ? OR leased_by IS NULL)",
+                                 (task.id, task.lease)).fetchone()
+            if not held:
+                logger.warning(f"Task {task.id} failed after its lease was lost: {error}")
+                return True
+            if retry and task.attempts < self.max_attempts:
+                delay = self._retry_delay(task.attempts)
+                conn.execute("UPDATE tasks SET leased_by = NULL, lease_expires = NULL, available_at = ?, "
+                             "last_error = ? WHERE id = ?", (now + delay, error, task.id))
+                logger.info(f"Task {task.id} ({task.task_type}) failed, retrying in {delay:.0f}s")
+                return True
+            _dead_letter(conn, task.id, error, now)
+        logger.warning(f"Task {task.id} ({task.task_type}) failed after {task.attempts} attempts, "
+                       f"moved to dead letters: {error}")
+        return False
+
+    @contextmanager
+    def keep_alive(self, task, interval=None):
+        """Send heartbeats for task from a background thread while the block runs
+
+        If the lease is lost anyway, task.lease_lost is set; long tasks can
+        check it to stop early.
+        """
+        interval = interval or max(1.0, self.lease_seconds / 3)
+        stop = threading.Event()
+
+        def beat():
+            try:
+                while not stop.wait(interval):
+                    try:
+                        if not self.heartbeat(task):
+                            logger.warning(f"Lost the lease on task {task.id}")
+                            task.lease_lost.set()
+                            return
+                    except sqlite3.Error as e:
+                        logger.error(f"Heartbeat for task {task.id} failed: {str(e)}")
+            finally:
+                self.close()  # This thread's connection
+
+        thread = threading.Thread(target=beat, name=f'heartbeat-{task.id}', daemon=True)
+        thread.start()
+        try:
+            yield task
+        finally:
+            stop.set()
+            thread.join()
+
+    def retry_dead_letters(self, ids=None):
+        """Put dead-lettered tasks (all, or the given ids) back in the queue; returns how many
+
+        One whose dedup_key has been queued again since is dropped as a duplicate.
+        """
+        now = time.time()
+        where, params = ("WHERE id IN (%s)" % ','.join('?' * len(ids)), list(ids)) if ids else ('', [])
+        with self._transaction() as conn:
+            cursor = conn.execute("INSERT OR IGNORE INTO tasks (task_type, data, priority, created_at, available_at, "
+                                  "dedup_key) "
+                                  f"SELECT task_type, data, priority, created_at, ?, dedup_key FROM dead_letters {where}",
+                                  [now] + params)
+            retried = cursor.rowcount
+            conn.execute(f"DELETE FROM dead_letters {where}", params)
+        return retried
+
+    def seconds_until_due(self):
+        """Seconds until a task can be leased: 0 if one is ready, None if the queue is empty
+
+        Counts tasks waiting out a retry backoff and leases that will expire.
+        """
+        conn = self._connect()
+        available, = conn.execute("SELECT MIN(available_at) FROM tasks WHERE lease_expires IS NULL").fetchone()
+        expires, = conn.execute("SELECT MIN(lease_expires) FROM tasks WHERE lease_expires IS NOT NULL").fetchone()
+        due = min((t for t in (available, expires) if t is not None), default=None)
+        if due is None:
+            return None
+        return max(due - time.time(), 0.0)
+
+    def leases_by_owner(self):
+        """Number of tasks each worker process (host:pid) holds a live lease on"""
+        conn = self._connect()
+        rows = conn.execute("SELECT leased_by, COUNT(*) FROM tasks WHERE lease_expires >= ? GROUP BY leased_by",
+                            (time.time(),)).fetchall()
+        owners = {}
+        for lease, count in rows:
+            owner = lease.rsplit(':', 1)[0]  # Drop the per-lease suffix
+            owners[owner] = owners.get(owner, 0) + count
+        return owners
+
+    def stats(self):
+        """Queue depth: ready, delayed and leased tasks, dead letters and the oldest ready task's age
+
+        merged and suppressed count duplicate submissions since the queue was created.
+        """
+        now = time.time()
+        conn = self._connect()
+        ready, delayed, leased, oldest = conn.execute(
+            "SELECT "
+            "SUM(lease_expires IS NULL AND available_at <= :now), "
+            "SUM(lease_expires IS NULL AND available_at > :now), "
+            "SUM(lease_expires IS NOT NULL), "
+            "MIN(CASE WHEN lease_expires IS NULL AND available_at <= :now THEN created_at END) "
+            "FROM tasks", {'now': now}).fetchone()
+        dead, = conn.execute("SELECT COUNT(*) FROM dead_letters").fetchone()
+        counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+        return {
+            'ready': ready or 0,
+            'delayed': delayed or 0,
+            'leased': leased or 0,
+            'dead_letters': dead,
+            'oldest_ready_seconds': round(now - oldest, 1) if oldest else 0.0,
+            'merged': counters.get('merged', 0),
+            'suppressed': counters.get('suppressed', 0),
+        }
+
+
+def _add_dedup_columns(conn):
+    """Add dedup_key to queues created before tasks had one"""
+    for table in ('tasks', 'dead_letters'):
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+        if 'dedup_key' not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN dedup_key TEXT")
+
+
+def _dead_letter(conn, task_id, error, now):
+    """Move a task to the dead letters with its last error"""
+    conn.execute("INSERT OR REPLACE INTO dead_letters "
+                 "(id, task_type, data, priority, created_at, attempts, last_error, failed_at, dedup_key) "
+                 "SELECT id, task_type, data, priority, created_at, attempts, ?, ?, dedup_key "
+                 "FROM tasks WHERE id = ?", (error, now, task_id))
+    conn.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+
+
+def _retire_task_types(conn):
+    """Move queued tasks of RETIRED_TASK_TYPES to the dead letters"""
+    marks = ','.join('?' * len(RETIRED_TASK_TYPES))
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute("INSERT OR REPLACE INTO dead_letters "
+                     "(id, task_type, data, priority, created_at, attempts, last_error, failed_at, dedup_key) "
+                     "SELECT id, task_type, data, priority, created_at, attempts, 'Task type retired', ?, dedup_key "
+                     f"FROM tasks WHERE task_type IN ({marks})", (time.time(),) + RETIRED_TASK_TYPES)
+        cursor = conn.execute(f"DELETE FROM tasks WHERE task_type IN ({marks})", RETIRED_TASK_TYPES)
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    if cursor.rowcount:
+        logger.info(f"Moved {cursor.rowcount} tasks of retired types to the dead letters")
+
+
+def _count(conn, name, amount):
+    if amount:
+        conn.execute("INSERT INTO counters (name, value) VALUES (?, ?) "
+                     "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value", (name, amount))
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    """The task queue of this process, opened on first use"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = TaskQueue()
+        return _queue
@@ -0,0 +1,123 @@
+"""
+Wake-up notifications from task producers to idle workers.
+Each worker process binds a Unix datagram socket in TASK_WAKE_DIR and blocks
+on it while the queue is empty; worker_client sends one byte to every
+socket there after it enqueues, so a new task starts within milliseconds
+and an idle worker doesn't wake up at all in between.
+
+Notifications are only a hint: the queue in SQLite is the source of truth,
+a lost datagram just means the task waits for the next wake-up, and
+workers still poll every WORKER_IDLE_POLL_SECONDS. Where Unix sockets are
+not available the worker falls back to polling every second.
+"""
+
+import os
+import errno
+import select
+import socket
+import logging
+import time
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Polling interval when notifications are unavailable
+FALLBACK_POLL_SECONDS = 1.0
+
+SOCKET_SUFFIX = '.sock'
+
+
+def _wake_dir():
+    return Config.TASK_WAKE_DIR
+
+
+class WakeListener:
+    """A worker's end: waits until a producer sends a wake-up or a timeout passes"""
+
+    def __init__(self, directory=None):
+        self.directory = directory or _wake_dir()
+        self.path = None
+        self._socket = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"worker-{os.getpid()}{SOCKET_SUFFIX}")
+            if os.path.exists(path):
+                os.unlink(path)  # Left by an earlier process with the same PID
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(path)
+            sock.setblocking(False)
+            self._socket, self.path = sock, path
+            logger.info(f"Listening for task notifications on {path}")
+        except (AttributeError, OSError) as e:
+            # No AF_UNIX (Windows) or the directory is not writable
+            logger.warning(f"Task notifications unavailable, polling instead: {str(e)}")
+
+    @property
+    def available(self):
+        return self._socket is not None
+
+    def wait(self, timeout):
+        """Block until a wake-up arrives or timeout seconds pass; returns True if woken"""
+        if self._socket is None:
+            time.sleep(min(timeout, FALLBACK_POLL_SECONDS))
+            return False
+        try:
+            readable, _, _ = select.select([self._socket], [], [], max(timeout, 0))
+        except InterruptedError:
+            return False
+        if not readable:
+            return False
+        # Several enqueues while busy only need one pass over the queue
+        while True:
+            try:
+                self._socket.recv(64)
+            except (BlockingIOError, InterruptedError):
+                return True
+            except OSError:
+                return True
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+
+def notify(directory=None):
+    """Wake every idle worker on this host; returns how many sockets were signalled"""
+    directory = directory or _wake_dir()
+    try:
+        names = [name for name in os.listdir(directory) if name.endswith(SOCKET_SUFFIX)]
+    except OSError:
+        return 0
+    if not names:
+        return 0
+
+    sent = 0
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    except (AttributeError, OSError):
+        return 0
+    with sock:
+        sock.setblocking(False)
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                sock.sendto(b'\x01', path)
+                sent += 1
+            except BlockingIOError:
+                sent += 1  # Its buffer is full of wake-ups already
+            except OSError as e:
+                if e.errno in (errno.ECONNREFUSED, errno.ENOENT):
+                    # The worker exited without removing its socket
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+                else:
+                    logger.debug(f"Could not notify {path}: {str(e)}")
+    return sent
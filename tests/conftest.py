@@ -0,0 +1,83 @@
+"""
+Shared fixtures. The settings below are read by config.Config when it is
+first imported, so they are set before any module under test is imported.
+"""
+
+import os
+import tempfile
+
+import pytest
+
+_scratch = tempfile.mkdtemp(prefix='tests-')
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+os.environ.setdefault('STORAGE_CACHE_MAX_BYTES', '0')
+os.environ.setdefault('TASK_QUEUE_PATH', os.path.join(_scratch, 'queue.db'))
+os.environ.setdefault('TASK_WAKE_DIR', os.path.join(_scratch, 'wake'))
+os.environ.setdefault('WORKER_STATUS_PATH', os.path.join(_scratch, 'manager_status.json'))
+# Keeps worker_client from starting a worker manager when app imports it
+os.environ.setdefault('IMAGE_WORKER', '1')
+
+from config import Config  # noqa: E402
+
+# The app creates its tables on import, so point it at SQLite first
+Config.SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(_scratch, 'app.db')}"
+
+
+
+class FakeClock:
+    """Stands in for the time module so tests can move time forward"""
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def make_queue(tmp_path, clock, monkeypatch):
+    """Factory for TaskQueues in a fresh database that run on the fake clock"""
+    import task_queue
+    monkeypatch.setattr(task_queue, 'time', clock)
+    queues = []
+
+    def make(**settings):
+        settings.setdefault('lease_seconds', 60)
+        settings.setdefault('max_attempts', 3)
+        settings.setdefault('retry_base_delay', 10)
+        settings.setdefault('retry_max_delay', 15)
+        settings.setdefault('dedup_window', 0)
+        queue = task_queue.TaskQueue(str(tmp_path / 'queue.db'), **settings)
+        queues.append(queue)
+        return queue
+
+    yield make
+    for queue in queues:
+        queue.close()
+
+
+@pytest.fixture(scope='session')
+def app():
+    """The Flask app on a SQLite database in the scratch directory"""
+    from app import app
+    return app
+
+
+@pytest.fixture
+def admin_client(app):
+    """Test client logged in as the default admin user"""
+    client = app.test_client()
+    response = client.post('/login', data={'username': 'admin', 'password': 'Stitches1'})
+    assert response.status_code == 302
+    return client
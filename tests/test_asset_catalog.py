@@ -0,0 +1,66 @@
+"""Reference counting of shared artwork in the asset catalog"""
+
+import hashlib
+
+import pytest
+
+import asset_catalog
+from app import db, storage
+from models import Order, OrderItem, StoredAsset
+from utils import generate_order_number, get_content_key, get_derivative_key
+
+
+@pytest.fixture
+def shared_artwork(app):
+    """One stored original with a thumbnail, used by the items of two orders
+
+    Yields (file_key, thumbnail key, [order ids]).
+    """
+    data = b'artwork'
+    file_key = get_content_key(hashlib.sha256(data).hexdigest(), 'logo.png')
+    thumbnail_key = get_derivative_key(file_key, asset_catalog.THUMBNAIL)
+    assert storage.put_many({file_key: data, thumbnail_key: b'thumbnail'}).ok
+
+    with app.app_context():
+        asset_catalog.record_upload(file_key, size_bytes=len(data))
+        assert asset_catalog.add_reference(file_key)
+        asset_catalog.record_derivatives(file_key, {asset_catalog.THUMBNAIL: (thumbnail_key, 9)})
+        order_ids = []
+        for _ in range(2):
+            order = Order(order_number=generate_order_number(), email='customer@example.com', total_cost=1)
+            order.items.append(OrderItem(file_key=file_key, filename='logo.png', width_inches=2,
+                                         height_inches=1, quantity=1, cost=1))
+            db.session.add(order)
+            db.session.flush()
+            order_ids.append(order.id)
+        db.session.commit()
+
+    yield file_key, thumbnail_key, order_ids
+
+    with app.app_context():
+        asset_catalog.remove([file_key])
+    storage.delete_many([file_key, thumbnail_key])
+
+
+def test_release_keeps_blob_until_last_reference(app, admin_client, shared_artwork):
+    file_key, thumbnail_key, (first, second) = shared_artwork
+
+    response = admin_client.post('/admin/delete-orders', json={'order_ids': [first]})
+    assert response.json['success']
+    assert storage.file_exists(file_key)
+    assert storage.file_exists(thumbnail_key)
+    with app.app_context():
+        assert asset_catalog.lookup(file_key).ref_count == 1
+
+    response = admin_client.post('/admin/delete-orders', json={'order_ids': [second]})
+    assert response.json['success']
+    assert not storage.file_exists(file_key)
+    assert not storage.file_exists(thumbnail_key)
+    with app.app_context():
+        assert StoredAsset.query.filter_by(file_key=file_key).first() is None
+
+
+def test_release_reports_uncataloged_keys(app):
+    with app.app_context():
+        assert asset_catalog.release(['uploads/never-cataloged.png']) == {'uploads/never-cataloged.png': None}
+        db.session.rollback()
@@ -0,0 +1,27 @@
+"""Request validation of /admin/gang-sheet"""
+
+import pytest
+
+
+@pytest.mark.parametrize('body', [
+    {'order_ids': '1,2'},
+    {'order_ids': {'1': 2}},
+    {'order_ids': []},
+    {'order_ids': [1, 'two']},
+    {'order_ids': [True]},
+    {'order_ids': [1], 'dpi': 0},
+    {'order_ids': [1], 'dpi': -300},
+    {'order_ids': [1], 'dpi': 100000},
+    {'order_ids': [1], 'dpi': '300'},
+    [1, 2],
+])
+def test_invalid_requests_are_rejected(admin_client, body):
+    response = admin_client.post('/admin/gang-sheet', json=body)
+    assert response.status_code == 400
+    assert 'error' in response.json
+
+
+def test_valid_request_is_laid_out(admin_client):
+    response = admin_client.post('/admin/gang-sheet', json={'order_ids': [999999], 'dpi': 600})
+    assert response.status_code == 200
+    assert response.json['placements'] == []
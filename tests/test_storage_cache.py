@@ -0,0 +1,47 @@
+"""DiskCache fills racing with invalidation"""
+
+import io
+
+import pytest
+
+from storage import ObjectStorage
+from storage_backends import MemoryStorageBackend
+from storage_cache import CacheFillReader, DiskCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return DiskCache(tmp_path / 'cache', 10 * 1024 * 1024)
+
+
+def test_fill_started_before_invalidation_is_dropped(cache):
+    reader = CacheFillReader(io.BytesIO(b'old'), cache.new_writer('thumbnails/a-min.png'))
+    assert reader.read(10) == b'old'
+
+    # The object is overwritten while the old copy is still being read
+    cache.invalidate('thumbnails/a-min.png')
+    assert reader.read(10) == b''
+
+    assert cache.open('thumbnails/a-min.png') is None
+    assert not [path for path in cache.objects_dir.rglob('*') if path.is_file()]
+
+
+def test_fill_started_after_invalidation_is_kept(cache):
+    cache.invalidate('a.png')
+    cache.put_bytes('a.png', b'new')
+    with cache.open('a.png') as cached:
+        assert cached.read() == b'new'
+
+
+def test_stale_read_through_is_not_cached(cache):
+    storage = ObjectStorage(backend=MemoryStorageBackend(), cache=cache, retry_delay=0)
+    storage.upload_file(io.BytesIO(b'old'), 'a.png')
+
+    stale = storage.open_file('a.png')
+    assert storage.upload_file(io.BytesIO(b'new'), 'a.png', keep_cached=True)
+    with stale:
+        assert stale.read() == b'old'
+
+    assert storage.get_file('a.png') == b'new'
+    with cache.open('a.png') as cached:
+        assert cached.read() == b'new'
@@ -0,0 +1,132 @@
+"""Circuit breaker and retry policy for storage calls"""
+
+from io import BytesIO
+
+import pytest
+
+from storage import ObjectStorage
+from storage_backends import MemoryStorageBackend, StorageObjectNotFound
+from storage_resilience import CircuitBreaker, ResiliencePolicy, StorageUnavailable
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker(failure_threshold=3, reset_timeout=30, clock=clock.monotonic)
+
+
+def test_breaker_opens_after_consecutive_failures(breaker):
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_success()  # Resets the count
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.stats()['times_opened'] == 1
+
+
+def test_breaker_half_opens_after_reset_timeout(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+
+    clock.advance(29)
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.advance(1)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # One trial call at a time
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_failed_trial_call_opens_breaker_again(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    clock.advance(30)
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.stats()['times_opened'] == 2
+    clock.advance(29)
+    assert not breaker.allow()
+
+
+def test_open_breaker_short_circuits_policy_calls(breaker):
+    policy = ResiliencePolicy(max_attempts=5, breaker=breaker, sleep=lambda seconds: None, seed=0)
+    calls = []
+
+    def failing():
+        calls.append(1)
+        raise ConnectionError('unreachable')
+
+    # Retries stop as soon as the breaker opens
+    with pytest.raises(ConnectionError):
+        policy.call('download', failing)
+    assert len(calls) == 3
+
+    with pytest.raises(StorageUnavailable):
+        policy.call('download', failing)
+    assert len(calls) == 3
+    assert policy.stats()['operations']['download']['short_circuited'] == 1
+
+
+def test_missing_key_counts_as_healthy(breaker):
+    policy = ResiliencePolicy(breaker=breaker, sleep=lambda seconds: None)
+
+    def missing():
+        raise StorageObjectNotFound('a.png')
+
+    for _ in range(5):
+        with pytest.raises(StorageObjectNotFound):
+            policy.call('download', missing)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def _storage(backend, breaker=None, max_attempts=3):
+    policy = ResiliencePolicy(max_attempts=max_attempts, breaker=breaker, sleep=lambda seconds: None, seed=0)
+    return ObjectStorage(backend=backend, use_cache=False, policy=policy)
+
+
+def test_retries_recover_from_injected_failures():
+    backend = MemoryStorageBackend(failure_rate=0.3, seed=1)
+    storage = _storage(backend, max_attempts=10)
+
+    for i in range(20):
+        assert storage.upload_file(BytesIO(b'x' * 1000 + bytes([i])), f'{i}.png')
+    for i in range(20):
+        assert storage.get_file(f'{i}.png') == b'x' * 1000 + bytes([i])
+
+    operations = storage.resilience_stats()['operations']
+    assert operations['upload']['retries'] > 0
+    assert operations['get']['retries'] > 0
+    assert operations['upload']['failures'] == operations['get']['failures'] == 0
+
+
+def test_failing_backend_opens_breaker_and_fails_fast(breaker):
+    backend = MemoryStorageBackend(failure_rate=1.0, seed=0)
+    storage = _storage(backend, breaker=breaker, max_attempts=5)
+    calls = []
+    download = backend.download_bytes
+    backend.download_bytes = lambda key: calls.append(key) or download(key)
+
+    # The first call retries until the breaker opens after 3 failures
+    assert storage.get_file('a.png') is None
+    assert len(calls) == 3
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # Later calls are refused without reaching the backend
+    for _ in range(5):
+        assert storage.get_file('a.png') is None
+        assert not storage.upload_file(BytesIO(b'data'), 'b.png')
+    assert len(calls) == 3
+    operations = storage.resilience_stats()['operations']
+    assert operations['get']['short_circuited'] == 5
+    assert operations['upload']['short_circuited'] == 5
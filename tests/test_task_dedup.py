@@ -0,0 +1,64 @@
+"""TaskQueue deduplication: merging into queued or running tasks and suppression after completion"""
+
+
+def test_duplicate_merges_into_queued_task(make_queue):
+    queue = make_queue()
+    first = queue.enqueue('thumbnail', {'file_key': 'a'}, dedup_key='thumbnail:a')
+    second = queue.enqueue('thumbnail', {'file_key': 'a'}, priority=5, dedup_key='thumbnail:a')
+
+    assert second == first
+    stats = queue.stats()
+    assert stats['ready'] == 1
+    assert stats['merged'] == 1
+    # The merged task takes the higher priority
+    queue.enqueue('gang_sheet', {}, priority=3)
+    assert queue.lease().id == first
+
+
+def test_duplicate_merges_into_leased_task(make_queue):
+    queue = make_queue()
+    first = queue.enqueue('thumbnail', {'file_key': 'a'}, dedup_key='thumbnail:a')
+    task = queue.lease()
+
+    assert queue.enqueue('thumbnail', {'file_key': 'a'}, dedup_key='thumbnail:a') == first
+    assert queue.lease() is None
+    assert queue.stats()['merged'] == 1
+    assert queue.complete(task)
+
+
+def test_duplicates_in_one_batch_merge(make_queue):
+    queue = make_queue()
+    ids = queue.enqueue_many([('thumbnail', {'file_key': 'a'}, 0, 'thumbnail:a')] * 3)
+    assert len(set(ids)) == 1
+    assert queue.stats()['merged'] == 2
+
+
+def test_completed_key_is_suppressed_within_window(make_queue, clock):
+    queue = make_queue(dedup_window=60)
+    queue.enqueue('thumbnail', {'file_key': 'a'}, dedup_key='thumbnail:a')
+    queue.complete(queue.lease())
+
+    clock.advance(59)
+    assert queue.enqueue('thumbnail', {'file_key': 'a'}, dedup_key='thumbnail:a') is None
+    assert queue.stats()['suppressed'] == 1
+    assert queue.lease() is None
+
+    clock.advance(2)
+    assert queue.enqueue('thumbnail', {'file_key': 'a'}, dedup_key='thumbnail:a') is not None
+    assert queue.lease() is not None
+
+
+def test_failed_task_is_not_suppressed(make_queue):
+    queue = make_queue(dedup_window=60, max_attempts=1)
+    queue.enqueue('thumbnail', {'file_key': 'a'}, dedup_key='thumbnail:a')
+    queue.fail(queue.lease(), 'boom')
+
+    assert queue.enqueue('thumbnail', {'file_key': 'a'}, dedup_key='thumbnail:a') is not None
+
+
+def test_tasks_without_key_are_not_deduplicated(make_queue):
+    queue = make_queue()
+    first = queue.enqueue('batch_thumbnails', {'file_keys': ['a']})
+    second = queue.enqueue('batch_thumbnails', {'file_keys': ['a']})
+    assert first != second
+    assert queue.stats()['ready'] == 2
@@ -0,0 +1,126 @@
+"""TaskQueue leases, retries and dead letters"""
+
+import time
+
+import pytest
+
+from task_queue import TaskQueue
+
+
+def test_lease_hands_out_highest_priority_first(make_queue):
+    queue = make_queue()
+    low = queue.enqueue('thumbnail', {'file_key': 'a'})
+    high = queue.enqueue('thumbnail', {'file_key': 'b'}, priority=5)
+
+    assert queue.lease().id == high
+    assert queue.lease().id == low
+    assert queue.lease() is None
+
+
+def test_expired_lease_is_handed_out_again(make_queue, clock):
+    queue = make_queue(lease_seconds=60)
+    task_id = queue.enqueue('thumbnail', {'file_key': 'a'})
+    first = queue.lease(owner='host:1')
+    assert queue.lease(owner='host:2') is None
+
+    # A lost worker counts as a failed attempt, retried after the backoff
+    clock.advance(61)
+    assert queue.lease(owner='host:2') is None
+    assert queue.stats()['delayed'] == 1
+    clock.advance(10)
+    second = queue.lease(owner='host:2')
+    assert second.id == task_id
+    assert second.attempts == 2
+    assert second.lease != first.lease
+
+    # The first worker lost the task: its heartbeat and outcome are ignored
+    assert not queue.heartbeat(first)
+    assert not queue.complete(first)
+    assert queue.stats()['leased'] == 1
+    assert queue.complete(second)
+    assert queue.stats()['leased'] == 0
+
+
+def test_task_that_keeps_killing_its_worker_is_dead_lettered(make_queue, clock):
+    queue = make_queue(lease_seconds=60, max_attempts=3, retry_base_delay=10, retry_max_delay=15)
+    queue.enqueue('thumbnail', {'file_key': 'poison'})
+
+    for attempt in range(1, 4):
+        task = queue.lease()
+        while task is None:
+            clock.advance(queue.seconds_until_due())
+            task = queue.lease()
+        assert task.attempts == attempt
+        # The worker dies without calling complete() or fail()
+        clock.advance(61)
+
+    assert queue.lease() is None
+    stats = queue.stats()
+    assert stats['dead_letters'] == 1
+    assert stats['ready'] == stats['delayed'] == stats['leased'] == 0
+    assert queue.seconds_until_due() is None
+
+
+def test_heartbeat_keeps_the_lease(make_queue, clock):
+    queue = make_queue(lease_seconds=60)
+    queue.enqueue('thumbnail', {'file_key': 'a'})
+    task = queue.lease()
+
+    clock.advance(50)
+    assert queue.heartbeat(task)
+    clock.advance(50)
+    assert queue.lease() is None
+
+
+def test_fail_backs_off_then_dead_letters(make_queue, clock):
+    queue = make_queue(max_attempts=3, retry_base_delay=10, retry_max_delay=15)
+    queue.enqueue('thumbnail', {'file_key': 'a'})
+
+    # Backoff doubles from the base delay up to the maximum
+    for delay in (10, 15):
+        task = queue.lease()
+        assert queue.fail(task, 'boom')
+        assert queue.seconds_until_due() == pytest.approx(delay)
+        clock.advance(delay - 1)
+        assert queue.lease() is None
+        clock.advance(1)
+
+    task = queue.lease()
+    assert task.attempts == 3
+    assert not queue.fail(task, 'still broken')
+    stats = queue.stats()
+    assert stats['dead_letters'] == 1
+    assert stats['ready'] == stats['delayed'] == stats['leased'] == 0
+    assert queue.seconds_until_due() is None
+
+
+def test_fail_without_retry_dead_letters_at_once(make_queue):
+    queue = make_queue()
+    queue.enqueue('unknown', {})
+    assert not queue.fail(queue.lease(), 'no handler', retry=False)
+    assert queue.stats()['dead_letters'] == 1
+
+
+def test_retry_dead_letters_requeues(make_queue):
+    queue = make_queue(max_attempts=1)
+    queue.enqueue('thumbnail', {'file_key': 'a'})
+    queue.fail(queue.lease(), 'boom')
+
+    assert queue.retry_dead_letters() == 1
+    task = queue.lease()
+    assert task.data == {'file_key': 'a'}
+    assert queue.stats()['dead_letters'] == 0
+    assert task.attempts == 1
+
+
+def test_keep_alive_sets_lease_lost(tmp_path):
+    # Real time: the heartbeat thread waits on a threading.Event
+    queue = TaskQueue(str(tmp_path / 'queue.db'), lease_seconds=0.05, retry_base_delay=0)
+    queue.enqueue('thumbnail', {'file_key': 'a'})
+    task = queue.lease(owner='host:1')
+    time.sleep(0.1)
+    assert queue.lease(owner='host:2') is not None  # The lease ran out and another worker took over
+
+    with queue.keep_alive(task, interval=0.01):
+        assert task.lease_lost.wait(5)
+    queue.close()
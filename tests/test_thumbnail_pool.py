@@ -0,0 +1,40 @@
+"""ThumbnailPool recovery from a pool process that dies"""
+
+import logging
+import os
+import time
+
+from thumbnail_pool import ThumbnailPool
+
+
+def _job(path):
+    """Runs in a pool process: dies on the 'crash' file, else echoes the file name"""
+    if os.path.basename(path) == 'crash':
+        os._exit(1)
+    time.sleep(0.2)
+    return os.path.basename(path), {}
+
+
+def test_jobs_after_a_crash_run_on_the_new_pool(tmp_path, caplog):
+    names = ['a', 'b', 'crash', 'c', 'd', 'e', 'f', 'g', 'h', 'i']
+    items = []
+    for name in names:
+        (tmp_path / name).write_bytes(b'')
+        items.append((name, str(tmp_path / name), None))
+
+    caplog.set_level(logging.INFO, logger='thumbnail_pool')
+    pool = ThumbnailPool(processes=2, memory_limit_mb=0, max_pending=4)
+    try:
+        results = list(pool.render_ordered(items, job=_job))
+    finally:
+        pool.shutdown()
+
+    assert [key for key, _, _, _ in results] == names
+    errors = {key: error for key, _, error, _ in results if error is not None}
+    # Only jobs in flight on the pool that broke fail, all with the same error
+    assert 'crash' in errors
+    assert set(errors.values()) == {"Thumbnail process exited unexpectedly"}
+    assert all(result == key for key, result, error, _ in results[-4:])
+    assert not list(tmp_path.iterdir())
+    # The broken pool was replaced once; futures it left behind didn't shut down its successor
+    assert sum('Started thumbnail pool' in record.message for record in caplog.records) == 2
@@ -0,0 +1,64 @@
+"""Validation of uploaded artwork in /upload"""
+
+import json
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+
+def _png(mode, size, dpi=300):
+    buffer = BytesIO()
+    Image.new(mode, size).save(buffer, 'PNG', dpi=(dpi, dpi))
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def order_id(admin_client):
+    response = admin_client.post('/create-order', data={'email': 'customer@example.com', 'orderDetails': '[]',
+                                                         'totalCost': '1'})
+    return response.json['order_id']
+
+
+def _upload(client, order_id, data, filename='art.png'):
+    details = {'width': 1, 'height': 1, 'quantity': 1, 'cost': 1}
+    return client.post('/upload', data={'order_id': str(order_id), 'fileDetails': json.dumps(details),
+                                        'file': (BytesIO(data), filename)},
+                       content_type='multipart/form-data')
+
+
+@pytest.mark.parametrize('data', [
+    b'GIF89a not a png',
+    _png('RGBA', (7000, 300)),  # 23.3 inches at 300 DPI
+    _png('L', (300, 300)),
+])
+def test_unprintable_uploads_are_rejected(admin_client, order_id, data):
+    response = _upload(admin_client, order_id, data)
+    assert response.status_code == 400
+    assert response.json['error'] == 'Invalid file'
+
+
+@pytest.mark.parametrize('mode', ['RGBA', 'P'])
+def test_printable_uploads_are_stored(admin_client, order_id, mode):
+    response = _upload(admin_client, order_id, _png(mode, (600, 300)))
+    assert response.status_code == 200
+    assert response.json['success']
+
+
+def test_upload_fallback_renders_only_the_png_thumbnail(app):
+    from app import generate_small_thumbnail, storage
+    from models import StoredAsset
+    from utils import derivative_names, get_derivative_key
+
+    file_key = 'uploads/fallback.png'
+    assert storage.upload_file(BytesIO(_png('RGBA', (600, 300))), file_key)
+    with app.app_context():
+        assert generate_small_thumbnail(file_key)
+        asset = StoredAsset.query.filter_by(file_key=file_key).one()
+        assert asset.has_derivative('thumbnail')
+        # Everything else is left to the queue
+        assert not asset.has_derivatives(derivative_names())
+    others = [get_derivative_key(file_key, name) for name in derivative_names() if name != 'thumbnail']
+    assert not any(storage.file_exists(key) for key in others)
+    with Image.open(BytesIO(storage.get_file(get_derivative_key(file_key, 'thumbnail')))) as thumbnail:
+        assert thumbnail.size == (100, 50)
@@ -0,0 +1,275 @@
+"""
+Process pool for generating previews in the image worker.
+Decoding and resizing large DTF PNGs is CPU bound, so it runs in a pool of
+processes (one per CPU by default) while the worker process keeps fetching
+originals and uploading finished previews. Each pool process has an address
+space limit so a single oversized image fails with MemoryError instead of
+taking the whole host down.
+
+Originals reach the pool processes as temporary files that the worker
+process streams them into; only the path is pickled, so neither process
+holds a whole original in memory.
+"""
+
+import os
+import time
+import shutil
+import logging
+import tempfile
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+from artwork_analysis import AlphaAnalysis, analyze_image
+from config import Config
+from image_decode import peak_memory_bytes, reset_peak_memory
+from storage_backends import CHUNK_SIZE
+from utils import generate_derivatives, get_derivative_key
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+
+def default_processes():
+    """Pool size from the config, or one process per CPU"""
+    return Config.WORKER_PROCESSES or os.cpu_count() or 1
+
+
+def _init_process(memory_limit):
+    """Runs once in each pool process before it takes any work"""
+    import signal
+    # Shutdown is driven by the worker process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if memory_limit and resource is not None:
+        try:
+            _, hard = resource.getrlimit(resource.RLIMIT_AS)
+            if hard != resource.RLIM_INFINITY:
+                memory_limit = min(memory_limit, hard)
+            resource.setrlimit(resource.RLIMIT_AS, (memory_limit, hard))
+        except (ValueError, OSError) as e:
+            logger.warning(f"Could not set the memory limit for thumbnail process: {str(e)}")
+
+
+def _render(path):
+    """Runs in a pool process: every preview size of the original at path
+
+    The alpha channel is analyzed during the same decode. Returns
+    ((derivatives, analysis), stats) where stats has the render time and the
+    peak memory of the process while rendering, for sizing the workers.
+    """
+    peak_is_per_job = reset_peak_memory()
+    start = time.perf_counter()
+    analysis = AlphaAnalysis()
+    with open(path, 'rb') as source:
+        derivatives = generate_derivatives(source, analysis=analysis)
+    if derivatives is None:
+        raise ValueError("Failed to generate derivatives")
+    return (derivatives, analysis.result()), _stats(start, peak_is_per_job)
+
+
+def _analyze(path):
+    """Runs in a pool process: only the alpha analysis of the original at path
+
+    Returns (analysis, stats).
+    """
+    peak_is_per_job = reset_peak_memory()
+    start = time.perf_counter()
+    with open(path, 'rb') as source:
+        analysis = analyze_image(source)
+    return analysis, _stats(start, peak_is_per_job)
+
+
+def _stats(start, peak_is_per_job):
+    peak = peak_memory_bytes()
+    return {
+        'seconds': round(time.perf_counter() - start, 3),
+        'peak_memory_mb': round(peak / MB, 1) if peak is not None else None,
+        'peak_is_per_job': peak_is_per_job,
+    }
+
+
+class ThumbnailPool:
+    """Generates previews in a pool of processes, results in submission order"""
+
+    def __init__(self, processes=None, memory_limit_mb=None, max_pending=None):
+        self.processes = max(1, processes or default_processes())
+        if memory_limit_mb is None:
+            memory_limit_mb = Config.WORKER_TASK_MEMORY_MB
+        self.memory_limit = memory_limit_mb * MB if memory_limit_mb else None
+        # Enough queued work to keep every process busy while results are uploaded
+        self.max_pending = max_pending or self.processes * 2
+        self._executor = None
+        self._generation = 0  # Bumped for every new executor, see _restart
+
+    def _pool(self):
+        if self._executor is None:
+            # spawn rather than fork: the worker process has storage threads
+            # and open connections that the pool processes must not inherit
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_process,
+                initargs=(self.memory_limit,),
+            )
+            self._generation += 1
+            logger.info(f"Started thumbnail pool with {self.processes} processes")
+        return self._executor
+
+    def start(self):
+        """Start the pool processes now rather than on the first render"""
+        self._pool().submit(int).result()
+
+    def _restart(self, generation):
+        """Drop the broken pool of generation; the next submit starts a new one
+
+        Futures of an executor that was already replaced fail with
+        BrokenProcessPool as well; they must not shut down its healthy successor.
+        """
+        if self._executor is not None and generation == self._generation:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _submit(self, job, path):
+        """Submit job(path); returns (future, executor generation) for _collect"""
+        try:
+            return self._pool().submit(job, path), self._generation
+        except BrokenProcessPool:
+            self._restart(self._generation)
+            return self._pool().submit(job, path), self._generation
+
+    def _collect(self, submitted):
+        """Return (result, error, stats) for a job from _submit"""
+        future, generation = submitted
+        try:
+            result, stats = future.result()
+            return result, None, stats
+        except MemoryError:
+            limit_mb = self.memory_limit // MB if self.memory_limit else 0
+            return None, f"Image exceeds the {limit_mb}MB thumbnail memory budget", {}
+        except BrokenProcessPool:
+            # A process died (e.g. killed by the OS); the others in flight fail with it
+            self._restart(generation)
+            return None, "Thumbnail process exited unexpectedly", {}
+        except Exception as e:
+            return None, str(e), {}
+
+    def render(self, path):
+        """Generate every preview size of the original at path and analyze it
+
+        Returns (({derivative name: encoded bytes}, analysis), None, stats)
+        or (None, error, stats); analysis is AlphaAnalysis.result().
+        """
+        return self._collect(self._submit(_render, path))
+
+    def render_ordered(self, items, job=_render):
+        """Render a stream of spooled originals and yield the results in the same order
+
+        Args:
+            items: Iterable of (key, temporary file path or None, error), as
+                from _spool_sources; items with no file are passed through
+                with their error. Each file is deleted once its job is done.
+            job: _render for previews and analysis, _analyze for analysis only
+
+        Yields (key, result of job or None, error, stats). At most
+        max_pending images are queued, so the next originals are read while
+        earlier ones render.
+        """
+        window = deque()
+        try:
+            for key, path, error in items:
+                window.append((key, path, None, error))
+                if path is not None:
+                    window[-1] = (key, path, self._submit(job, path), error)
+                if len(window) >= self.max_pending:
+                    yield self._result(*window.popleft())
+            while window:
+                yield self._result(*window.popleft())
+        finally:
+            # The caller stopped early or a submit failed
+            for _, path, submitted, _ in window:
+                if submitted is not None:
+                    submitted[0].cancel()
+                _remove(path)
+
+    def _result(self, key, path, submitted, error):
+        if submitted is None:
+            return key, None, error, {}
+        try:
+            result, error, stats = self._collect(submitted)
+        finally:
+            _remove(path)
+        return key, result, error, stats
+
+    def process(self, file_keys, storage_client):
+        """Fetch, render and upload the previews of several originals
+
+        Fetching runs on the storage thread pool, rendering on the process
+        pool and uploading in the calling thread, so all three overlap.
+
+        Yields (file_key, {derivative name: (storage key, size)} written,
+        analysis or None, error, stats) in the order of file_keys; stats are
+        those of the render.
+        """
+        sources = _spool_sources(storage_client.open_many(file_keys))
+        for file_key, rendered, error, stats in self.render_ordered(sources):
+            if rendered is None:
+                yield file_key, {}, None, error, stats
+                continue
+            derivatives, analysis = rendered
+            keys = {name: get_derivative_key(file_key, name) for name in derivatives}
+            result = storage_client.put_many({keys[name]: data for name, data in derivatives.items()})
+            written = {name: (keys[name], len(data)) for name, data in derivatives.items()
+                       if keys[name] in result.results}
+            error = '; '.join(f"{key}: {message}" for key, message in result.errors.items()) or None
+            yield file_key, written, analysis, error, stats
+
+    def analyze(self, file_keys, storage_client):
+        """Fetch and analyze originals that already have their previews
+
+        Yields (file_key, analysis or None, error, stats) in the order of file_keys.
+        """
+        sources = _spool_sources(storage_client.open_many(file_keys))
+        yield from self.render_ordered(sources, job=_analyze)
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=not wait)
+            self._executor = None
+
+
+def _spool_sources(sources):
+    """Copy open_many results into temporary files: (key, path or None, error)
+
+    The caller deletes the files (render_ordered does once each job is done).
+    """
+    for file_key, source, error in sources:
+        if source is None:
+            yield file_key, None, error or "File not found"
+            continue
+        try:
+            with source, tempfile.NamedTemporaryFile(prefix='thumbnail-', delete=False) as spool:
+                try:
+                    shutil.copyfileobj(source, spool, CHUNK_SIZE)
+                except Exception:
+                    spool.close()
+                    _remove(spool.name)
+                    raise
+        except Exception as e:
+            yield file_key, None, str(e)
+            continue
+        yield file_key, spool.name, None
+
+
+def _remove(path):
+    if path is not None:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
@@ -0,0 +1,125 @@
+"""
+Incremental scan of order items for missing previews.
+Instead of reloading every recent order and probing storage for each
+thumbnail, the scan keeps a watermark on OrderItem.id (ScanWatermark) and
+only reads the items added since its last run. Items whose previews the
+asset catalog doesn't list as complete are recorded in missing_derivatives.
+Each run rechecks those against the catalog, drops the ones that have their
+previews now, and returns the file keys to queue thumbnails for. With no
+new items and nothing missing a run is two indexed queries.
+
+The first run starts at the orders of the last THUMBNAIL_SCAN_BACKFILL_HOURS.
+worker_manager schedules one scan every THUMBNAIL_SCAN_INTERVAL seconds as a
+worker task; the watermark only moves forward, so a concurrent scan from
+another host skips a batch instead of recording it twice.
+
+All functions need an application context.
+"""
+
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from config import Config
+from models import MissingDerivatives, Order, OrderItem, ScanWatermark
+from utils import derivative_names
+import asset_catalog
+
+logger = logging.getLogger(__name__)
+
+SCAN_NAME = 'thumbnails'
+
+
+def _watermark():
+    """The scan's watermark row, created on the first run"""
+    watermark = db.session.get(ScanWatermark, SCAN_NAME)
+    if watermark is not None:
+        return watermark
+
+    cutoff = datetime.utcnow() - timedelta(hours=Config.THUMBNAIL_SCAN_BACKFILL_HOURS)
+    last_id = db.session.query(func.max(OrderItem.id)).join(Order).filter(Order.created_at < cutoff).scalar()
+    try:
+        with db.session.begin_nested():
+            db.session.add(ScanWatermark(name=SCAN_NAME, last_id=last_id or 0))
+        db.session.commit()
+        logger.info(f"Started the thumbnail scan after order item {last_id or 0}")
+    except IntegrityError:
+        pass  # Another process created it first
+    return db.session.get(ScanWatermark, SCAN_NAME)
+
+
+def _complete(file_keys):
+    """The subset of file_keys whose previews the catalog lists as complete"""
+    names = derivative_names()
+    return {file_key for file_key, asset in asset_catalog.get_assets(file_keys).items()
+            if asset.has_derivatives(names)}
+
+
+def scan(batch_size=None):
+    """Record the order items added since the last scan that lack previews
+
+    Returns (items scanned, items recorded as missing).
+    """
+    batch_size = batch_size or Config.THUMBNAIL_SCAN_BATCH
+    scanned = missing = 0
+    while True:
+        last_id = _watermark().last_id
+        rows = db.session.query(OrderItem.id, OrderItem.file_key).filter(
+            OrderItem.id > last_id).order_by(OrderItem.id).limit(batch_size).all()
+        if not rows:
+            break
+
+        complete = _complete([file_key for _, file_key in rows])
+        for item_id, file_key in rows:
+            if file_key not in complete:
+                db.session.merge(MissingDerivatives(order_item_id=item_id, file_key=file_key, attempts=0))
+                missing += 1
+
+        # Move the watermark only from where this batch started
+        updated = ScanWatermark.query.filter_by(name=SCAN_NAME, last_id=last_id).update(
+            {ScanWatermark.last_id: rows[-1][0], ScanWatermark.updated_at: datetime.utcnow()},
+            synchronize_session=False)
+        if not updated:
+            db.session.rollback()
+            logger.info("Another thumbnail scan moved the watermark, stopping")
+            break
+        db.session.commit()
+        scanned += len(rows)
+        if len(rows) < batch_size:
+            break
+    return scanned, missing
+
+
+def due(limit=None):
+    """File keys of recorded items that still lack previews, to queue thumbnails for
+
+    Items that have their previews now, or were deleted, are dropped; items
+    queued THUMBNAIL_SCAN_MAX_ATTEMPTS times already are left recorded.
+    """
+    limit = limit or Config.THUMBNAIL_SCAN_MAX_QUEUED
+    rows = db.session.query(MissingDerivatives, OrderItem.id).outerjoin(
+        OrderItem, OrderItem.id == MissingDerivatives.order_item_id).filter(
+        MissingDerivatives.attempts < Config.THUMBNAIL_SCAN_MAX_ATTEMPTS).order_by(
+        MissingDerivatives.order_item_id).limit(limit).all()
+    if not rows:
+        return []
+
+    complete = _complete([entry.file_key for entry, _ in rows])
+    now = datetime.utcnow()
+    file_keys = []
+    for entry, item_id in rows:
+        if item_id is None or entry.file_key in complete:
+            db.session.delete(entry)
+            continue
+        entry.attempts += 1
+        entry.queued_at = now
+        file_keys.append(entry.file_key)
+    db.session.commit()
+    return list(dict.fromkeys(file_keys))
+
+
+def missing_count():
+    """Recorded items without previews, including those no longer queued"""
+    return MissingDerivatives.query.count()
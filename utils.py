@@ -1,9 +1,11 @@
 import os
 import uuid
-from PIL import Image
+from PIL import Image, features
 Image.MAX_IMAGE_PIXELS = None  # Disable decompression bomb protection
 from werkzeug.utils import secure_filename
 from config import Config
+from png_header import PNGHeaderError, read_png_header
+from image_decode import ImageTooLarge, open_for_previews
 from io import BytesIO
 import logging
 from decimal import Decimal, ROUND_HALF_UP
@@ -52,74 +54,200 @@ def calculate_cost(width_inches, height_inches):
     return float(cost)
 
 def get_image_dimensions(file_data):
-    with Image.open(file_data) as img:
-        # Get physical size in inches using the image's DPI info
-        dpi_x, dpi_y = img.info.get('dpi', (96, 96))  # Default to 96 DPI if not specified
-        
-        # Convert to Decimal for precise calculations
-        width_px = Decimal(str(img.size[0]))
-        height_px = Decimal(str(img.size[1]))
-        dpi_x = Decimal(str(dpi_x))
-        dpi_y = Decimal(str(dpi_y))
-        
-        # Calculate dimensions with 2 decimal places precision
-        width_inches = (width_px / dpi_x).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-        height_inches = (height_px / dpi_y).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-        
-        logger.debug(f"Image dimensions calculation:")
-        logger.debug(f"Pixels: {width_px} x {height_px}")
-        logger.debug(f"DPI: {dpi_x} x {dpi_y}")
-        logger.debug(f"Result inches: {width_inches} x {height_inches}")
-        
-        # Return as float but maintain precision
-        return float(width_inches), float(height_inches)
+    # Only the PNG header is read, never the pixel data
+    info = read_png_header(file_data)
+    dpi_x, dpi_y = info.dpi_or_default  # Default to 96 DPI if not specified
+
+    # Convert to Decimal for precise calculations
+    width_px = Decimal(str(info.width))
+    height_px = Decimal(str(info.height))
+    dpi_x = Decimal(str(dpi_x))
+    dpi_y = Decimal(str(dpi_y))
+
+    # Calculate dimensions with 2 decimal places precision
+    width_inches = (width_px / dpi_x).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    height_inches = (height_px / dpi_y).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+    logger.debug(f"Image dimensions calculation:")
+    logger.debug(f"Pixels: {width_px} x {height_px}")
+    logger.debug(f"DPI: {dpi_x} x {dpi_y}")
+    logger.debug(f"Result inches: {width_inches} x {height_inches}")
+
+    # Return as float but maintain precision
+    return float(width_inches), float(height_inches)
+
+def read_image_info(file_data):
+    """Read pixel size and DPI from the PNG header without decoding pixels
+
+    The file position is restored afterwards so the file can still be uploaded.
+    Raises PNGHeaderError if the file is not a PNG.
+    """
+    return header_image_info(read_png_header(file_data))
+
+def header_image_info(info):
+    """Catalog fields (width_px, height_px, dpi_x, dpi_y) of a png_header.PNGInfo"""
+    dpi_x, dpi_y = info.dpi_or_default
+    return {
+        'width_px': info.width,
+        'height_px': info.height,
+        'dpi_x': float(dpi_x),
+        'dpi_y': float(dpi_y)
+    }
+
+# Longest printable side; the film is 22 inches wide
+MAX_PRINT_INCHES = 22
+
+# Colour modes validate_image accepts; uploads also take palette PNGs (see ingest.py)
+PRINT_MODES = ('RGB', 'RGBA')
+
+def check_image(info, modes=PRINT_MODES):
+    """Return why a PNG (png_header.PNGInfo) can't be printed, or None if it can"""
+    if info.mode not in modes:
+        names = ['palette' if mode == 'P' else mode for mode in modes]
+        return f"Image must be in {', '.join(names[:-1])} or {names[-1]} format"
+
+    # Get physical dimensions
+    dpi_x, dpi_y = info.dpi_or_default
+    width_inches = info.width / dpi_x
+    height_inches = info.height / dpi_y
+
+    # Log the dimensions for debugging
+    logger.debug(f"Image physical dimensions: {width_inches:.2f}\" x {height_inches:.2f}\"")
+
+    # Check if either dimension exceeds 22 inches
+    if width_inches > MAX_PRINT_INCHES or height_inches > MAX_PRINT_INCHES:
+        return (f"Image dimensions ({width_inches:.1f}\" x {height_inches:.1f}\") exceed maximum of "
+                f"{MAX_PRINT_INCHES} inches")
+    return None
 
 def validate_image(file_data):
     try:
-        with Image.open(file_data) as img:
-            if img.format != 'PNG':
-                return False, "Only PNG files are supported"
-            if img.mode not in ('RGB', 'RGBA'):
-                return False, "Image must be in RGB or RGBA format"
-            
-            # Get physical dimensions
-            dpi_x, dpi_y = img.info.get('dpi', (96, 96))
-            width_inches = img.size[0] / dpi_x
-            height_inches = img.size[1] / dpi_y
-            
-            # Log the dimensions for debugging
-            logger.debug(f"Image physical dimensions: {width_inches:.2f}\" x {height_inches:.2f}\"")
-            
-            # Check if either dimension exceeds 22 inches
-            if width_inches > 22 or height_inches > 22:
-                return False, f"Image dimensions ({width_inches:.1f}\" x {height_inches:.1f}\") exceed maximum of 22 inches"
-                
-            return True, "Image is valid"
+        info = read_png_header(file_data)
+    except PNGHeaderError as e:
+        return False, str(e)
     except Exception as e:
         return False, f"Error validating image: {str(e)}"
 
-def generate_thumbnail(image_data, max_size=(100, 100)):
-    """Generate a lightweight thumbnail from image data"""
+    problem = check_image(info)
+    if problem is not None:
+        return False, problem
+    return True, "Image is valid"
+
+# Preview sizes (longest side in pixels) generated for every original, largest
+# first; the 100 px one is the original thumbnail and keeps its -min.png key
+DERIVATIVE_SIZES = {'large': 1600, 'preview': 400, 'thumbnail': 100}
+
+# Smaller formats saved next to each PNG preview, best first, as
+# (MIME type, save options). Both keep the alpha channel.
+VARIANT_FORMATS = {
+    'avif': ('image/avif', {'quality': 60, 'speed': 8}),
+    'webp': ('image/webp', {'quality': 80, 'method': 4}),
+}
+
+def _pillow_supports(fmt):
+    try:
+        return features.check_module(fmt)
+    except ValueError:  # Pillow too old to know the format
+        return False
+
+# Variants this Pillow build can write; PNG is always generated
+SUPPORTED_VARIANTS = [fmt for fmt in VARIANT_FORMATS if _pillow_supports(fmt)]
+
+def variant_name(name, fmt):
+    """Derivative name of the fmt variant of a preview, e.g. 'thumbnail.webp'"""
+    return f"{name}.{fmt}"
+
+def derivative_names():
+    """Every derivative generated for an original: each PNG size and its variants"""
+    names = list(DERIVATIVE_SIZES)
+    for fmt in SUPPORTED_VARIANTS:
+        names.extend(variant_name(name, fmt) for name in DERIVATIVE_SIZES)
+    return names
+
+def generate_derivatives(image_data, sizes=None, formats=None, analysis=None):
+    """Generate every preview size of an image from a single decode
+
+    Each size is reduced from the previous, larger one instead of from the
+    original, so the full-resolution pixels are decoded and resampled once.
+    Every size is saved as PNG and in each of formats (default: the
+    variants Pillow supports), e.g. 'thumbnail' and 'thumbnail.webp'.
+
+    Large images are reduced while they are decoded (image_decode), so
+    memory stays bounded however large the original is. If analysis (an
+    artwork_analysis.AlphaAnalysis) is given, it is fed the full-resolution
+    pixels during the same decode.
+
+    Returns {derivative name: encoded bytes}, or None on error.
+
+    Raises:
+        ImageTooLarge: The image is over the decode budget
+    """
+    sizes = sizes or DERIVATIVE_SIZES
+    formats = SUPPORTED_VARIANTS if formats is None else formats
     try:
-        img = Image.open(BytesIO(image_data))
-        
-        # Keep original mode (RGBA or RGB)
-        if img.mode not in ('RGBA', 'RGB'):
-            img = img.convert('RGBA')
-        
-        # Calculate thumbnail size while maintaining aspect ratio
-        img.thumbnail(max_size, Image.Resampling.LANCZOS)
-        
-        # Save thumbnail as PNG to preserve transparency
-        thumb_io = BytesIO()
-        img.save(thumb_io, 'PNG', optimize=True)
-        thumb_io.seek(0)
-        
-        return thumb_io.getvalue()
+        # RGB or RGBA, already reduced if the original is large
+        img = open_for_previews(image_data, max(sizes.values()), analysis)
+
+        derivatives = {}
+        for name, size in sorted(sizes.items(), key=lambda item: item[1], reverse=True):
+            # Shrinks img in place, keeping the aspect ratio (never enlarges)
+            img.thumbnail((size, size), Image.Resampling.LANCZOS)
+            output = BytesIO()
+            # optimize makes a noticeable difference only on the small sizes
+            img.save(output, 'PNG', optimize=size <= 100)
+            derivatives[name] = output.getvalue()
+
+            for fmt in formats:
+                output = BytesIO()
+                img.save(output, fmt.upper(), **VARIANT_FORMATS[fmt][1])
+                derivatives[variant_name(name, fmt)] = output.getvalue()
+
+        return derivatives
+    except ImageTooLarge:
+        raise
     except Exception as e:
-        logger.error(f"Error generating thumbnail: {str(e)}")
+        logger.error(f"Error generating derivatives: {str(e)}")
         return None
 
+def closest_derivative(size=None):
+    """Return the name of the smallest derivative at least size pixels long
+
+    Falls back to the largest derivative for bigger sizes, and to the
+    thumbnail when no size is given.
+    """
+    if not size:
+        return 'thumbnail'
+    by_size = sorted(DERIVATIVE_SIZES, key=DERIVATIVE_SIZES.get)
+    for name in by_size:
+        if DERIVATIVE_SIZES[name] >= size:
+            return name
+    return by_size[-1]
+
+def get_derivative_key(file_key, name):
+    """Generate the storage key for a derivative of file_key
+
+    Variants share the key of their PNG preview with their own extension.
+    """
+    name, _, fmt = name.partition('.')
+    if name == 'thumbnail':
+        key = get_thumbnail_key(file_key)
+    else:
+        base, ext = os.path.splitext(file_key)
+        key = f"{base}-{DERIVATIVE_SIZES[name]}.png"
+    if fmt:
+        key = f"{os.path.splitext(key)[0]}.{fmt}"
+    return key
+
+def get_derivative_mimetype(name):
+    """MIME type of a derivative, from its name"""
+    fmt = name.partition('.')[2]
+    return VARIANT_FORMATS[fmt][0] if fmt else 'image/png'
+
+def get_content_key(content_hash, filename):
+    """Generate the content-addressed storage key for an upload with the given SHA-256 digest"""
+    ext = os.path.splitext(filename)[1].lower()
+    return f"cas/{content_hash}{ext}"
+
 def get_thumbnail_key(file_key):
     """Generate the storage key for a thumbnail"""
     name, ext = os.path.splitext(file_key)
@@ -5,7 +5,7 @@ This process runs independently of the main Flask app and handles:
 - Image validation and processing
 - Background image tasks
 
-Communication happens via Redis for production or filesystem-based queues for development.
+Tasks come from the SQLite task queue (task_queue.py) that worker_client adds to.
 """
 
 import os
@@ -15,7 +15,6 @@ import json
 import logging
 import signal
 import threading
-from io import BytesIO
 from pathlib import Path
 from datetime import datetime, timedelta
 import traceback
@@ -26,12 +25,18 @@ logger = logging.getLogger(__name__)
 
 # Global variables
 exit_flag = False
+current_task = None  # Task being processed, so a shutdown signal can wait for it
+thumbnail_pool = None  # Created on first use, see get_thumbnail_pool
 task_path = Path("worker_tasks")
 task_path.mkdir(exist_ok=True)
 
 # Import shared modules that don't have circular dependencies
 from storage import ObjectStorage
-from utils import generate_thumbnail, get_thumbnail_key
+from utils import derivative_names, get_derivative_key
+from thumbnail_pool import ThumbnailPool
+from config import Config
+from task_queue import RETIRED_TASK_TYPES, get_queue
+from task_wakeup import FALLBACK_POLL_SECONDS, WakeListener, notify
 
 # Initialize storage
 try:
@@ -71,102 +76,145 @@ class Task:
             data.get('priority', 0)
         )
 
+def derivative_keys(file_key):
+    """Return {derivative name: storage key} for every preview of file_key"""
+    return {name: get_derivative_key(file_key, name) for name in derivative_names()}
+
+def probe_derivatives(file_keys, storage_client):
+    """Check storage for the previews of files that are not cataloged yet
+
+    Previews found are recorded in the catalog. Returns {file_key: True if
+    every preview size exists}.
+    """
+    from worker_db import record_derivatives
+
+    keys = {file_key: derivative_keys(file_key) for file_key in file_keys}
+    probed = storage_client.exists_many([key for names in keys.values() for key in names.values()])
+
+    complete = {}
+    for file_key, names in keys.items():
+        found = {name: (key, None) for name, key in names.items() if probed.results.get(key)}
+        if found:
+            record_derivatives(file_key, found)
+        complete[file_key] = len(found) == len(names)
+    return complete
+
+def get_thumbnail_pool():
+    """Process pool shared by every thumbnail task in this worker"""
+    global thumbnail_pool
+    if thumbnail_pool is None:
+        thumbnail_pool = ThumbnailPool()
+    return thumbnail_pool
+
 def process_thumbnail_task(file_key, storage_client):
-    """Process a single thumbnail generation task"""
+    """Generate the thumbnail and larger previews of a single file"""
     try:
         logger.info(f"Processing thumbnail task for {file_key}")
-        
-        # Generate thumbnail key
-        thumbnail_key = get_thumbnail_key(file_key)
-        
-        # Check if thumbnail exists already
-        if storage_client.get_file(thumbnail_key):
-            logger.info(f"Thumbnail already exists for {file_key}")
+
+        # Check the asset catalog, then storage for files not cataloged yet
+        from worker_db import get_derivatives_status
+        complete = get_derivatives_status(file_key)
+        if complete is None:
+            complete = probe_derivatives([file_key], storage_client)[file_key]
+        if complete:
+            logger.info(f"Thumbnails already exist for {file_key}")
             return True
-            
-        # Get the original file
-        file_data = storage_client.get_file(file_key)
-        if not file_data:
-            logger.error(f"Original file not found: {file_key}")
-            return False
-            
-        # Generate the thumbnail
-        thumb_data = generate_thumbnail(file_data)
-        if not thumb_data:
-            logger.error(f"Failed to generate thumbnail for {file_key}")
-            return False
-            
-        # Save the thumbnail
-        storage_client.upload_file(BytesIO(thumb_data), thumbnail_key)
-        logger.info(f"Successfully generated thumbnail for {file_key}")
-        
-        return True
+
+        # Decode once in the pool and write every preview size
+        return process_batch_thumbnails_task([file_key], storage_client, skip_check=True)
     except Exception as e:
         logger.error(f"Error processing thumbnail for {file_key}: {e}")
         return False
 
-def process_batch_thumbnails_task(batch_file_keys, storage_client):
-    """Process a batch of thumbnails"""
+def process_batch_thumbnails_task(batch_file_keys, storage_client, skip_check=False):
+    """Process a batch of thumbnails
+
+    Originals are fetched concurrently and decoded in the process pool, one
+    per CPU, while finished previews are uploaded; each original is decoded
+    once for all preview sizes and its alpha analysis. Files that already
+    have every preview but no analysis are only analyzed.
+    """
+    from worker_db import get_derivatives_statuses, get_unanalyzed, record_analysis, record_derivatives
+
     successful = 0
     failed = 0
-    
-    for file_key in batch_file_keys:
-        try:
-            success = process_thumbnail_task(file_key, storage_client)
-            if success:
-                successful += 1
+    batch_file_keys = list(dict.fromkeys(batch_file_keys))
+
+    if skip_check:
+        pending = batch_file_keys
+    else:
+        # Skip files that already have every preview: one catalog query for the
+        # batch, then concurrent storage checks for files not cataloged yet
+        statuses = get_derivatives_statuses(batch_file_keys)
+        uncataloged = [key for key in batch_file_keys if key not in statuses]
+        statuses.update(probe_derivatives(uncataloged, storage_client))
+
+        pending = []
+        complete = []
+        for file_key in batch_file_keys:
+            if statuses[file_key]:
+                complete.append(file_key)
             else:
-                failed += 1
-        except Exception as e:
-            logger.error(f"Error processing batch thumbnail {file_key}: {e}")
+                pending.append(file_key)
+
+        unanalyzed = get_unanalyzed(complete)
+        for file_key, analysis, error, _ in get_thumbnail_pool().analyze(
+                [key for key in complete if key in unanalyzed], storage_client):
+            if analysis is not None:
+                record_analysis(file_key, analysis)
+            else:
+                logger.error(f"Error analyzing {file_key}: {error}")
+        successful += len(complete)
+
+    for file_key, written, analysis, error, stats in get_thumbnail_pool().process(pending, storage_client):
+        if written:
+            record_derivatives(file_key, written)
+        if analysis is not None:
+            record_analysis(file_key, analysis)
+        if error is None:
+            logger.info(f"Successfully generated thumbnails for {file_key} in {stats.get('seconds')}s, "
+                        f"peak memory {stats.get('peak_memory_mb')}MB")
+            successful += 1
+        else:
+            logger.error(f"Error processing thumbnail {file_key}: {error}")
             failed += 1
-    
+
     logger.info(f"Batch processing complete: {successful} successful, {failed} failed")
     return successful > 0
 
-def process_recent_orders_task(hours=24, max_thumbnails=20, storage_client=None):
-    """Process thumbnails for recent orders"""
-    if storage_client is None:
-        storage_client = storage
-    
+def process_thumbnail_scan_task():
+    """Scan new order items for missing previews and queue thumbnail tasks for them"""
+    from worker_db import scan_missing_derivatives
+
+    result = scan_missing_derivatives()
+    if result is None:
+        return False
+    scanned, missing, file_keys = result
+    if file_keys:
+        get_queue().enqueue_many([('thumbnail', {'file_key': file_key}, 0, f"thumbnail:{file_key}")
+                                  for file_key in file_keys])
+        notify()
+    logger.info(f"Thumbnail scan: {scanned} new order items, {missing} missing previews, "
+                f"{len(file_keys)} files queued")
+    return True
+
+def process_gang_sheet_task(task_data, storage_client):
+    """Render a gang sheet and upload it to storage"""
+    from gang_sheet import SheetRenderer
+
+    key = task_data['key']
     try:
-        # Import here to avoid circular imports
-        from worker_db import get_recent_orders
-        
-        # Get recent orders from database
-        recent_orders = get_recent_orders(hours)
-        
-        if not recent_orders:
-            logger.info("No recent orders found")
-            return True
-            
-        logger.info(f"Processing thumbnails for {len(recent_orders)} recent orders")
-        
-        processed = 0
-        for order in recent_orders:
-            if processed >= max_thumbnails:
-                break
-                
-            for item in order.get('items', []):
-                if processed >= max_thumbnails:
-                    break
-                
-                file_key = item.get('file_key')
-                if not file_key:
-                    continue
-                    
-                try:
-                    success = process_thumbnail_task(file_key, storage_client)
-                    if success:
-                        processed += 1
-                except Exception as e:
-                    logger.error(f"Error processing thumbnail in recent orders: {e}")
-        
-        logger.info(f"Processed {processed} thumbnails from recent orders")
+        renderer = SheetRenderer(storage_client, task_data.get('dpi', 300))
+        start = time.time()
+        if not renderer.render_to_storage(task_data['placements'], key, task_data['roll_width'],
+                                          task_data['length']):
+            logger.error(f"Failed to upload gang sheet {key}")
+            return False
+        logger.info(f"Rendered gang sheet {key} with {len(task_data['placements'])} pieces "
+                    f"in {time.time() - start:.1f}s: {renderer.stats}")
         return True
     except Exception as e:
-        logger.error(f"Error processing recent orders: {e}")
-        traceback.print_exc()
+        logger.error(f"Error rendering gang sheet {key}: {str(e)}")
         return False
 
 def process_task(task, storage_client):
@@ -184,10 +232,11 @@ def process_task(task, storage_client):
         if file_keys:
             return process_batch_thumbnails_task(file_keys, storage_client)
     
-    elif task_type == 'recent_orders':
-        hours = task_data.get('hours', 24)
-        max_thumbnails = task_data.get('max_thumbnails', 20)
-        return process_recent_orders_task(hours, max_thumbnails, storage_client)
+    elif task_type == 'gang_sheet':
+        return process_gang_sheet_task(task_data, storage_client)
+
+    elif task_type == 'thumbnail_scan':
+        return process_thumbnail_scan_task()
     
     else:
         logger.warning(f"Unknown task type: {task_type}")
@@ -195,11 +244,21 @@ def process_task(task, storage_client):
     
     return False
 
+# Task types process_task knows; failures of anything else aren't retried
+TASK_HANDLERS = ('thumbnail', 'batch_thumbnails', 'gang_sheet', 'thumbnail_scan')
+
 def signal_handler(sig, frame):
-    """Handle shutdown signals gracefully"""
+    """Handle shutdown signals gracefully
+
+    An idle worker exits straight away; a busy one finishes its task first
+    (worker_manager drains workers this way when it scales down or stops).
+    """
     global exit_flag
-    logger.info(f"Received signal {sig}, shutting down worker...")
     exit_flag = True
+    if current_task is not None:
+        logger.info(f"Received signal {sig}, finishing task {current_task.id} before shutting down...")
+        return
+    logger.info(f"Received signal {sig}, shutting down worker...")
     sys.exit(0)
 
 def worker_main():
@@ -212,72 +271,104 @@ def worker_main():
     
     logger.info("Starting image processing worker")
     
-    # Main worker loop
-    while not exit_flag:
-        try:
-            # Check for task files
-            task_files = sorted(list(task_path.glob("task_*.json")))
-            
-            if task_files:
-                # Process the oldest task first
-                task_file = task_files[0]
-                
-                try:
-                    # Read task
-                    with open(task_file, 'r') as f:
-                        task_data = json.load(f)
-                    
-                    # Process task
-                    task = Task.from_dict(task_data)
-                    logger.info(f"Processing task: {task.task_type}")
-                    
-                    success = process_task(task, storage)
-                    
-                    if success:
-                        logger.info(f"Successfully processed task: {task.task_type}")
-                    else:
-                        logger.warning(f"Failed to process task: {task.task_type}")
-                    
-                    # Remove task file regardless of success to avoid permanent failures
-                    task_file.unlink()
-                
-                except Exception as e:
-                    logger.error(f"Error processing task file {task_file}: {e}")
-                    # Move to a failed folder to avoid endless reprocessing
-                    failed_dir = task_path / "failed"
-                    failed_dir.mkdir(exist_ok=True)
-                    
-                    try:
-                        task_file.rename(failed_dir / task_file.name)
-                    except Exception:
-                        # If rename fails, just delete
-                        task_file.unlink(missing_ok=True)
-            
-            # Check for recent orders periodically (every 5 minutes)
-            if time.time() % 300 < 5:  # Run approximately every 5 minutes
-                process_recent_orders_task(hours=24, max_thumbnails=20)
-            
-            # Sleep to avoid CPU spinning
-            time.sleep(1)
-            
-        except Exception as e:
-            logger.error(f"Error in worker main loop: {e}")
-            # Sleep a bit longer after an error
-            time.sleep(5)
+    try:
+        run_loop()
+    finally:
+        if thumbnail_pool is not None:
+            thumbnail_pool.shutdown(wait=False)
     
     logger.info("Worker process exiting")
 
-def add_task(task_type, data, priority=0):
-    """Add a task to the processing queue"""
-    task = Task(task_type, data, priority)
-    
-    # Save to a file in the task directory
-    task_path.mkdir(exist_ok=True)
-    task_file = task_path / f"task_{int(time.time() * 1000)}_{os.getpid()}.json"
-    
-    with open(task_file, 'w') as f:
-        json.dump(task.to_dict(), f)
-    
+def import_task_files(directory=task_path):
+    """Move tasks left as task_*.json files (the old queue format) into the task queue"""
+    task_files = sorted(directory.glob("task_*.json"))
+    if not task_files:
+        return 0
+    tasks = []
+    for task_file in task_files:
+        try:
+            with open(task_file, 'r') as f:
+                task = Task.from_dict(json.load(f))
+            if task.task_type in RETIRED_TASK_TYPES:
+                logger.info(f"Dropping retired {task.task_type} task file {task_file}")
+                continue
+            tasks.append((task.task_type, task.data, task.priority))
+        except Exception as e:
+            logger.error(f"Skipping unreadable task file {task_file}: {e}")
+    get_queue().enqueue_many(tasks)
+    for task_file in task_files:
+        task_file.unlink(missing_ok=True)
+    logger.info(f"Imported {len(tasks)} task files into the task queue")
+    return len(tasks)
+
+def run_task(queue, task):
+    """Run a leased task, then complete it or record the failure for a retry"""
+    global current_task
+    logger.info(f"Processing task: {task.task_type} (attempt {task.attempts})")
+    current_task = task
+    try:
+        with queue.keep_alive(task):
+            success = process_task(task, storage)
+    except Exception as e:
+        logger.error(f"Error processing task {task.id}: {e}")
+        traceback.print_exc()
+        queue.fail(task, str(e))
+        return False
+    finally:
+        current_task = None
+
+    if task.lease_lost.is_set():
+        # Another worker holds the task now; its outcome is theirs to record
+        logger.warning(f"Lease on task {task.id} was lost while it ran, not recording the result")
+        return success
+
+    if success:
+        logger.info(f"Successfully processed task: {task.task_type}")
+        queue.complete(task)
+    else:
+        logger.warning(f"Failed to process task: {task.task_type}")
+        queue.fail(task, "Task reported failure", retry=task.task_type in TASK_HANDLERS)
+    return success
+
+def run_loop():
+    """Lease tasks from the queue one at a time until the worker is asked to stop
+
+    When the queue is empty the worker blocks until worker_client signals a
+    new task (task_wakeup) or a delayed retry becomes due. Periodic work such
+    as the thumbnail scan arrives as tasks from worker_manager.
+    """
+    queue = get_queue()
+    listener = WakeListener()
+    import_task_files()
+    poll_seconds = Config.WORKER_IDLE_POLL_SECONDS if listener.available else FALLBACK_POLL_SECONDS
+
+    try:
+        # Main worker loop
+        while not exit_flag:
+            try:
+                task = queue.lease()
+                if task is not None:
+                    run_task(queue, task)
+                    continue
+
+                # Sleep until notified or something is due, without spinning
+                timeout = poll_seconds
+                due = queue.seconds_until_due()
+                if due is not None:
+                    timeout = min(timeout, due)
+                listener.wait(timeout)
+
+            except Exception as e:
+                logger.error(f"Error in worker main loop: {e}")
+                # Sleep a bit longer after an error
+                time.sleep(5)
+    finally:
+        listener.close()
+
+def add_task(task_type, data, priority=0, dedup_key=None):
+    """Add a task to the processing queue; see TaskQueue.enqueue_many for dedup_key"""
+    get_queue().enqueue(task_type, data, priority, dedup_key)
+    notify()
     return True
 
 if __name__ == "__main__":
@@ -10,16 +10,19 @@ import subprocess
 import threading
 import logging
 import time
-import json
-import queue
-from pathlib import Path
+
+from task_queue import get_queue
+from task_wakeup import notify
+from worker_manager import manager_running, read_status
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Set by worker_manager for its workers, which import the app (and so this module) for database access
+IN_WORKER = os.environ.get('IMAGE_WORKER') == '1'
+
 # Global variables
-task_queue = queue.Queue()
 worker_manager_process = None
 worker_thread = None
 worker_running = False
@@ -27,10 +30,16 @@ worker_running = False
 def ensure_worker_running():
     """Ensure that the worker process is running"""
     global worker_manager_process, worker_thread, worker_running
-    
+
+    if IN_WORKER:
+        return True  # Already supervised by the worker manager
+
     if worker_running and worker_manager_process and worker_manager_process.poll() is None:
         return True  # Worker is already running
-    
+
+    if manager_running():
+        return True  # Another process on the host started the manager
+
     try:
         # Start the worker manager process
         worker_manager_process = subprocess.Popen(
@@ -41,14 +50,13 @@ def ensure_worker_running():
             bufsize=1
         )
         
-        # Start a thread to monitor the output
-        if worker_thread is None:
-            worker_thread = threading.Thread(
-                target=monitor_process_output, 
-                args=(worker_manager_process, "[MANAGER] "),
-                daemon=True
-            )
-            worker_thread.start()
+        # Start a thread to monitor the output; a manager that finds another one running exits
+        worker_thread = threading.Thread(
+            target=monitor_process_output,
+            args=(worker_manager_process, "[MANAGER] "),
+            daemon=True
+        )
+        worker_thread.start()
         
         worker_running = True
         logger.info("Started worker manager process with PID %d", worker_manager_process.pid)
@@ -73,37 +81,26 @@ def monitor_process_output(process, prefix):
     
     logger.warning(f"Process monitoring thread exiting (return code: {process.returncode})")
 
-def add_task(task_type, data, priority=0):
-    """Add a task to the worker's processing queue"""
+def add_task(task_type, data, priority=0, dedup_key=None):
+    """Add a task to the worker's processing queue
+
+    Higher priorities are processed first. A task with the dedup_key of one
+    that is still queued or running, or finished moments ago, is merged into it.
+    """
+    return add_tasks([(task_type, data, priority, dedup_key)])
+
+def add_tasks(tasks):
+    """Add several (task_type, data, priority[, dedup_key]) tasks to the queue in one transaction"""
     try:
         # Ensure the worker is running
         if not ensure_worker_running():
             logger.error("Cannot add task, worker is not running")
             return False
-        
-        # Create task data
-        task = {
-            'type': task_type,
-            'data': data,
-            'priority': priority,
-            'timestamp': time.time()
-        }
-        
-        # Add task to the queue
-        # In a more sophisticated setup, this would use IPC, Redis, or another
-        # message queue to communicate with the worker process
-        task_queue.put(task)
-        
-        # For now, we'll use a simple file-based approach
-        # This is not ideal for production but works for our demo
-        task_path = Path("worker_tasks")
-        task_path.mkdir(exist_ok=True)
-        
-        # Write task to a file
-        task_file = task_path / f"task_{int(time.time() * 1000)}_{os.getpid()}.json"
-        with open(task_file, 'w') as f:
-            json.dump(task, f)
-        
+
+        # Durable queue shared with the worker processes (task_queue.py)
+        get_queue().enqueue_many(tasks)
+        # Wake idle workers now instead of at their next poll
+        notify()
         return True
     except Exception as e:
         logger.error(f"Error adding task to worker: {str(e)}")
@@ -111,18 +108,34 @@ def add_task(task_type, data, priority=0):
 
 def submit_thumbnail_task(file_key, priority=0):
     """Submit a task to generate a thumbnail for a specific file"""
-    return add_task('thumbnail', {'file_key': file_key}, priority)
+    return add_task('thumbnail', {'file_key': file_key}, priority, dedup_key=f"thumbnail:{file_key}")
 
 def submit_batch_thumbnails_task(file_keys, priority=0):
     """Submit a task to generate thumbnails for multiple files"""
     return add_task('batch_thumbnails', {'file_keys': file_keys}, priority)
 
-def submit_recent_orders_task(hours=24, max_thumbnails=20, priority=0):
-    """Submit a task to process thumbnails for recent orders"""
-    return add_task('recent_orders', {
-        'hours': hours,
-        'max_thumbnails': max_thumbnails
-    }, priority)
+def get_worker_status():
+    """Worker pool status written by worker_manager, with the current queue depth"""
+    status = read_status() or {}
+    status['manager_running'] = manager_running()
+    try:
+        status['queue'] = get_queue().stats()
+    except Exception as e:
+        logger.error(f"Error reading task queue stats: {str(e)}")
+    return status
 
 # Start the worker process when this module is imported
-ensure_worker_running()
\ No newline at end of file
+ensure_worker_running()
+
+def submit_gang_sheet_task(placements, key, roll_width, length, dpi=300, priority=0):
+    """Submit a task to render a gang sheet layout to storage under key
+
+    placements are dicts with file_key, x, y, width, height and rotated (inches).
+    """
+    return add_task('gang_sheet', {
+        'placements': placements,
+        'key': key,
+        'roll_width': roll_width,
+        'length': length,
+        'dpi': dpi
+    }, priority)
@@ -7,50 +7,105 @@ to database models for the worker process.
 import os
 import sys
 import logging
-from datetime import datetime, timedelta
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def get_recent_orders(hours=24):
+def get_derivatives_status(file_key):
     """
-    Get recent orders from the database.
-    This function is called by the worker to find images that need thumbnails.
+    Check the asset catalog for the preview sizes of file_key.
+    Returns True/False if the file is cataloged, or None if it is not
+    (in which case the caller has to check storage).
     """
     try:
-        # Import here to avoid circular imports
-        from app import app, db
-        from models import Order
-        
+        from app import app
+        import asset_catalog
+
+        with app.app_context():
+            return asset_catalog.derivatives_status(file_key)
+    except Exception as e:
+        logger.error(f"Error reading asset catalog for {file_key}: {str(e)}")
+        return None
+
+
+def get_derivatives_statuses(file_keys):
+    """
+    Check the asset catalog for the preview sizes of several files with one query.
+    Returns {file_key: True/False} for cataloged files; files that are not
+    cataloged are left out.
+    """
+    try:
+        from app import app
+        import asset_catalog
+        from utils import derivative_names
+
+        with app.app_context():
+            assets = asset_catalog.get_assets(file_keys)
+            names = derivative_names()
+            return {file_key: asset.has_derivatives(names)
+                    for file_key, asset in assets.items()}
+    except Exception as e:
+        logger.error(f"Error reading asset catalog: {str(e)}")
+        return {}
+
+
+def get_unanalyzed(file_keys):
+    """Return the cataloged files among file_keys that have no alpha analysis yet"""
+    try:
+        from app import app
+        import asset_catalog
+
+        with app.app_context():
+            return asset_catalog.unanalyzed(file_keys)
+    except Exception as e:
+        logger.error(f"Error reading asset catalog: {str(e)}")
+        return set()
+
+
+def record_analysis(file_key, analysis):
+    """Store the alpha analysis computed by the worker in the asset catalog"""
+    try:
+        from app import app
+        import asset_catalog
+
+        with app.app_context():
+            return asset_catalog.record_analysis(file_key, analysis) is not None
+    except Exception as e:
+        logger.error(f"Error recording analysis for {file_key}: {str(e)}")
+        return False
+
+
+def record_derivatives(file_key, derivatives):
+    """Record previews written by the worker in the asset catalog
+
+    derivatives maps derivative name -> (storage key, size in bytes or None).
+    """
+    try:
+        from app import app
+        import asset_catalog
+
+        with app.app_context():
+            asset_catalog.record_derivatives(file_key, derivatives)
+            return True
+    except Exception as e:
+        logger.error(f"Error recording derivatives for {file_key}: {str(e)}")
+        return False
+
+
+def scan_missing_derivatives():
+    """Run the incremental thumbnail scan (thumbnail_scanner)
+
+    Returns (items scanned, items found missing, file keys to queue), or
+    None if the scan failed.
+    """
+    try:
+        from app import app
+        import thumbnail_scanner
+
         with app.app_context():
-            recent_orders = Order.query.filter(
-                Order.created_at >= datetime.now() - timedelta(hours=hours)
-            ).order_by(Order.created_at.desc()).all()
-            
-            # Convert to simple dictionaries to avoid SQLAlchemy session issues
-            result = []
-            for order in recent_orders:
-                order_dict = {
-                    'id': order.id,
-                    'order_number': order.order_number,
-                    'created_at': order.created_at.isoformat() if order.created_at else None,
-                    'items': []
-                }
-                
-                for item in order.items:
-                    item_dict = {
-                        'id': item.id,
-                        'file_key': item.file_key,
-                        'width_inches': item.width_inches,
-                        'height_inches': item.height_inches,
-                        'quantity': item.quantity
-                    }
-                    order_dict['items'].append(item_dict)
-                
-                result.append(order_dict)
-            
-            return result
+            scanned, missing = thumbnail_scanner.scan()
+            return scanned, missing, thumbnail_scanner.due()
     except Exception as e:
-        logger.error(f"Error getting recent orders: {str(e)}")
-        return []
\ No newline at end of file
+        logger.error(f"Error scanning for missing thumbnails: {str(e)}")
+        return None
@@ -1,51 +1,79 @@
 """
 Worker process manager for image processing.
-This script starts and monitors the image processing worker.
-It automatically restarts the worker if it crashes or exits unexpectedly.
+This script runs a pool of image processing workers (worker.py) and keeps it
+sized to the task queue: between WORKER_POOL_MIN and WORKER_POOL_MAX
+processes, one per WORKER_SCALE_TASKS_PER_WORKER queued tasks, plus one more
+while the oldest ready task has waited WORKER_SCALE_UP_AGE seconds. Idle
+workers are stopped one at a time when the queue shrinks.
+
+A worker that crashes is restarted after an exponential backoff, which is
+reset once a worker has stayed up for WORKER_STABLE_SECONDS. On SIGTERM the
+workers are asked to stop, finish the task they are running and exit; any
+still running after WORKER_DRAIN_SECONDS are killed.
+
+The pool size, busy and idle workers, restarts and queue depth are logged
+and written to WORKER_STATUS_PATH as JSON.
+
+Only one manager runs per host: it holds an flock on a pidfile next to the
+task queue, and a second manager (every web process starts one through
+worker_client) exits when it finds the lock taken.
+
+The manager is also the one place periodic work is scheduled from: every
+THUMBNAIL_SCAN_INTERVAL seconds it queues a thumbnail_scan task
+(thumbnail_scanner) for the pool.
 """
 
 import os
 import sys
+import json
+import math
+import socket
+import sqlite3
 import subprocess
 import threading
 import time
 import logging
 import signal
 
+try:
+    import fcntl
+except ImportError:  # Windows: no host-wide lock, every manager runs
+    fcntl = None
+
+from config import Config
+from task_queue import get_queue
+from task_wakeup import notify
+
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+POLL_SECONDS = 2  # How often the pool is checked
+STATUS_LOG_SECONDS = 60  # How often the status is logged when nothing changes
+
 # Global variables
-worker_process = None
 exit_flag = False
-restart_count = 0
-max_restarts = 5  # Max restarts per hour
-restart_timer = None
-
-def restart_count_monitor():
-    """Reset restart count after an hour to prevent endless restarts"""
-    global restart_count
-    restart_count = 0
-    logger.info("Reset worker restart count")
+manager_lock = None  # Open pidfile holding the lock while this process is the manager
 
 def signal_handler(sig, frame):
-    """Handle shutdown signals gracefully"""
-    global exit_flag, worker_process
+    """Handle shutdown signals gracefully; the main loop drains the pool"""
+    global exit_flag
     logger.info(f"Received signal {sig}, shutting down worker manager...")
     exit_flag = True
-    
-    if worker_process:
-        try:
-            worker_process.terminate()
-            # Give it a moment to shut down gracefully
-            time.sleep(1)
-            if worker_process.poll() is None:
-                worker_process.kill()
-        except Exception as e:
-            logger.error(f"Error terminating worker process: {str(e)}")
-    
-    sys.exit(0)
+
+def worker_env():
+    """Environment for worker processes
+
+    Each worker runs its own preview pool (WORKER_PROCESSES), so unless it is
+    set explicitly the CPUs are shared out among the largest worker pool.
+    IMAGE_WORKER marks the process as a worker for worker_client.
+    """
+    env = os.environ.copy()
+    env['IMAGE_WORKER'] = '1'  # Keeps worker_client from starting another manager inside the worker
+    if 'WORKER_PROCESSES' not in env:
+        cpus = Config.WORKER_PROCESSES or os.cpu_count() or 1
+        env['WORKER_PROCESSES'] = str(max(1, cpus // max(1, Config.WORKER_POOL_MAX)))
+    return env
 
 def start_worker():
     """Start the worker process and return subprocess handle"""
@@ -56,9 +84,10 @@ def start_worker():
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
             text=True,
-            bufsize=1
+            bufsize=1,
+            env=worker_env()
         )
-        
+
         logger.info(f"Started worker process with PID {process.pid}")
         return process
     except Exception as e:
@@ -66,72 +95,295 @@ def start_worker():
         return None
 
 def monitor_worker_output(process):
-    """Monitor and log output from the worker process"""
-    while process and not exit_flag:
+    """Monitor and log output from the worker process until it exits"""
+    while process:
         try:
             line = process.stdout.readline()
             if not line and process.poll() is not None:
                 break
-                
+
             if line:
-                logger.info(f"[WORKER] {line.rstrip()}")
+                logger.info(f"[WORKER {process.pid}] {line.rstrip()}")
         except Exception as e:
             logger.error(f"Error reading worker output: {str(e)}")
             break
 
-def check_worker(process):
-    """Check if worker process is still running, return True if alive"""
-    if process is None:
+class WorkerProcess:
+    """A worker subprocess in the pool"""
+
+    def __init__(self, process):
+        self.process = process
+        self.pid = process.pid
+        self.owner = f"{socket.gethostname()}:{process.pid}"  # Its name on task leases
+        self.started_at = time.time()
+        self.busy = False  # Holds a task lease
+        self.stopping = False  # Sent SIGTERM; exits after its current task
+
+    def stop(self):
+        if not self.stopping:
+            self.stopping = True
+            try:
+                self.process.terminate()
+            except OSError as e:
+                logger.error(f"Error terminating worker process {self.pid}: {str(e)}")
+
+class WorkerPool:
+    """Keeps the number of worker processes in line with the task queue"""
+
+    def __init__(self, queue=None, min_workers=None, max_workers=None):
+        self.queue = queue or get_queue()
+        self.min_workers = Config.WORKER_POOL_MIN if min_workers is None else min_workers
+        self.max_workers = max(self.min_workers, Config.WORKER_POOL_MAX if max_workers is None else max_workers)
+        self.workers = []
+        self.desired = self.min_workers
+        self.queue_stats = {}
+        self.restarts = 0  # Workers restarted after crashing
+        self.crashes = 0  # Crashes in a row, sets the restart backoff
+        self.restart_at = 0.0  # No worker is started before this after a crash
+        self.last_resize = time.time()
+
+    @property
+    def running(self):
+        return [w for w in self.workers if not w.stopping]
+
+    def tick(self):
+        """Reap exited workers, then start or stop workers to match the queue"""
+        now = time.time()
+        self._reap(now)
+        self._refresh()
+        self.desired = self._desired_size()
+        running = self.running
+
+        if len(running) <= self.desired:
+            # Shrinking waits until the pool has been too large for a while
+            self.last_resize = now
+            if len(running) < self.desired and now >= self.restart_at:
+                for _ in range(self.desired - len(running)):
+                    self._start()
+        elif now - self.last_resize >= Config.WORKER_SCALE_DOWN_DELAY:
+            idle = [w for w in running if not w.busy]
+            if idle:
+                worker = max(idle, key=lambda w: w.started_at)
+                logger.info(f"Stopping idle worker {worker.pid}, pool shrinking to {len(running) - 1}")
+                worker.stop()
+                self.last_resize = now
+
+    def _desired_size(self):
+        """Workers wanted for the current queue depth, within the pool limits"""
+        stats = self.queue_stats
+        tasks = stats.get('ready', 0) + stats.get('leased', 0)
+        desired = math.ceil(tasks / max(1, Config.WORKER_SCALE_TASKS_PER_WORKER))
+        if stats.get('oldest_ready_seconds', 0) >= Config.WORKER_SCALE_UP_AGE:
+            # Tasks are waiting too long for the workers there are
+            desired = max(desired, len(self.running) + 1)
+        return min(max(desired, self.min_workers), self.max_workers)
+
+    def _refresh(self):
+        """Read the queue depth and which workers hold a task"""
+        try:
+            self.queue_stats = self.queue.stats()
+            owners = self.queue.leases_by_owner()
+        except sqlite3.Error as e:
+            logger.error(f"Error reading the task queue: {str(e)}")
+            return
+        for worker in self.workers:
+            worker.busy = owners.get(worker.owner, 0) > 0
+
+    def _start(self):
+        process = start_worker()
+        if process is None:
+            self._crashed(time.time(), 0)
+            return
+        self.workers.append(WorkerProcess(process))
+        threading.Thread(target=monitor_worker_output, args=(process,), daemon=True).start()
+
+    def _reap(self, now):
+        for worker in list(self.workers):
+            exit_code = worker.process.poll()
+            if exit_code is None:
+                continue
+            self.workers.remove(worker)
+            if worker.stopping:
+                logger.info(f"Worker process {worker.pid} stopped (exit code: {exit_code})")
+                continue
+            logger.warning(f"Worker process {worker.pid} exited unexpectedly (exit code: {exit_code})")
+            self._crashed(now, now - worker.started_at)
+
+    def _crashed(self, now, uptime):
+        if uptime >= Config.WORKER_STABLE_SECONDS:
+            self.crashes = 0  # It had been running fine
+        self.crashes += 1
+        self.restarts += 1
+        delay = min(Config.WORKER_RESTART_BASE_DELAY * 2 ** (self.crashes - 1), Config.WORKER_RESTART_MAX_DELAY)
+        self.restart_at = max(self.restart_at, now + delay)
+        logger.warning(f"Restarting worker in {delay:.0f}s ({self.crashes} crashes in a row)")
+
+    def drain(self, timeout=None):
+        """Stop every worker, letting running tasks finish; kill those left after timeout seconds"""
+        timeout = Config.WORKER_DRAIN_SECONDS if timeout is None else timeout
+        for worker in self.workers:
+            worker.stop()
+        deadline = time.time() + timeout
+        while self.workers and time.time() < deadline:
+            self._reap(time.time())
+            time.sleep(0.2)
+        for worker in self.workers:
+            logger.warning(f"Worker process {worker.pid} did not stop within {timeout:.0f}s, killing it")
+            try:
+                worker.process.kill()
+                worker.process.wait(5)
+            except (OSError, subprocess.TimeoutExpired) as e:
+                logger.error(f"Error killing worker process {worker.pid}: {str(e)}")
+        self.workers = []
+
+    def status(self):
+        """Pool size, busy and idle workers, restarts and queue depth"""
+        now = time.time()
+        running = self.running
+        busy = sum(1 for w in running if w.busy)
+        return {
+            'updated_at': now,
+            'manager_pid': os.getpid(),
+            'size': len(running),
+            'desired': self.desired,
+            'min': self.min_workers,
+            'max': self.max_workers,
+            'busy': busy,
+            'idle': len(running) - busy,
+            'stopping': len(self.workers) - len(running),
+            'restarts': self.restarts,
+            'crashes_in_a_row': self.crashes,
+            'restart_in': round(max(self.restart_at - now, 0.0), 1),
+            'workers': [{'pid': w.pid, 'uptime': round(now - w.started_at), 'busy': w.busy, 'stopping': w.stopping}
+                        for w in self.workers],
+            'queue': self.queue_stats,
+        }
+
+def write_status(status, path=None):
+    """Write the pool status to a JSON file for the app to read"""
+    path = path or Config.WORKER_STATUS_PATH
+    try:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(status, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.error(f"Error writing worker status: {str(e)}")
+
+def read_status(path=None):
+    """The status last written by the worker manager, or None"""
+    try:
+        with open(path or Config.WORKER_STATUS_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def manager_lock_path():
+    """Pidfile locked by the running manager, next to the task queue it serves"""
+    return os.path.join(os.path.dirname(Config.TASK_QUEUE_PATH) or '.', 'worker_manager.pid')
+
+def acquire_manager_lock():
+    """Become the host's worker manager; returns False if another process is"""
+    global manager_lock
+    if fcntl is None:
+        return True
+    path = manager_lock_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    lock_file = open(path, 'a+')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(f"{os.getpid()}\n")
+    lock_file.flush()
+    # Held until this process exits; Popen doesn't pass the descriptor to workers
+    manager_lock = lock_file
+    return True
+
+def manager_running():
+    """True if a worker manager holds the lock on this host"""
+    if fcntl is None:
         return False
-    
-    return process.poll() is None
+    try:
+        with open(manager_lock_path()) as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except OSError:
+                return True
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            return False
+    except OSError:
+        return False  # No pidfile yet
+
+def manager_pid():
+    """PID written to the pidfile by the last manager, or None"""
+    try:
+        with open(manager_lock_path()) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+def schedule_thumbnail_scan(queue):
+    """Queue the incremental thumbnail scan; merged into one that is already queued"""
+    try:
+        # Behind thumbnails someone is waiting for
+        queue.enqueue('thumbnail_scan', {}, priority=-1, dedup_key='thumbnail_scan')
+        notify()
+    except sqlite3.Error as e:
+        logger.error(f"Error scheduling the thumbnail scan: {str(e)}")
+
+def log_status(status):
+    logger.info(f"Worker pool: {status['size']} running ({status['busy']} busy, {status['idle']} idle, "
+                f"{status['stopping']} stopping), {status['restarts']} restarts; "
+                f"queue: {status['queue'].get('ready', 0)} ready, "
+                f"oldest {status['queue'].get('oldest_ready_seconds', 0)}s, "
+                f"{status['queue'].get('merged', 0)} duplicates merged")
 
 def main():
     """Main function for the worker manager"""
-    global worker_process, restart_count, restart_timer, exit_flag
-    
     # Set up signal handlers
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
-    
+
+    if not acquire_manager_lock():
+        logger.info(f"Worker manager already running (PID {manager_pid()}), exiting")
+        return
+
     logger.info("Starting image processing worker manager")
-    
-    # Start the restart count monitor
-    restart_timer = threading.Timer(3600, restart_count_monitor)
-    restart_timer.daemon = True
-    restart_timer.start()
-    
+    pool = WorkerPool()
+    logger.info(f"Worker pool of {pool.min_workers} to {pool.max_workers} processes")
+
+    last_logged = None
+    last_log_time = 0
+    next_scan = time.time()
     while not exit_flag:
-        # Start worker if not running
-        if worker_process is None or worker_process.poll() is not None:
-            if worker_process is not None:
-                # Worker exited
-                exit_code = worker_process.poll()
-                logger.warning(f"Worker process not running (exit code: {exit_code}), restarting...")
-                
-                # Increment restart count and check if we've restarted too many times
-                restart_count += 1
-                if restart_count > max_restarts:
-                    logger.error(f"Too many worker restarts ({restart_count}), waiting for one hour")
-                    time.sleep(3600)  # Wait an hour before trying again
-                    restart_count = 0
-            
-            # Start a new worker process
-            worker_process = start_worker()
-            
-            if worker_process:
-                # Start output monitoring thread
-                monitor_thread = threading.Thread(
-                    target=monitor_worker_output,
-                    args=(worker_process,),
-                    daemon=True
-                )
-                monitor_thread.start()
-        
+        if Config.THUMBNAIL_SCAN_INTERVAL and time.time() >= next_scan:
+            schedule_thumbnail_scan(pool.queue)
+            next_scan = time.time() + Config.THUMBNAIL_SCAN_INTERVAL
+
+        pool.tick()
+        status = pool.status()
+        write_status(status)
+        summary = (status['size'], status['busy'], status['stopping'], status['restarts'])
+        if summary != last_logged or time.time() - last_log_time >= STATUS_LOG_SECONDS:
+            log_status(status)
+            last_logged, last_log_time = summary, time.time()
+
         # Sleep a bit to avoid CPU spinning
-        time.sleep(3)
-    
+        time.sleep(POLL_SECONDS)
+
+    logger.info(f"Draining {len(pool.workers)} workers")
+    pool.drain()
+    status = pool.status()
+    write_status(status)
+    log_status(status)
     logger.info("Worker manager exiting")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,88 @@
+"""
+Streaming ZIP archives of files in object storage.
+The archive is sent to the client while it is being built: each file is
+copied into the ZIP in chunks, and the next few files are fetched in the
+background (ObjectStorage.open_many) while the current one streams. Files are stored without
+recompression because PNGs are already compressed. Memory use is bounded by
+the chunk size, whatever the size of the order; prefetched files wait in
+temporary files on disk.
+"""
+
+import io
+import time
+import logging
+import zipfile
+
+from storage import get_reader_size
+from storage_backends import CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class _ChunkSink(io.RawIOBase):
+    """Unseekable output for ZipFile that collects written bytes until drained"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(storage, entries, prefetch=3, chunk_size=CHUNK_SIZE):
+    """Yield a ZIP archive of storage files chunk by chunk
+
+    Args:
+        storage: ObjectStorage to read the files from
+        entries: List of (file_key, name in archive) tuples
+        prefetch: Number of files fetched concurrently ahead of the one being written
+        chunk_size: Read size when copying file data into the archive
+
+    Files that cannot be fetched are logged and left out of the archive.
+    """
+    entries = list(entries)
+    arcnames = [arcname for _, arcname in entries]
+    sink = _ChunkSink()
+    fetched = storage.open_many([file_key for file_key, _ in entries], max_concurrency=prefetch)
+
+    try:
+        with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as zf:
+            for arcname, (file_key, source, error) in zip(arcnames, fetched):
+                if source is None:
+                    logger.error(f"Error adding {file_key} to zip: {error}")
+                    continue
+
+                with source:
+                    zinfo = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+                    zinfo.compress_type = zipfile.ZIP_STORED
+                    zinfo.file_size = get_reader_size(source)
+                    with zf.open(zinfo, 'w') as dest:
+                        while True:
+                            chunk = source.read(chunk_size)
+                            if not chunk:
+                                break
+                            dest.write(chunk)
+                            yield from _drain(sink)
+                yield from _drain(sink)
+
+        # Central directory written when the ZipFile closes
+        yield from _drain(sink)
+    finally:
+        # Client may have disconnected: stop prefetching and drop fetched files
+        fetched.close()
+
+
+def _drain(sink):
+    """Yield whatever the ZIP writer has produced since the last drain"""
+    data = sink.drain()
+    if data:
+        yield data